@@ -0,0 +1,31 @@
+import importlib
+
+
+# submodules load on first attribute access (databook_utils.catalog_utils), so that
+# importing the package does not import every backend
+__all__ = [
+    "cache_utils",
+    "catalog_utils",
+    "cred_assign_utils",
+    "dandi_utils",
+    "fetch_utils",
+    "glm_utils",
+    "lfp_utils",
+    "metadata_utils",
+    "movie_utils",
+    "opto_utils",
+    "pyramid_utils",
+    "rf_utils",
+    "sdf_utils",
+    "spike_utils",
+    "stim_utils",
+    "stream_utils",
+    "subset_utils",
+    "units_utils",
+]
+
+
+def __getattr__(name: str):
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
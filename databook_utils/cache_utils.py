@@ -0,0 +1,293 @@
+import json
+import os
+import re
+import shutil
+import time
+
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# matches the asset id in DANDI API download URLs, e.g. .../api/assets/<asset_id>/download/
+_ASSET_URL_PATTERN = re.compile(r"/assets/([0-9a-fA-F-]{36})/download")
+
+_META_FILENAME = "meta.json"
+_ACCESS_FILENAME = ".last_access"
+_STAGING_DIRNAME = ".staging"
+
+
+def _path_size(path: Union[str, Path]) -> int:
+    """Return the size in bytes of a file, or of all files under a directory."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            total += os.path.getsize(os.path.join(root, filename))
+    return total
+
+
+def _try_lock_file(fp) -> bool:
+    """Take an exclusive lock on an open file without waiting, returning whether it was taken."""
+    try:
+        if fcntl is not None:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            fp.seek(0)
+            msvcrt.locking(fp.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def _unlock_file(fp) -> None:
+    if fcntl is not None:
+        fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+    else:
+        fp.seek(0)
+        msvcrt.locking(fp.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _remove_path(path: Union[str, Path]) -> None:
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+class AssetCache:
+    """
+    Shared, content-addressed cache of downloaded DANDI assets.
+
+    Each asset is stored once under cache_dir/<asset_id>/, where the DANDI
+    asset id changes whenever the asset's content changes, so the same
+    sub-*/ses-*.nwb file is shared by every notebook and dandiset version that
+    refers to it. Downloads are staged in a private directory and renamed into
+    place once complete, so readers never see a partial file. Notebooks that
+    share a cache hold a per-asset lock (see lock) while they download and
+    publish an asset, so each asset is downloaded once. When the total size of
+    the cache exceeds max_bytes, the least recently used entries that no
+    process holds the lock of are evicted.
+
+    Parameters
+    ----------
+    cache_dir : str or Path, optional
+        Root directory of the cache. Defaults to the DATABOOK_CACHE_DIR
+        environment variable, the scratch directory on Code Ocean, or
+        ~/.cache/openscope_databook.
+    max_bytes : int, optional
+        Byte budget of the cache. Defaults to the DATABOOK_CACHE_MAX_BYTES
+        environment variable, or no limit if not set.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path] = None, max_bytes: int = None):
+        if cache_dir is None:
+            cache_dir = os.environ.get("DATABOOK_CACHE_DIR")
+        if cache_dir is None:
+            if "codeocean" in os.environ.get("GIT_ASKPASS", ""):
+                cache_dir = "../../scratch/databook_cache"
+            else:
+                cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "openscope_databook")
+        if max_bytes is None and "DATABOOK_CACHE_MAX_BYTES" in os.environ:
+            max_bytes = int(os.environ["DATABOOK_CACHE_MAX_BYTES"])
+
+        self.cache_dir = str(cache_dir)
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(self.cache_dir, _STAGING_DIRNAME), exist_ok=True)
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _read_meta(self, key: str) -> Union[dict, None]:
+        try:
+            with open(os.path.join(self._entry_dir(key), _META_FILENAME), "r") as fp:
+                return json.load(fp)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _touch(self, key: str) -> None:
+        access_path = os.path.join(self._entry_dir(key), _ACCESS_FILENAME)
+        with open(access_path, "a"):
+            pass
+        os.utime(access_path, None)
+
+    def get(self, key: str) -> Union[str, None]:
+        """Return the local path of a cached asset and mark it as recently used, or None."""
+        meta = self._read_meta(key)
+        if meta is None:
+            return None
+        path = os.path.join(self._entry_dir(key), meta["filename"])
+        if not os.path.exists(path):
+            return None
+        self._touch(key)
+        return path
+
+    def resolve(self, path_or_url: Union[str, Path]) -> Union[str, None]:
+        """
+        Return the cached local copy of an asset given its DANDI URL, or None.
+
+        Both DANDI API download URLs, which contain the asset id, and any
+        other URL recorded when the asset was published are recognized.
+        When only subsets of the asset are cached (see
+        dandi_utils.dandi_subset_download_open), the most recently used one
+        is returned instead.
+        """
+        path_or_url = str(path_or_url)
+        match = _ASSET_URL_PATTERN.search(path_or_url)
+        if match is not None:
+            path = self.get(match.group(1))
+            if path is not None:
+                return path
+            entries = [entry for entry in self.entries() if entry.get("asset_id") == match.group(1)]
+        elif path_or_url.startswith(("http://", "https://")):
+            entries = [entry for entry in self.entries() if path_or_url in entry.get("urls", [])]
+        else:
+            return None
+
+        # full copies first, then subsets from most to least recently used
+        entries.sort(key=lambda entry: ("include" not in entry, entry["last_access"]), reverse=True)
+        for entry in entries:
+            path = self.get(entry["key"])
+            if path is not None:
+                return path
+        return None
+
+    @contextmanager
+    def lock(self, key: str, poll_interval: float = 0.5) -> Iterator[None]:
+        """
+        Hold an exclusive lock on a key, across processes, e.g. while downloading and publishing it.
+
+        Waits for any other process or thread holding the lock. The lock is
+        not reentrant, and lock files are left in the staging area, since
+        deleting one while another process waits on it would break the lock.
+        """
+        with open(self._lock_path(key), "a+b") as fp:
+            while not _try_lock_file(fp):
+                time.sleep(poll_interval)
+            try:
+                yield
+            finally:
+                _unlock_file(fp)
+
+    def _lock_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, _STAGING_DIRNAME, f"{key}.lock")
+
+    def staging_path(self, key: str, filename: str) -> str:
+        """
+        Return the private path where an asset should be downloaded before publish.
+
+        The path is stable for a given key, so an interrupted download can be
+        resumed by a later call.
+        """
+        staging_dir = os.path.join(self.cache_dir, _STAGING_DIRNAME, key)
+        os.makedirs(staging_dir, exist_ok=True)
+        return os.path.join(staging_dir, filename)
+
+    def publish(self, key: str, staged_path: Union[str, Path], metadata: dict = None) -> str:
+        """
+        Atomically move a completed download into the cache and return its final path.
+
+        The whole staging directory, including sidecar files such as the
+        download manifest, is renamed into place. If another process already
+        published the key, its entry is kept and the staged copy discarded.
+        Least recently used entries are then evicted to bring the cache under
+        its budget. Call it while holding lock(key).
+        """
+        staged_path = str(staged_path)
+        staging_dir, filename = os.path.split(staged_path)
+        entry_dir = self._entry_dir(key)
+
+        cached_path = self.get(key)
+        if cached_path is not None:
+            _remove_path(staging_dir)
+            return cached_path
+
+        meta = dict(metadata or {})
+        meta.update({"key": key, "filename": filename, "size": _path_size(staged_path)})
+        with open(os.path.join(staging_dir, _META_FILENAME), "w") as fp:
+            json.dump(meta, fp)
+
+        # the staging directory becomes the entry in a single rename; an entry without
+        # metadata is what is left of one being removed, so it is cleared first
+        _remove_path(entry_dir)
+        os.replace(staging_dir, entry_dir)
+        self._touch(key)
+
+        self.evict(keep=[key])
+        return os.path.join(entry_dir, filename)
+
+    def remove(self, key: str) -> None:
+        """Delete a cached asset along with any staged partial download of it."""
+        _remove_path(self._entry_dir(key))
+        _remove_path(os.path.join(self.cache_dir, _STAGING_DIRNAME, key))
+
+    def entries(self) -> list:
+        """Return the metadata of every cached asset, with its size and last access time."""
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            if key == _STAGING_DIRNAME:
+                continue
+            meta = self._read_meta(key)
+            if meta is None:
+                continue
+            access_path = os.path.join(self._entry_dir(key), _ACCESS_FILENAME)
+            meta["last_access"] = os.path.getmtime(access_path) if os.path.exists(access_path) else 0
+            entries.append(meta)
+        return entries
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(entry["size"] for entry in self.entries())
+
+    def evict(self, extra_bytes: int = 0, keep: list = ()) -> list:
+        """
+        Evict least recently used assets until the cache fits in its budget.
+
+        Parameters
+        ----------
+        extra_bytes : int, optional
+            Additional space to free, e.g. for an asset about to be downloaded.
+        keep : list of str, optional
+            Keys that must not be evicted.
+
+        Returns
+        -------
+        list of str
+            Keys of the evicted assets.
+        """
+        if self.max_bytes is None:
+            return []
+
+        entries = sorted(self.entries(), key=lambda entry: entry["last_access"])
+        total = sum(entry["size"] for entry in entries) + extra_bytes
+        evicted = []
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry["key"] in keep:
+                continue
+            # entries locked by another download are skipped rather than waited for
+            with open(self._lock_path(entry["key"]), "a+b") as fp:
+                if not _try_lock_file(fp):
+                    continue
+                try:
+                    self.remove(entry["key"])
+                finally:
+                    _unlock_file(fp)
+            total -= entry["size"]
+            evicted.append(entry["key"])
+        return evicted
+
+
+# returns an AssetCache configured from the environment if DATABOOK_CACHE_DIR is set, otherwise None
+def get_default_cache() -> Union[AssetCache, None]:
+    if os.environ.get("DATABOOK_CACHE_DIR"):
+        return AssetCache()
+    return None
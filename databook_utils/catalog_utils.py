@@ -0,0 +1,292 @@
+import ast
+import glob
+import re
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from pathlib import Path
+from typing import Iterable, Union
+
+
+# the data/ directory of the databook repository, where the *_sessions.csv catalogs live
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
+# normalized column name -> dtype ("list" columns hold lists of strings)
+CATALOG_SCHEMA = {
+    "project": "string",
+    "identifier": "string",
+    "size": "Int64",
+    "path": "string",
+    "session_time": "datetime64[ns, UTC]",
+    "session_length": "Float64",
+    "sub_name": "string",
+    "session_id": "string",
+    "sex": "string",
+    "age_days": "Float64",
+    "genotype": "string",
+    "sub_group": "string",
+    "probes": "list",
+    "stim_types": "list",
+    "n_units": "Int64",
+    "n_rois": "Int64",
+    "experiment_id": "Int64",
+    "container_id": "Int64",
+    "group": "Int64",
+    "group_count": "Int64",
+    "imaging_depth": "Int64",
+    "location": "string",
+    "fov_height": "Int64",
+    "fov_width": "Int64",
+}
+LIST_COLUMNS = tuple(name for name, dtype in CATALOG_SCHEMA.items() if dtype == "list")
+
+# the different names that projects use for the same catalog column
+_COLUMN_ALIASES = {
+    "#_units": "n_units",
+    "#_rois": "n_rois",
+    "sub_sex": "sex",
+    "sub_age": "age_days",
+    "age": "age_days",
+    "sub_genotype": "genotype",
+    "specimen_name": "sub_name",
+    "stim types": "stim_types",
+    "session_end": "session_length",
+}
+
+
+def _parse_list(value) -> list:
+    """Parse a set literal such as "{'probeA', 'probeB'}" (or a bare name) into a sorted list."""
+    if isinstance(value, (list, set, tuple)):
+        return sorted(value)
+    if value is None or (isinstance(value, float) and np.isnan(value)) or value == "":
+        return []
+    value = str(value).strip()
+    if value.startswith(("{", "[", "(")):
+        return sorted(ast.literal_eval(value))
+    return [value]
+
+
+def _parse_age_days(value) -> float:
+    """Parse ages such as 124.0, "P162.0D" or "P185D" into a number of days."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return np.nan
+    match = re.fullmatch(r"P?([0-9.]+)D?", str(value).strip())
+    return float(match.group(1)) if match else np.nan
+
+
+def normalize_session_catalog(catalog: pd.DataFrame, project: str = None) -> pd.DataFrame:
+    """
+    Convert a raw session catalog to the shared CATALOG_SCHEMA.
+
+    Unnamed index columns are dropped, project-specific column names are
+    mapped to their common name, set literals become lists, ages become
+    numbers of days and session times are converted to UTC. Columns a
+    project does not have are filled with missing values.
+    """
+    catalog = catalog.loc[:, ~catalog.columns.str.startswith("Unnamed")]
+    # a project with both names keeps its own sub_name
+    if "sub_name" in catalog and "specimen_name" in catalog:
+        catalog = catalog.drop(columns="specimen_name")
+    catalog = catalog.rename(columns=_COLUMN_ALIASES)
+
+    normalized = pd.DataFrame(index=range(len(catalog)))
+    for name, dtype in CATALOG_SCHEMA.items():
+        if name == "project":
+            column = pd.Series([project] * len(catalog))
+        elif name in catalog:
+            column = catalog[name].reset_index(drop=True)
+        else:
+            column = pd.Series([None] * len(catalog))
+
+        if dtype == "list":
+            normalized[name] = column.map(_parse_list)
+        elif name == "age_days":
+            normalized[name] = column.map(_parse_age_days).astype(dtype)
+        elif name == "path":
+            normalized[name] = column.str.replace("\\", "/", regex=False).astype(dtype)
+        elif dtype.startswith("datetime"):
+            normalized[name] = pd.to_datetime(column, utc=True, format="ISO8601")
+        elif dtype == "string":
+            normalized[name] = column.map(lambda value: None if pd.isna(value) else str(value)).astype(dtype)
+        else:
+            normalized[name] = pd.to_numeric(column).astype(dtype)
+    return normalized
+
+
+def load_session_catalog(catalog_path: Union[str, Path], project: str = None) -> pd.DataFrame:
+    """
+    Read one of the data/*_sessions.csv catalogs into a DataFrame with the shared CATALOG_SCHEMA.
+
+    The project name defaults to the file name before "_sessions.csv".
+    """
+    if project is None:
+        project = Path(catalog_path).stem.removesuffix("_sessions")
+    return normalize_session_catalog(pd.read_csv(catalog_path), project=project)
+
+
+class SessionCatalog:
+    """
+    Typed, indexed catalog of the sessions of every project.
+
+    Every catalog is normalized to CATALOG_SCHEMA and concatenated into one
+    table. Inverted indexes from each probe and stimulus name to the rows
+    that contain it make queries across all projects a few array operations,
+    without re-parsing any strings. The catalog can be persisted as a
+    columnar HDF5 file with save() and reopened with load().
+
+    Parameters
+    ----------
+    sessions : DataFrame
+        Sessions in the CATALOG_SCHEMA layout
+    """
+
+    def __init__(self, sessions: pd.DataFrame):
+        self.sessions = sessions.reset_index(drop=True)
+        self._index = {column: self._build_index(self.sessions[column]) for column in LIST_COLUMNS}
+
+    @staticmethod
+    def _build_index(column: pd.Series) -> dict:
+        """Map each value of a list column to the sorted array of rows containing it."""
+        lengths = column.map(len).to_numpy()
+        rows = np.repeat(np.arange(len(column)), lengths)
+        values = np.array([value for values in column for value in values], dtype=object)
+        if len(values) == 0:
+            return {}
+        vocabulary, codes = np.unique(values, return_inverse=True)
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(vocabulary) + 1))
+        return {
+            value: rows[order[bounds[i]:bounds[i + 1]]]
+            for i, value in enumerate(vocabulary)
+        }
+
+    @classmethod
+    def from_csvs(cls, catalog_paths: Iterable[Union[str, Path]] = None) -> "SessionCatalog":
+        """Build a catalog from session CSVs, by default every data/*_sessions.csv."""
+        if catalog_paths is None:
+            catalog_paths = sorted(glob.glob(str(DATA_DIR / "*_sessions.csv")))
+        return cls(pd.concat([load_session_catalog(path) for path in catalog_paths], ignore_index=True))
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def values(self, column: str) -> list:
+        """Return the distinct values of a list column, e.g. every stimulus name."""
+        return sorted(self._index[column])
+
+    def _rows_with(self, column: str, values: Union[str, Iterable[str]], match_all: bool) -> np.ndarray:
+        if isinstance(values, str):
+            values = [values]
+        masks = []
+        for value in values:
+            mask = np.zeros(len(self), dtype=bool)
+            mask[self._index[column].get(value, [])] = True
+            masks.append(mask)
+        combine = np.logical_and if match_all else np.logical_or
+        return combine.reduce(masks) if masks else np.ones(len(self), dtype=bool)
+
+    def query(
+        self,
+        stim_types: Union[str, Iterable[str]] = None,
+        probes: Union[str, Iterable[str]] = None,
+        max_size: int = None,
+        min_size: int = None,
+        projects: Union[str, Iterable[str]] = None,
+        match_all: bool = True,
+        **equals,
+    ) -> pd.DataFrame:
+        """
+        Return the sessions matching every given criterion.
+
+        Parameters
+        ----------
+        stim_types : str or list of str, optional
+            Stimulus table names the session must have
+        probes : str or list of str, optional
+            Probe (device) names the session must have
+        max_size : int, optional
+            Largest file size in bytes
+        min_size : int, optional
+            Smallest file size in bytes
+        projects : str or list of str, optional
+            Projects to search, e.g. "vippo". All projects if not given.
+        match_all : bool, optional
+            If True, sessions must have all of the given stim_types and all
+            of the given probes; if False, any one of each is enough.
+        **equals
+            Other columns that must equal a value, e.g. sex="F"
+
+        Returns
+        -------
+        DataFrame
+            The matching rows of the catalog
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if stim_types is not None:
+            mask &= self._rows_with("stim_types", stim_types, match_all)
+        if probes is not None:
+            mask &= self._rows_with("probes", probes, match_all)
+        if max_size is not None:
+            mask &= (self.sessions["size"] <= max_size).fillna(False).to_numpy()
+        if min_size is not None:
+            mask &= (self.sessions["size"] >= min_size).fillna(False).to_numpy()
+        if projects is not None:
+            projects = [projects] if isinstance(projects, str) else list(projects)
+            mask &= self.sessions["project"].isin(projects).to_numpy()
+        for column, value in equals.items():
+            mask &= (self.sessions[column] == value).fillna(False).to_numpy()
+        return self.sessions[mask]
+
+    def save(self, path: Union[str, Path]) -> None:
+        """
+        Persist the catalog as a columnar HDF5 file.
+
+        Each column is stored as one dataset. List columns are stored as a
+        vocabulary, integer codes and row offsets, so they load without parsing.
+        """
+        with h5py.File(path, "w") as h5_file:
+            for name, dtype in CATALOG_SCHEMA.items():
+                column = self.sessions[name]
+                if dtype == "list":
+                    group = h5_file.create_group(name)
+                    values = [value for values in column for value in values]
+                    vocabulary, codes = np.unique(np.array(values, dtype=str), return_inverse=True)
+                    group["vocabulary"] = vocabulary.astype(object)
+                    group["codes"] = codes.astype(np.int32)
+                    group["offsets"] = np.concatenate([[0], np.cumsum(column.map(len))]).astype(np.int64)
+                elif dtype == "string":
+                    h5_file.create_dataset(name, data=column.fillna("").to_numpy(dtype=object), dtype=h5py.string_dtype())
+                    h5_file[name].attrs["missing"] = column.isna().to_numpy()
+                elif dtype.startswith("datetime"):
+                    h5_file[name] = column.to_numpy(dtype="datetime64[ns]").astype(np.int64)
+                    h5_file[name].attrs["missing"] = column.isna().to_numpy()
+                else:
+                    h5_file[name] = column.to_numpy(dtype=np.float64, na_value=np.nan)
+                h5_file[name].attrs["dtype"] = dtype
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "SessionCatalog":
+        """Load a catalog persisted with save()."""
+        columns = {}
+        with h5py.File(path, "r") as h5_file:
+            for name in CATALOG_SCHEMA:
+                node = h5_file[name]
+                dtype = node.attrs["dtype"]
+                if dtype == "list":
+                    vocabulary = node["vocabulary"].asstr()[:]
+                    values = vocabulary[node["codes"][:]]
+                    offsets = node["offsets"][:]
+                    columns[name] = [list(values[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1)]
+                elif dtype == "string":
+                    column = pd.Series(node.asstr()[:], dtype=dtype)
+                    column[node.attrs["missing"]] = pd.NA
+                    columns[name] = column
+                elif dtype.startswith("datetime"):
+                    column = pd.Series(pd.to_datetime(node[:], utc=True))
+                    column[node.attrs["missing"]] = pd.NaT
+                    columns[name] = column
+                else:
+                    columns[name] = pd.Series(node[:]).astype(dtype)
+        return cls(pd.DataFrame(columns))
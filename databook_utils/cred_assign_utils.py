@@ -1,8 +1,14 @@
-import itertools
+import hashlib
+import json
+import os
 import warnings
+from pathlib import Path
 
+import h5py
 import numpy as np
-from matplotlib import colors as mpl_colors
+
+# matplotlib and pandas are imported by the functions that use them, so that 
+# the mask and cache helpers can be imported without them
 
 # ignore tight layout warning
 warnings.filterwarnings("ignore", category=UserWarning, message="This figure includes Axes")
@@ -121,6 +127,69 @@ def crop_roi_image(df_row, roi_image):
     return roi_image
         
         
+#############################################
+def create_roi_mask_image(mask_idxs, mask_shape):
+    """
+    create_roi_mask_image(mask_idxs, mask_shape)
+
+    Returns a single ROI mask image built directly from mask indices, without 
+    allocating one image per ROI.
+
+    Required args:
+        - mask_idxs (list):
+            mask indices, the last two being the height and width indices 
+            ((..., hei, wid) x val)
+        - mask_shape (tuple):
+            shape of the image (hei x wid)
+
+    Returns:
+        - roi_mask (2D array):
+            ROI mask image (hei x wid), overlaid for all ROIs, with 1s where 
+            masks are present, and 0s elsewhere.
+    """
+
+    hei_idxs, wid_idxs = [np.asarray(sub) for sub in mask_idxs[-2:]]
+    roi_mask = np.zeros(tuple(mask_shape), dtype=int)
+    roi_mask[hei_idxs, wid_idxs] = 1
+
+    return roi_mask
+
+
+#############################################
+def dilate_mask(mask, cw=1):
+    """
+    dilate_mask(mask)
+
+    Returns a boolean mask dilated by a square of side (2 * cw + 1), i.e. 
+    with every pixel within cw pixels (including diagonally) of the mask set.
+
+    Required args:
+        - mask (2D array):
+            boolean mask (hei x wid)
+
+    Optional args:
+        - cw (int):
+            dilation width (pixels)
+            default: 1
+
+    Returns:
+        - dilated_mask (2D array):
+            dilated boolean mask (hei x wid)
+    """
+
+    # a square dilation is separable into one dilation along each axis
+    for axis in [0, 1]:
+        dilated_mask = mask.copy()
+        dilated_view = np.moveaxis(dilated_mask, axis, 0)
+        mask_view = np.moveaxis(mask, axis, 0)
+        for sh in range(1, cw + 1):
+            dilated_view[sh:] |= mask_view[:-sh]
+            dilated_view[:-sh] |= mask_view[sh:]
+        mask = dilated_mask
+
+    return mask
+
+
 #############################################
 def create_roi_mask_contours(df_row, sess_idx=0, cw=1):
     """
@@ -128,6 +197,10 @@ def create_roi_mask_contours(df_row, sess_idx=0, cw=1):
 
     Returns ROI mask contour image.
 
+    Each ROI's contour is computed only within its bounding box (padded by 
+    the contour width), and added to a single image, so that memory does not 
+    scale with the number of ROIs.
+
     Required args:
         - df_row (pd Series):
             see add_proj_and_roi_masks() docstring
@@ -146,28 +219,33 @@ def create_roi_mask_contours(df_row, sess_idx=0, cw=1):
             with 1s where mask contours are present, and 0s elsewhere.
     """
 
-    idxs = [np.asarray(sub) for sub in df_row["roi_mask_idxs"][sess_idx]]
+    roi_idxs, hei_idxs, wid_idxs = [
+        np.asarray(sub) for sub in df_row["roi_mask_idxs"][sess_idx]
+        ]
     nrois = df_row["nrois"][sess_idx]
-    mask_shape = (nrois, ) + tuple(df_row["roi_mask_shapes"][1:])
-    roi_masks = np.zeros(mask_shape).astype("int8")
-    roi_masks[tuple(idxs)] = 1 # ROI x hei x wid
-
-    pad_zhw = [0, 0], [cw, cw], [cw, cw]
-    contour_mask = np.pad(roi_masks, pad_zhw, "constant", constant_values=0)
-    shifts = range(-cw, cw + 1)
-    _, h, w = roi_masks.shape
-    for h_sh, w_sh in itertools.product(shifts, repeat=2):
-        if h_sh == 0 and w_sh == 0:
+    hei, wid = tuple(df_row["roi_mask_shapes"][1:])
+
+    # group mask pixels by ROI
+    order = np.argsort(roi_idxs, kind="stable")
+    bounds = np.searchsorted(roi_idxs[order], np.arange(nrois + 1))
+
+    roi_masks = np.zeros((hei, wid), dtype=bool)
+    for r in range(nrois):
+        pix = order[bounds[r] : bounds[r + 1]]
+        if len(pix) == 0:
             continue
-        contour_mask[:, cw+h_sh: h+cw+h_sh, cw+w_sh: w+cw+w_sh] += roi_masks
-    
-    sub_mask = contour_mask[:, cw:h+cw, cw:w+cw]
-    contour_mask = (sub_mask != len(shifts) ** 2) * (sub_mask != 0)
-    restrict_masks = 1 - roi_masks
+        h, w = hei_idxs[pix], wid_idxs[pix]
+        h_st, w_st = max(h.min() - cw, 0), max(w.min() - cw, 0)
+        h_end, w_end = min(h.max() + cw + 1, hei), min(w.max() + cw + 1, wid)
+
+        roi_box = np.zeros((h_end - h_st, w_end - w_st), dtype=bool)
+        roi_box[h - h_st, w - w_st] = True
+        
+        # contour: pixels within cw of the ROI, but outside of it
+        contour_box = dilate_mask(roi_box, cw=cw) & ~roi_box
+        roi_masks[h_st : h_end, w_st : w_end] |= contour_box
     
-    # collapse mask contours
-    roi_masks = np.max(contour_mask * restrict_masks, axis=0).astype(int)
-    roi_masks = crop_roi_image(df_row, roi_masks)
+    roi_masks = crop_roi_image(df_row, roi_masks.astype(int))
 
     return roi_masks
 
@@ -209,6 +287,8 @@ def add_roi_mask(sub_ax, roi_masks, col="orange", alpha=0.6,
             default: 0
     """
 
+    from matplotlib import colors as mpl_colors
+
     N_LEVELS_MASKS = 2
 
     colors = [col]
@@ -268,14 +348,14 @@ def add_proj_and_roi_masks(ax_grp, df_row, sess_cols, alpha=0.6,
             default: -12
     """
 
+    from matplotlib import colors as mpl_colors
+
     N_LEVELS_PROJS = 256
 
     n_sess = len(df_row["sess_ns"])
 
-    idxs = [np.asarray(sub) for sub in df_row["registered_roi_mask_idxs"]]    
-    reg_roi_masks = np.zeros(df_row["roi_mask_shapes"]).astype(int)
-    reg_roi_masks[tuple(idxs)] = 1 # sess x hei x wid        
-    reg_roi_masks = crop_roi_image(df_row, reg_roi_masks)
+    reg_idxs = [np.asarray(sub) for sub in df_row["registered_roi_mask_idxs"]]
+    mask_shape = tuple(df_row["roi_mask_shapes"][1:])
 
     imaging_planes = []
     for s, sess_n in enumerate(df_row["sess_ns"]):
@@ -311,7 +391,12 @@ def add_proj_and_roi_masks(ax_grp, df_row, sess_cols, alpha=0.6,
         shared_col = int((n_sess - 1) // 2)
         shared_sub_ax = ax_grp[1, shared_col]
 
-        add_roi_mask(shared_sub_ax, reg_roi_masks[s], col=col, alpha=alpha)
+        sess_pix = (reg_idxs[0] == s)
+        reg_roi_mask = create_roi_mask_image(
+            [sub[sess_pix] for sub in reg_idxs[1:]], mask_shape
+            )
+        reg_roi_mask = crop_roi_image(df_row, reg_roi_mask)
+        add_roi_mask(shared_sub_ax, reg_roi_mask, col=col, alpha=alpha)
 
         imaging_planes.append(imaging_plane)
 
@@ -505,3 +590,301 @@ def format_linpla_subaxes(ax):
     # add axis labels
     add_linpla_axislabels(ax)
 
+
+#############################################
+####### DATA DICTIONARY CACHE FUNCTIONS #####
+#############################################
+
+# bump when the cache layout changes, so that older caches are rebuilt
+DATA_CACHE_FORMAT = 1
+
+
+#############################################
+def get_file_hash(filepath):
+    """
+    get_file_hash(filepath)
+
+    Returns the SHA-256 hash of a file.
+
+    Required args:
+        - filepath (Path or str):
+            path to the file
+
+    Returns:
+        - file_hash (str):
+            hexadecimal SHA-256 hash of the file
+    """
+
+    hasher = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(block)
+
+    return hasher.hexdigest()
+
+
+#############################################
+def _as_numeric_array(value):
+    """
+    _as_numeric_array(value)
+
+    Returns a list as a numeric array, or None if it is ragged or not numeric.
+    """
+
+    if not isinstance(value, list):
+        return None
+    try:
+        array = np.asarray(value)
+    except ValueError: # ragged
+        return None
+    if array.dtype.kind not in "biuf" or array.ndim == 0:
+        return None
+
+    return array
+
+
+#############################################
+def _write_value(group, name, value):
+    """
+    _write_value(group, name, value)
+
+    Writes a JSON value to an HDF5 group: numeric (nested) lists as 
+    contiguous datasets, ragged lists as subgroups, and anything else as a 
+    JSON attribute.
+    """
+
+    array = _as_numeric_array(value)
+    if array is not None:
+        group.create_dataset(name, data=array)
+    elif isinstance(value, list) and len(value):
+        sub_group = group.create_group(name)
+        for i, sub_value in enumerate(value):
+            _write_value(sub_group, str(i), sub_value)
+    else:
+        group.attrs[name] = json.dumps(value)
+
+
+#############################################
+def _read_value(group, name, cache_path):
+    """
+    _read_value(group, name, cache_path)
+
+    Reads a value written with _write_value(). Datasets are returned as 
+    read-only memory maps of the cache file, so their data is only read from 
+    disk when used.
+    """
+
+    if name not in group:
+        return json.loads(group.attrs[name])
+
+    node = group[name]
+    if isinstance(node, h5py.Group):
+        return [
+            _read_value(node, str(i), cache_path) 
+            for i in range(len(node) + len(node.attrs))
+            ]
+
+    offset = node.id.get_offset()
+    if offset is None: # empty datasets are not allocated
+        return np.empty(node.shape, dtype=node.dtype)
+
+    return np.memmap(
+        cache_path, dtype=node.dtype, mode="r", offset=offset, shape=node.shape
+        )
+
+
+#############################################
+def _write_df(group, df_dict):
+    """
+    _write_df(group, df_dict)
+
+    Writes a dataframe in dict format ({column: {index: value}}) to an HDF5 
+    group, with scalar columns stored as typed datasets, and other columns 
+    stored cell by cell.
+    """
+
+    columns = list(df_dict.keys())
+    index = list(df_dict[columns[0]].keys()) if len(columns) else []
+    group.attrs["columns"] = json.dumps(columns)
+    group.attrs["index"] = json.dumps(index)
+
+    for c, column in enumerate(columns):
+        values = [df_dict[column][idx] for idx in index]
+        if all(isinstance(value, str) for value in values):
+            group.create_dataset(
+                str(c), data=values, dtype=h5py.string_dtype()
+                )
+        elif all(isinstance(value, (int, float)) for value in values):
+            group.create_dataset(str(c), data=np.asarray(values))
+        else:
+            col_group = group.create_group(str(c))
+            for i, value in enumerate(values):
+                _write_value(col_group, str(i), value)
+
+
+#############################################
+def _read_df(group, cache_path):
+    """
+    _read_df(group, cache_path)
+
+    Reads a dataframe written with _write_df().
+    """
+
+    import pandas as pd
+
+    columns = json.loads(group.attrs["columns"])
+    index = json.loads(group.attrs["index"])
+
+    data = dict()
+    for c, column in enumerate(columns):
+        node = group[str(c)]
+        if isinstance(node, h5py.Dataset):
+            if h5py.check_string_dtype(node.dtype) is not None:
+                data[column] = node.asstr()[()]
+            else:
+                data[column] = node[()]
+        else:
+            cells = np.empty(len(index), dtype=object)
+            cells[:] = [
+                _read_value(node, str(i), cache_path) 
+                for i in range(len(index))
+                ]
+            data[column] = cells
+
+    return pd.DataFrame(data, index=index, columns=columns)
+
+
+#############################################
+def build_data_dict_cache(filepath, cache_path):
+    """
+    build_data_dict_cache(filepath, cache_path)
+
+    Converts a cred_assign_data JSON data dictionary to an HDF5 cache.
+
+    Dataframes (keys ending in "_df") are stored column by column, with 
+    numeric lists stored as contiguous (memory-mappable) datasets. Other 
+    keys (analysis parameters) are stored as JSON.
+
+    Required args:
+        - filepath (Path or str):
+            path to the JSON data dictionary
+        - cache_path (Path or str):
+            path to the HDF5 cache to write
+    """
+
+    with open(filepath, "r") as f:
+        data_dict = json.load(f)
+
+    stat = os.stat(filepath)
+    tmp_path = f"{cache_path}.tmp"
+    with h5py.File(tmp_path, "w") as h5_file:
+        h5_file.attrs["format"] = DATA_CACHE_FORMAT
+        h5_file.attrs["source_mtime_ns"] = stat.st_mtime_ns
+        h5_file.attrs["source_size"] = stat.st_size
+        h5_file.attrs["source_hash"] = get_file_hash(filepath)
+        h5_file.attrs["keys"] = json.dumps(list(data_dict.keys()))
+        for k, (key, value) in enumerate(data_dict.items()):
+            if key.endswith("_df"):
+                _write_df(h5_file.create_group(str(k)), value)
+            else:
+                h5_file.attrs[str(k)] = json.dumps(value)
+
+    os.replace(tmp_path, cache_path)
+
+
+#############################################
+def data_dict_cache_is_valid(filepath, cache_path):
+    """
+    data_dict_cache_is_valid(filepath, cache_path)
+
+    Returns whether an HDF5 cache is up to date with its JSON data dictionary.
+
+    The source's modification time and size are checked first. If they 
+    differ (e.g., after a fresh clone), the source's hash is compared to the 
+    one recorded when the cache was built, and the recorded modification 
+    time is updated if the content is unchanged.
+
+    Required args:
+        - filepath (Path or str):
+            path to the JSON data dictionary
+        - cache_path (Path or str):
+            path to the HDF5 cache
+
+    Returns:
+        - valid (bool):
+            if True, the cache can be used
+    """
+
+    if not Path(cache_path).is_file():
+        return False
+
+    stat = os.stat(filepath)
+    try:
+        with h5py.File(cache_path, "r") as h5_file:
+            attrs = dict(h5_file.attrs)
+    except OSError: # e.g., an interrupted write
+        return False
+
+    if attrs.get("format") != DATA_CACHE_FORMAT:
+        return False
+    if (attrs["source_mtime_ns"] == stat.st_mtime_ns and 
+        attrs["source_size"] == stat.st_size):
+        return True
+    if attrs["source_hash"] != get_file_hash(filepath):
+        return False
+
+    with h5py.File(cache_path, "r+") as h5_file:
+        h5_file.attrs["source_mtime_ns"] = stat.st_mtime_ns
+        h5_file.attrs["source_size"] = stat.st_size
+
+    return True
+
+
+#############################################
+def load_data_dict_cached(filepath, cache_path=None):
+    """
+    load_data_dict_cached(filepath)
+
+    Returns a cred_assign_data data dictionary, loaded from an HDF5 cache 
+    that is (re)built from the JSON file whenever it is missing or out of 
+    date.
+
+    Dataframes (keys ending in "_df") are returned as pd.DataFrames, as in 
+    the figures notebook, but with numeric list values (e.g., 
+    "max_projections", "roi_mask_idxs", traces) as read-only memory-mapped 
+    arrays, so only the data actually plotted is read from disk.
+
+    Required args:
+        - filepath (Path or str):
+            path to the JSON data dictionary, 
+            e.g. "data/cred_assign_data/dataset_fig5B.json"
+
+    Optional args:
+        - cache_path (Path or str):
+            path to the HDF5 cache. If None, the JSON path with an ".h5" 
+            suffix is used.
+            default: None
+
+    Returns:
+        - data_dict (dict):
+            data dictionary
+    """
+
+    filepath = Path(filepath)
+    if not filepath.is_file():
+        raise OSError(f"{filepath} not found.")
+    if cache_path is None:
+        cache_path = filepath.with_suffix(".h5")
+
+    if not data_dict_cache_is_valid(filepath, cache_path):
+        build_data_dict_cache(filepath, cache_path)
+
+    data_dict = dict()
+    with h5py.File(cache_path, "r") as h5_file:
+        for k, key in enumerate(json.loads(h5_file.attrs["keys"])):
+            if key.endswith("_df"):
+                data_dict[key] = _read_df(h5_file[str(k)], cache_path)
+            else:
+                data_dict[key] = json.loads(h5_file.attrs[str(k)])
+
+    return data_dict
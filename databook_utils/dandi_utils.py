@@ -1,17 +1,24 @@
 
-import h5py
+import hashlib
+import json
 import os
-import remfile
+import requests
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from random import randint
-from typing import Union, Iterator, Callable, Tuple, Dict
+from typing import TYPE_CHECKING, Union, Iterator, Callable, Tuple, Dict
 from pathlib import Path
 
-from dandi import download
-from dandi import dandiapi
-from hdmf_zarr.nwb import NWBZarrIO
-from pynwb import NWBHDF5IO
-from tqdm.notebook import tqdm
+# dandi, pynwb, hdmf_zarr, h5py, remfile and tqdm take seconds to import together,
+# so they are imported by the functions that use them
+if TYPE_CHECKING:
+    from dandi import dandiapi
+
+from databook_utils.cache_utils import AssetCache, get_default_cache
+from databook_utils.stream_utils import BlockCacheFile, get_remote_size
 
 
 def _is_zarr_asset(asset_path: Union[str, Path]) -> bool:
@@ -20,7 +27,67 @@ def _is_zarr_asset(asset_path: Union[str, Path]) -> bool:
     return path.endswith(".zarr") or ".zarr/" in path
 
 
-def open_nwb_io(path_or_url: Union[str, Path], mode: str = "r", force_zarr: bool = False):
+# process-wide pools, so that repeated opens reuse connections and metadata lookups
+_client_pool = {}
+_dandiset_pool = {}
+_url_pool = {}
+_pool_lock = threading.Lock()
+_http_session = None
+
+# seconds that a resolved (possibly presigned) download URL is reused for
+URL_TTL = float(os.environ.get("DANDI_URL_TTL", 300))
+
+
+def get_dandi_client(dandi_api_key=None) -> "dandiapi.DandiAPIClient":
+    """Return the process-wide DandiAPIClient for an API key, creating it on first use."""
+    from dandi import dandiapi
+
+    with _pool_lock:
+        if dandi_api_key not in _client_pool:
+            _client_pool[dandi_api_key] = dandiapi.DandiAPIClient(token=dandi_api_key)
+        return _client_pool[dandi_api_key]
+
+
+def get_dandiset(dandiset_id, version=None, dandi_api_key=None) -> "dandiapi.RemoteDandiset":
+    """Return a pooled RemoteDandiset, fetching it through the pooled client on first use."""
+    key = (dandi_api_key, dandiset_id, version)
+    with _pool_lock:
+        dandiset = _dandiset_pool.get(key)
+    if dandiset is None:
+        dandiset = get_dandi_client(dandi_api_key).get_dandiset(dandiset_id, version_id=version)
+        with _pool_lock:
+            _dandiset_pool[key] = dandiset
+    return dandiset
+
+
+def get_http_session() -> requests.Session:
+    """Return the process-wide session used for direct (S3) range requests."""
+    global _http_session
+    with _pool_lock:
+        if _http_session is None:
+            _http_session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=32)
+            _http_session.mount("http://", adapter)
+            _http_session.mount("https://", adapter)
+        return _http_session
+
+
+def clear_dandi_pool() -> None:
+    """Drop all pooled clients, dandisets, sessions and resolved URLs."""
+    global _http_session
+    with _pool_lock:
+        _client_pool.clear()
+        _dandiset_pool.clear()
+        _url_pool.clear()
+        _http_session = None
+
+
+def open_nwb_io(
+    path_or_url: Union[str, Path],
+    mode: str = "r",
+    force_zarr: bool = False,
+    cache: AssetCache = None,
+):
     """Open an NWB IO object using the appropriate backend for HDF5 or Zarr.
 
     Parameters
@@ -32,14 +99,31 @@ def open_nwb_io(path_or_url: Union[str, Path], mode: str = "r", force_zarr: bool
     force_zarr : bool
         When True, use the Zarr backend even if the URL/path does not include a
         ".zarr" suffix (e.g., redirected DANDI download URLs).
+    cache : AssetCache, optional
+        Asset cache consulted for a local copy of a remote URL when reading.
+        Defaults to the cache configured by DATABOOK_CACHE_DIR, if any.
     """
+    if cache is None:
+        cache = get_default_cache()
+    if cache is not None and mode == "r":
+        cached_path = cache.resolve(path_or_url)
+        if cached_path is not None:
+            path_or_url = cached_path
+
     if force_zarr or _is_zarr_asset(path_or_url):
+        from hdmf_zarr.nwb import NWBZarrIO
+
         return NWBZarrIO(path=str(path_or_url), mode=mode)
+    from pynwb import NWBHDF5IO
+
     return NWBHDF5IO(str(path_or_url), mode=mode)
 
 
 # downloads an NWB file from DANDI to download_loc, opens it, and returns the IO object for the NWB
 # dandi_api_key is required to access files from embargoed dandisets
+# n_workers > 1 fetches the file as concurrent byte ranges (see download_ranges_parallel)
+# interrupted HDF5 downloads are resumed and finished ones verified (see download_resumable)
+# when a cache is given, or DATABOOK_CACHE_DIR is set, the file is stored in the shared AssetCache instead
 def dandi_download_open(
     dandiset_id,
     dandi_filepath,
@@ -48,14 +132,30 @@ def dandi_download_open(
     force_overwrite=False,
     version=None,
     show_progress=True,
+    n_workers=1,
+    cache=None,
 ):
-    client = dandiapi.DandiAPIClient(token=dandi_api_key)
-    dandiset = client.get_dandiset(dandiset_id, version_id=version)
+    dandiset = get_dandiset(dandiset_id, version=version, dandi_api_key=dandi_api_key)
 
     file = dandiset.get_asset_by_path(dandi_filepath)
     file_url = file.download_url
     is_zarr_asset = _is_zarr_asset(dandi_filepath)
 
+    if cache is None:
+        cache = get_default_cache()
+    if cache is not None:
+        filepath = download_to_cache(
+            cache,
+            file,
+            dandiset_id=dandiset_id,
+            version=dandiset.version_id,
+            force_overwrite=force_overwrite,
+            show_progress=show_progress,
+            n_workers=n_workers,
+        )
+        print("Opening file")
+        return open_nwb_io(filepath, mode="r", cache=cache)
+
     if download_loc == None:
         if "codeocean" in os.environ.get("GIT_ASKPASS", ""):
             download_loc = "../../scratch"
@@ -65,51 +165,339 @@ def dandi_download_open(
     filename = dandi_filepath.split("/")[-1]
     filepath = f"{download_loc}/{filename}"
 
-    if os.path.exists(filepath) and not force_overwrite:
-        print("File already exists")
-    else:
-        if is_zarr_asset:
+    if is_zarr_asset:
+        if os.path.exists(filepath) and not force_overwrite:
+            print("File already exists")
+        else:
+            from dandi import download
+
             download.download(file_url, output_dir=download_loc, preserve_tree=True)
-        elif show_progress:
-            download_with_progressbar(file, filepath)
+            print(f"Downloaded file to {filepath}")
+    else:
+        if force_overwrite:
+            remove_download(filepath)
+        if download_resumable(file, filepath, n_workers=n_workers, show_progress=show_progress):
+            print(f"Downloaded file to {filepath}")
         else:
-            download.download(file_url, output_dir=download_loc)
-        print(f"Downloaded file to {filepath}")
+            print("File already exists")
 
     print("Opening file")
     io = open_nwb_io(filepath, mode="r")
     return io
 
 
+def download_to_cache(
+    cache: AssetCache,
+    file,
+    dandiset_id: str = None,
+    version: str = None,
+    force_overwrite: bool = False,
+    show_progress: bool = True,
+    n_workers: int = 1,
+    on_chunk: Callable[[int], None] = None,
+) -> str:
+    """
+    Download a DANDI asset into a shared AssetCache and return its local path.
+
+    The asset is keyed by its DANDI asset id. If it is already cached it is
+    only marked as recently used. Otherwise it is downloaded into the cache's
+    staging area (resuming any earlier partial download), verified, and then
+    atomically published.
+
+    Parameters
+    ----------
+    cache : AssetCache
+        The cache to resolve the asset through
+    file : dandi.file.RemoteAsset
+        The file object from a DANDI dandiset obtained via dandiset.get_asset_by_path()
+    dandiset_id : str, optional
+        Dandiset the asset was looked up in, recorded in the cache metadata
+    version : str, optional
+        Dandiset version the asset was looked up in, recorded in the cache metadata
+    force_overwrite : bool, optional
+        Discard any cached copy and download the asset again.
+    show_progress : bool, optional
+        Whether to display a tqdm progress bar.
+    n_workers : int, optional
+        Number of concurrent range requests for HDF5 assets.
+    on_chunk : Callable, optional
+        Called with the number of bytes after each chunk of an HDF5 asset is written.
+
+    Returns
+    -------
+    str
+        Local path of the cached asset
+    """
+    key = file.identifier
+    # other notebooks sharing the cache wait here rather than download the asset too
+    with cache.lock(key):
+        if force_overwrite:
+            cache.remove(key)
+
+        cached_path = cache.get(key)
+        if cached_path is not None:
+            print("File already exists")
+            return cached_path
+
+        cache.evict(extra_bytes=file.size)
+        filename = file.path.split("/")[-1]
+        staged_path = cache.staging_path(key, filename)
+        if _is_zarr_asset(file.path):
+            from dandi import download
+
+            # the asset URL is downloaded to output_dir/<basename> without preserve_tree, i.e. to staged_path;
+            # chunks already staged by an interrupted download are kept
+            download.download(
+                file.download_url,
+                output_dir=os.path.dirname(staged_path),
+                existing=download.DownloadExisting.OVERWRITE_DIFFERENT,
+                preserve_tree=False,
+            )
+        else:
+            download_resumable(
+                file, staged_path, n_workers=n_workers, show_progress=show_progress, on_chunk=on_chunk
+            )
+
+        metadata = {
+            "asset_id": file.identifier,
+            "dandiset_id": dandiset_id,
+            "version": version,
+            "path": file.path,
+            "urls": [file.download_url],
+        }
+        filepath = cache.publish(key, staged_path, metadata)
+        print(f"Downloaded file to {filepath}")
+        return filepath
+
+
 # streams an NWB file remotely from DANDI, opens it, and returns the IO object for the NWB
 # dandi_api_key is required to access files from embargoed dandisets
+# pass a BlockCache as block_cache to read through its memory/disk block cache instead of remfile
+# Zarr assets are read chunk by chunk (see open_zarr_stream), cached on disk under chunk_cache_dir if given
 def dandi_stream_open(
     dandiset_id,
     dandi_filepath,
     dandi_api_key=None,
     version=None,
+    block_cache=None,
+    chunk_cache_dir=None,
 ):
-    client = dandiapi.DandiAPIClient(token=dandi_api_key)
-    dandiset = client.get_dandiset(dandiset_id, version_id=version)
+    dandiset = get_dandiset(dandiset_id, version=version, dandi_api_key=dandi_api_key)
 
     file = dandiset.get_asset_by_path(dandi_filepath)
 
     if _is_zarr_asset(dandi_filepath):
-        raise NotImplementedError(
-            "Remote streaming of DANDI Zarr assets is not supported by the "
-            "current hdmf-zarr backend in this environment. "
-            "Use dandi_download_open(...) for Zarr assets."
+        # the asset id changes whenever the Zarr's content does, so cached chunks never go stale
+        if chunk_cache_dir is not None:
+            chunk_cache_dir = os.path.join(chunk_cache_dir, file.identifier)
+        return open_zarr_stream(get_zarr_url(file), chunk_cache_dir=chunk_cache_dir)
+
+    from pynwb import NWBHDF5IO
+
+    io = NWBHDF5IO(file=_stream_h5py_file(file, block_cache=block_cache), mode="r")
+    return io
+
+
+def _stream_h5py_file(file, block_cache=None):
+    """Open a remote HDF5 asset with h5py, reading through remfile or through a BlockCache if given."""
+    import h5py
+
+    file_url = resolve_download_url(file)
+
+    if block_cache is None:
+        import remfile
+
+        rem_file = remfile.File(file_url)
+    else:
+        rem_file = BlockCacheFile(
+            file_url, cache=block_cache, key=file.identifier, size=file.size, session=get_http_session()
         )
+    return h5py.File(rem_file, "r")
+
+
+def resolve_download_url(file) -> str:
+    """Return the URL that DANDI's download endpoint redirects to for a file, memoized for URL_TTL seconds."""
+    now = time.monotonic()
+    with _pool_lock:
+        cached = _url_pool.get(file.base_download_url)
+    if cached is not None and cached[1] > now:
+        return cached[0]
 
     base_url = file.client.session.head(file.base_download_url)
-    file_url = base_url.headers["Location"]
+    file_url = base_url.headers.get("Location", file.base_download_url)
+    with _pool_lock:
+        _url_pool[file.base_download_url] = (file_url, now + URL_TTL)
+    return file_url
+
+
+def get_zarr_url(file) -> str:
+    """Return the S3 URL of a DANDI Zarr asset's root directory, which its metadata and chunks are read relative to."""
+    return file.get_content_url(regex="s3", strip_query=True).rstrip("/")
 
-    rem_file = remfile.File(file_url)
-    h5py_file = h5py.File(rem_file, "r")
-    io = NWBHDF5IO(file=h5py_file, mode="r")
+
+def open_zarr_stream(
+    url: str,
+    chunk_cache_dir: Union[str, Path] = None,
+    storage_options: dict = None,
+):
+    """
+    Open a remote Zarr NWB over HTTP, fetching only the chunks that are read.
+
+    The store is an fsspec HTTP filesystem behind fsspec's simplecache, so
+    each metadata file and chunk is requested once, saved to chunk_cache_dir
+    and read from disk afterwards. When a slice spans several chunks, zarr
+    requests all of them at once and they are fetched concurrently (in batches
+    of fsspec's gather_batch_size, 128 by default).
+    Group and array metadata come from the consolidated .zmetadata file, so
+    the server does not need to list directories (S3 does not), and the
+    namespaces cached in the file are loaded from it as well.
+
+    Parameters
+    ----------
+    url : str
+        http(s) URL of the Zarr directory, e.g. from get_zarr_url(), or a
+        local HTTP server serving a .nwb.zarr directory
+    chunk_cache_dir : str or Path, optional
+        Directory the fetched chunks are kept in, so they persist across
+        sessions. Defaults to a temporary directory removed at exit.
+    storage_options : dict, optional
+        Extra fsspec options for the HTTP filesystem, e.g. {"client_kwargs": {"headers": ...}}
+
+    Returns
+    -------
+    NWBZarrIO
+        The opened IO object, as returned by open_nwb_io for a local Zarr NWB
+    """
+    from hdmf.build import BuildManager
+    from hdmf_zarr.nwb import NWBZarrIO
+    from pynwb import get_type_map
+
+    protocol = url.split("://")[0]
+    cache_options = {} if chunk_cache_dir is None else {"cache_storage": str(chunk_cache_dir)}
+
+    # NWBZarrIO would load the cached namespaces by listing the specifications group
+    # without the consolidated metadata, which finds nothing on servers that cannot
+    # list directories, so they are loaded once the file is open instead
+    type_map = get_type_map()
+    io = NWBZarrIO(
+        path=f"simplecache::{url}",
+        mode="r",
+        manager=BuildManager(type_map),
+        storage_options={"simplecache": cache_options, protocol: storage_options or {}},
+    )
+    io.open()
+    io.load_namespaces_io(type_map)
     return io
 
 
+def get_range_reader(url: str, session: requests.Session = None, max_retries: int = 3) -> Callable[[int, int], bytes]:
+    """Return a thread-safe function that fetches (offset, size) byte ranges of a remote file, for copy_nwb_subset."""
+    if session is None:
+        session = get_http_session()
+
+    def read_range(offset: int, size: int) -> bytes:
+        attempts = 0
+        while True:
+            try:
+                result = session.get(url, headers={"Range": f"bytes={offset}-{offset + size - 1}"})
+                result.raise_for_status()
+                if result.status_code != 206 or len(result.content) != size:
+                    raise IOError(f"Expected {size} bytes at {offset} from {url}, got {len(result.content)}")
+                return result.content
+            except (requests.RequestException, IOError):
+                attempts += 1
+                if attempts > max_retries:
+                    raise
+
+    return read_range
+
+
+def _get_subset_digest(include) -> str:
+    """Return a short digest of the sorted included paths, which names the subsets made with them."""
+    include = sorted("/" + str(path).strip("/") for path in include)
+    return hashlib.sha256("\n".join(include).encode()).hexdigest()[:16]
+
+
+# streams an HDF5 NWB file from DANDI and copies only the groups and datasets in include,
+# e.g. ["units", "intervals"], into a small local NWB file, then opens it and returns the IO object
+# objects they refer to (the electrodes table, linked timestamps, ...) are copied too (see subset_utils)
+# chunks are fetched as concurrent range requests by n_workers threads
+# when a cache is given, or DATABOOK_CACHE_DIR is set, the subset is stored in the shared AssetCache,
+# where later open_nwb_io calls with the asset's URL resolve to it unless the full asset is cached
+def dandi_subset_download_open(
+    dandiset_id,
+    dandi_filepath,
+    include,
+    download_loc=None,
+    dandi_api_key=None,
+    force_overwrite=False,
+    version=None,
+    show_progress=True,
+    n_workers=8,
+    block_cache=None,
+    cache=None,
+):
+    if _is_zarr_asset(dandi_filepath):
+        raise ValueError("Zarr assets are already read chunk by chunk; use dandi_stream_open(...) instead")
+
+    from databook_utils.subset_utils import copy_nwb_subset
+
+    dandiset = get_dandiset(dandiset_id, version=version, dandi_api_key=dandi_api_key)
+    file = dandiset.get_asset_by_path(dandi_filepath)
+    digest = _get_subset_digest(include)
+    filename = dandi_filepath.split("/")[-1]
+
+    if cache is None:
+        cache = get_default_cache()
+    key = f"{file.identifier}-subset-{digest}"
+    # other notebooks sharing the cache wait here rather than copy the same subset too
+    with cache.lock(key) if cache is not None else nullcontext():
+        if cache is not None:
+            if force_overwrite:
+                cache.remove(key)
+            filepath = cache.get(key)
+            staged_path = cache.staging_path(key, filename) if filepath is None else None
+        else:
+            if download_loc == None:
+                if "codeocean" in os.environ.get("GIT_ASKPASS", ""):
+                    download_loc = "../../scratch"
+                else:
+                    download_loc = "."
+            filepath = f"{download_loc}/{Path(filename).stem}.subset-{digest}.nwb"
+            if force_overwrite and os.path.exists(filepath):
+                os.remove(filepath)
+            staged_path = None if os.path.exists(filepath) else f"{filepath}.part"
+
+        if staged_path is None:
+            print("File already exists")
+        else:
+            with _stream_h5py_file(file, block_cache=block_cache) as src:
+                copied = copy_nwb_subset(
+                    src,
+                    staged_path,
+                    include,
+                    read_range=get_range_reader(resolve_download_url(file)),
+                    n_workers=n_workers,
+                    show_progress=show_progress,
+                )
+            if cache is not None:
+                metadata = {
+                    "asset_id": file.identifier,
+                    "dandiset_id": dandiset_id,
+                    "version": dandiset.version_id,
+                    "path": file.path,
+                    "urls": [file.download_url],
+                    "include": copied,
+                }
+                filepath = cache.publish(key, staged_path, metadata)
+            else:
+                os.replace(staged_path, filepath)
+            print(f"Downloaded {', '.join(copied)} to {filepath}")
+
+    print("Opening file")
+    return open_nwb_io(filepath, mode="r", cache=cache)
+
+
 def get_download_file_iter_with_steps(
     file, chunk_size: int = None
 ) -> Tuple[Callable[[int], Iterator[bytes]], Dict[str, int]]:
@@ -146,6 +534,8 @@ def get_download_file_iter_with_steps(
     url = file.base_download_url
     steps_dict = {"total_steps": None}
     result = file.client.session.get(url, stream=True)
+    # only the headers are needed, so release the connection back to the pool
+    result.close()
 
     total_size = int(result.headers.get('content-length', 0))
     steps_dict["total_steps"] = (total_size + chunk_size - 1) // chunk_size
@@ -165,13 +555,15 @@ def get_download_file_iter_with_steps(
 
 
 def download_with_progressbar(
-    file, filepath: Union[str, Path], chunk_size: int = None
+    file, filepath: Union[str, Path], chunk_size: int = None, n_workers: int = 1
 ) -> None:
     """
     Download a file from DANDI with a progress bar.
     
     Uses get_download_file_iter_with_steps to download the file in chunks and
-    displays a tqdm progress bar showing download progress.
+    displays a tqdm progress bar showing download progress. When n_workers is
+    greater than 1, the file is instead split into byte ranges that are fetched
+    concurrently with download_ranges_parallel.
     
     Parameters
     ----------
@@ -182,16 +574,393 @@ def download_with_progressbar(
     chunk_size : int, optional
         Size of each chunk in bytes. Defaults to DANDI_MAX_CHUNK_SIZE environment variable
         or 8MB if not set.
+    n_workers : int, optional
+        Number of concurrent range requests. Defaults to 1 (a single stream).
     
     See Also
     --------
     get_download_file_iter_with_steps : The underlying chunked downloader
+    download_ranges_parallel : The underlying multi-connection downloader
     dandi_download_open : Standard download helper (simpler alternative)
     """
     if chunk_size is None:
         chunk_size = int(os.environ.get("DANDI_MAX_CHUNK_SIZE", 1024 * 1024 * 8))
+
+    if n_workers > 1:
+        file_url = resolve_download_url(file)
+        download_ranges_parallel(
+            file_url, filepath, total_size=file.size, chunk_size=chunk_size, n_workers=n_workers
+        )
+        return
     
+    from tqdm.notebook import tqdm
+
     downloader, steps_dict = get_download_file_iter_with_steps(file, chunk_size=chunk_size)
     with open(filepath, "wb") as fp:
         for chunk in tqdm(downloader(0), total=steps_dict["total_steps"], unit="chunk", unit_scale=True, unit_divisor=1024):
             fp.write(chunk)
+
+
+def split_byte_ranges(total_size: int, part_size: int) -> list:
+    """Split [0, total_size) into inclusive (start, end) byte ranges of at most part_size bytes."""
+    return [
+        (start, min(start + part_size, total_size) - 1)
+        for start in range(0, total_size, part_size)
+    ]
+
+
+def download_ranges_parallel(
+    url: str,
+    filepath: Union[str, Path],
+    total_size: int = None,
+    chunk_size: int = None,
+    part_size: int = None,
+    n_workers: int = 4,
+    session: requests.Session = None,
+    max_retries: int = 3,
+    show_progress: bool = True,
+    ranges: list = None,
+    on_range_done: Callable[[int, int], None] = None,
+    on_chunk: Callable[[int], None] = None,
+) -> None:
+    """
+    Download a remote file by fetching byte ranges concurrently.
+
+    The destination file is preallocated to its full size and each worker
+    writes its range directly at the corresponding offset, so no reassembly
+    step is needed. A single progress bar aggregates the bytes received by
+    all workers. The server must support HTTP Range requests.
+
+    Parameters
+    ----------
+    url : str
+        Direct URL of the file (for DANDI assets, the redirected S3 URL).
+    filepath : str or Path
+        Local file path where the downloaded content should be saved
+    total_size : int, optional
+        Size of the remote file in bytes. Queried from the server if not given.
+    chunk_size : int, optional
+        Size of each streamed chunk in bytes. Defaults to DANDI_MAX_CHUNK_SIZE
+        environment variable or 8MB if not set.
+    part_size : int, optional
+        Size of each byte range handed to a worker. Defaults to 8 chunks.
+    n_workers : int, optional
+        Maximum number of concurrent connections.
+    session : requests.Session, optional
+        Session used for the range requests. Defaults to the pooled session
+        from get_http_session.
+    max_retries : int, optional
+        Number of times a failed range is resumed before giving up.
+    show_progress : bool, optional
+        Whether to display a tqdm progress bar.
+    ranges : list of (int, int), optional
+        Inclusive byte ranges to fetch. Defaults to the whole file split into
+        part_size ranges. When given, existing content at filepath is kept.
+    on_range_done : Callable, optional
+        Called with (start, end) from the worker thread once a range is written.
+    on_chunk : Callable, optional
+        Called with the number of bytes from the worker thread after each chunk
+        is written, e.g. to report throughput or to throttle bandwidth.
+    """
+    if chunk_size is None:
+        chunk_size = int(os.environ.get("DANDI_MAX_CHUNK_SIZE", 1024 * 1024 * 8))
+    if part_size is None:
+        part_size = chunk_size * 8
+    if session is None:
+        session = get_http_session()
+    if total_size is None:
+        total_size = get_remote_size(session, url)
+
+    if ranges is None:
+        ranges = split_byte_ranges(total_size, part_size)
+        mode = "wb"
+    else:
+        mode = "r+b" if os.path.exists(filepath) else "wb"
+
+    # preallocate so that every worker can write at its own offset
+    with open(filepath, mode) as fp:
+        fp.truncate(total_size)
+
+    from tqdm.notebook import tqdm
+
+    remaining = sum(end - start + 1 for start, end in ranges)
+    progress = tqdm(total=remaining, unit="B", unit_scale=True, unit_divisor=1024, disable=not show_progress)
+    progress_lock = threading.Lock()
+
+    def fetch_range(byte_range: Tuple[int, int]) -> None:
+        start, end = byte_range
+        offset = start
+        attempts = 0
+        with open(filepath, "r+b") as fp:
+            while offset <= end:
+                try:
+                    headers = {"Range": f"bytes={offset}-{end}"}
+                    with session.get(url, headers=headers, stream=True) as result:
+                        result.raise_for_status()
+                        if result.status_code != 206:
+                            raise IOError(f"Server for {url} ignored the range request")
+                        fp.seek(offset)
+                        for chunk in result.iter_content(chunk_size=chunk_size):
+                            if not chunk:
+                                continue
+                            chunk = chunk[:end - offset + 1]
+                            fp.write(chunk)
+                            offset += len(chunk)
+                            with progress_lock:
+                                progress.update(len(chunk))
+                            if on_chunk is not None:
+                                on_chunk(len(chunk))
+                    if offset <= end:
+                        raise IOError(f"Connection closed early at byte {offset} of range {start}-{end}")
+                except (requests.RequestException, IOError):
+                    attempts += 1
+                    if attempts > max_retries:
+                        raise
+        if on_range_done is not None:
+            on_range_done(start, end)
+
+    try:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            # consume the results so that any worker exception is raised here
+            for _ in executor.map(fetch_range, ranges):
+                pass
+    finally:
+        progress.close()
+
+
+MANIFEST_SUFFIX = ".manifest.json"
+
+# DANDI metadata digest keys, in order of preference, with the matching local digest name
+_DIGEST_TYPES = (("dandi:sha2-256", "sha256"), ("dandi:dandi-etag", "dandi-etag"))
+
+
+def _manifest_path(filepath: Union[str, Path]) -> str:
+    return f"{filepath}{MANIFEST_SUFFIX}"
+
+
+def load_download_manifest(filepath: Union[str, Path]) -> Union[dict, None]:
+    """Return the sidecar download manifest for filepath, or None if there is none."""
+    try:
+        with open(_manifest_path(filepath), "r") as fp:
+            return json.load(fp)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _save_manifest(filepath: Union[str, Path], manifest: dict) -> None:
+    # write then rename, so that a crash never leaves a half-written manifest
+    manifest_path = _manifest_path(filepath)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump(manifest, fp)
+    os.replace(tmp_path, manifest_path)
+
+
+def remove_download(filepath: Union[str, Path]) -> None:
+    """Delete a downloaded (or partially downloaded) file and its manifest."""
+    for path in (filepath, _manifest_path(filepath)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _merge_ranges(ranges: list) -> list:
+    """Merge overlapping or adjacent inclusive byte ranges."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _missing_ranges(completed: list, total_size: int, part_size: int) -> list:
+    """Return the byte ranges of [0, total_size) not covered by completed, split to part_size."""
+    missing = []
+    offset = 0
+    for start, end in _merge_ranges(completed) + [[total_size, total_size]]:
+        if start > offset:
+            missing += [(a + offset, b + offset) for a, b in split_byte_ranges(start - offset, part_size)]
+        offset = max(offset, end + 1)
+    return missing
+
+
+def _get_expected_digest(file) -> Tuple[Union[str, None], Union[str, None]]:
+    """Return (local digest name, value) of the best digest in a DANDI asset's metadata."""
+    asset_digests = file.get_raw_metadata().get("digest", {})
+    for dandi_type, digest_type in _DIGEST_TYPES:
+        if dandi_type in asset_digests:
+            return digest_type, asset_digests[dandi_type]
+    return None, None
+
+
+def verify_download(filepath: Union[str, Path], manifest: dict) -> bool:
+    """
+    Check a finished download against the size and digest recorded in its manifest.
+
+    The digest is only recomputed when the file has been modified since it was
+    last verified, so checking an unchanged file before each open is cheap.
+
+    Parameters
+    ----------
+    filepath : str or Path
+        Local path of the downloaded file
+    manifest : dict
+        Manifest as returned by load_download_manifest
+
+    Returns
+    -------
+    bool
+        True if the file is complete and matches the expected digest
+    """
+    if not os.path.exists(filepath) or os.path.getsize(filepath) != manifest["size"]:
+        return False
+    if _missing_ranges(manifest["completed"], manifest["size"], manifest["size"] or 1):
+        return False
+
+    mtime = os.path.getmtime(filepath)
+    if manifest.get("verified_mtime") == mtime:
+        return True
+    if manifest["digest"] is not None:
+        from dandi.support import digests
+
+        if digests.get_digest(filepath, manifest["digest_type"]) != manifest["digest"]:
+            return False
+
+    manifest["verified_mtime"] = mtime
+    _save_manifest(filepath, manifest)
+    return True
+
+
+def download_resumable(
+    file,
+    filepath: Union[str, Path],
+    chunk_size: int = None,
+    n_workers: int = 1,
+    show_progress: bool = True,
+    on_chunk: Callable[[int], None] = None,
+) -> bool:
+    """
+    Download a file from DANDI, resuming a previous interrupted attempt.
+
+    A sidecar manifest (filepath + ".manifest.json") records the asset id,
+    the expected size and digest from the DANDI asset metadata, and the byte
+    ranges that have been written so far. An interrupted download resumes
+    from the last recorded byte instead of starting over, and a finished file
+    is verified against the expected size and digest before it is used. An
+    existing file without a manifest is kept only if it matches the digest,
+    and is downloaded again otherwise.
+
+    Parameters
+    ----------
+    file : dandi.file.RemoteAsset
+        The file object from a DANDI dandiset obtained via dandiset.get_asset_by_path()
+    filepath : str or Path
+        Local file path where the downloaded content should be saved
+    chunk_size : int, optional
+        Size of each chunk in bytes. Defaults to DANDI_MAX_CHUNK_SIZE environment variable
+        or 8MB if not set.
+    n_workers : int, optional
+        Number of concurrent range requests. Defaults to 1 (a single stream).
+    show_progress : bool, optional
+        Whether to display a tqdm progress bar.
+    on_chunk : Callable, optional
+        Called with the number of bytes after each chunk is written.
+
+    Returns
+    -------
+    bool
+        True if any bytes were downloaded, False if a verified copy already existed
+
+    Raises
+    ------
+    IOError
+        If the finished file does not match the expected size or digest. The
+        manifest is removed so that the next attempt starts from scratch.
+    """
+    if chunk_size is None:
+        chunk_size = int(os.environ.get("DANDI_MAX_CHUNK_SIZE", 1024 * 1024 * 8))
+
+    manifest = load_download_manifest(filepath)
+    if manifest is None or manifest["asset_id"] != file.identifier or manifest["size"] != file.size:
+        digest_type, digest = _get_expected_digest(file)
+        manifest = {
+            "asset_id": file.identifier,
+            "size": file.size,
+            "digest_type": digest_type,
+            "digest": digest,
+            "completed": [],
+        }
+        # a file without a manifest may be a parallel download interrupted after the file was preallocated
+        # to its full size, so it is only kept if its digest shows that it is complete
+        if os.path.exists(filepath):
+            manifest["completed"] = [[0, file.size - 1]] if file.size > 0 else []
+            if digest is not None and verify_download(filepath, manifest):
+                return False
+            manifest["completed"] = []
+            os.remove(filepath)
+        _save_manifest(filepath, manifest)
+
+    missing = _missing_ranges(manifest["completed"], manifest["size"], chunk_size * 8)
+    if not missing and verify_download(filepath, manifest):
+        return False
+    if not missing:
+        # complete but corrupt, so nothing recorded can be trusted
+        manifest["completed"] = []
+        missing = _missing_ranges([], manifest["size"], chunk_size * 8)
+
+    manifest_lock = threading.Lock()
+
+    def mark_done(start: int, end: int) -> None:
+        with manifest_lock:
+            manifest["completed"] = _merge_ranges(manifest["completed"] + [[start, end]])
+            _save_manifest(filepath, manifest)
+
+    if not missing:
+        # a zero-byte asset has nothing to download
+        open(filepath, "wb").close()
+    elif n_workers > 1:
+        download_ranges_parallel(
+            resolve_download_url(file),
+            filepath,
+            total_size=manifest["size"],
+            chunk_size=chunk_size,
+            n_workers=n_workers,
+            show_progress=show_progress,
+            ranges=missing,
+            on_range_done=mark_done,
+            on_chunk=on_chunk,
+        )
+    else:
+        from tqdm.notebook import tqdm
+
+        start_at = missing[0][0]
+        if start_at > 0:
+            print(f"Resuming download at byte {start_at}")
+        downloader, steps_dict = get_download_file_iter_with_steps(file, chunk_size=chunk_size)
+        # anything recorded past start_at is rewritten by the stream, so forget it
+        manifest["completed"] = [[0, start_at - 1]] if start_at > 0 else []
+        _save_manifest(filepath, manifest)
+        mode = "r+b" if os.path.exists(filepath) else "wb"
+        with open(filepath, mode) as fp:
+            fp.truncate(start_at)
+            fp.seek(start_at)
+            offset = start_at
+            for chunk in tqdm(
+                downloader(start_at),
+                total=steps_dict["total_steps"],
+                initial=start_at // chunk_size,
+                unit="chunk",
+                disable=not show_progress,
+            ):
+                fp.write(chunk)
+                fp.flush()
+                mark_done(offset, offset + len(chunk) - 1)
+                offset += len(chunk)
+                if on_chunk is not None:
+                    on_chunk(len(chunk))
+
+    if not verify_download(filepath, manifest):
+        os.remove(_manifest_path(filepath))
+        raise IOError(f"Downloaded file {filepath} does not match the size or digest of asset {file.identifier}")
+    return True
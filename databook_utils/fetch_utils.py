@@ -0,0 +1,230 @@
+import argparse
+import os
+import re
+import threading
+import time
+
+import pandas as pd
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Union
+from tqdm.auto import tqdm
+
+from databook_utils.cache_utils import AssetCache
+from databook_utils.catalog_utils import load_session_catalog
+from databook_utils.dandi_utils import download_resumable, download_to_cache, get_dandiset
+
+
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+
+def parse_byte_size(size: Union[str, int, float]) -> int:
+    """Parse a byte count such as 2500000000, "2.5G" or "50MB" into an int."""
+    if isinstance(size, (int, float)):
+        return int(size)
+    match = re.fullmatch(r"\s*([0-9.]+)\s*([KMGT]?)(?:i?B)?\s*", size, flags=re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Could not parse byte size '{size}'")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+class BandwidthLimiter:
+    """
+    Caps the combined rate of bytes reported by any number of threads.
+
+    Each call to consume blocks the calling thread for as long as needed to
+    keep the overall rate at or below max_bytes_per_second.
+    """
+
+    def __init__(self, max_bytes_per_second: float):
+        self.max_bytes_per_second = max_bytes_per_second
+        self._next_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes: int) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._next_time = max(self._next_time, now) + nbytes / self.max_bytes_per_second
+            delay = self._next_time - now
+        if delay > 0:
+            time.sleep(delay)
+
+
+def fetch_sessions(
+    dandiset_id: str,
+    catalog: Union[str, Path, pd.DataFrame],
+    query: str = None,
+    download_loc: Union[str, Path] = ".",
+    version: str = None,
+    dandi_api_key: str = None,
+    max_concurrent: int = 2,
+    n_workers_per_file: int = 1,
+    max_bytes_per_second: Union[str, int] = None,
+    order: str = "largest",
+    cache: AssetCache = None,
+) -> pd.DataFrame:
+    """
+    Download the sessions of a catalog that match a filter, several at a time.
+
+    Parameters
+    ----------
+    dandiset_id : str
+        Dandiset that the catalog describes, e.g. "000248"
+    catalog : str, Path or DataFrame
+        Path to a data/*_sessions.csv catalog, or an already loaded catalog
+    query : str, optional
+        pandas query string selecting the sessions to fetch, e.g.
+        "size <= 2.5e9 and sex == 'F'", using the column names of
+        catalog_utils.CATALOG_SCHEMA. All sessions are fetched if not given.
+    download_loc : str or Path, optional
+        Directory to download the files into. Ignored when cache is given.
+    version : str, optional
+        Dandiset version. Defaults to the most recent one.
+    dandi_api_key : str, optional
+        Required to access files from embargoed dandisets
+    max_concurrent : int, optional
+        Maximum number of files downloaded at the same time.
+    n_workers_per_file : int, optional
+        Number of concurrent range requests within each file.
+    max_bytes_per_second : str or int, optional
+        Combined bandwidth limit across all downloads, e.g. "50MB". Unlimited if not given.
+    order : str, optional
+        "largest" to start with the largest files (best overall throughput),
+        "smallest" to finish as many files as early as possible, or "catalog"
+        to keep the catalog order.
+    cache : AssetCache, optional
+        Download into this shared cache instead of download_loc.
+
+    Returns
+    -------
+    DataFrame
+        One row per selected session with its local path, status, elapsed
+        seconds and throughput, plus an "error" column for failed downloads.
+    """
+    if not isinstance(catalog, pd.DataFrame):
+        catalog = load_session_catalog(catalog)
+    selected = catalog.query(query) if query else catalog
+    if order == "largest":
+        selected = selected.sort_values("size", ascending=False)
+    elif order == "smallest":
+        selected = selected.sort_values("size", ascending=True)
+    elif order != "catalog":
+        raise ValueError(f"Unknown order '{order}', expected 'largest', 'smallest' or 'catalog'")
+
+    limiter = None
+    if max_bytes_per_second is not None:
+        limiter = BandwidthLimiter(parse_byte_size(max_bytes_per_second))
+
+    dandiset = get_dandiset(dandiset_id, version=version, dandi_api_key=dandi_api_key)
+    if cache is None:
+        os.makedirs(download_loc, exist_ok=True)
+
+    total_bytes = int(selected["size"].sum())
+    progress = tqdm(total=total_bytes, unit="B", unit_scale=True, unit_divisor=1024, desc="sessions")
+    progress_lock = threading.Lock()
+
+    def on_chunk(nbytes: int) -> None:
+        with progress_lock:
+            progress.update(nbytes)
+        if limiter is not None:
+            limiter.consume(nbytes)
+
+    def fetch_one(dandi_filepath: str, size: int) -> dict:
+        row = {"path": dandi_filepath, "size": size}
+        t0 = time.perf_counter()
+        try:
+            file = dandiset.get_asset_by_path(dandi_filepath)
+            if cache is not None:
+                cached_path = cache.get(file.identifier)
+                if cached_path is not None:
+                    row["local_path"] = cached_path
+                    row["status"] = "exists"
+                    with progress_lock:
+                        progress.update(size)
+                else:
+                    row["local_path"] = download_to_cache(
+                        cache, file, dandiset_id=dandiset_id, version=dandiset.version_id,
+                        show_progress=False, n_workers=n_workers_per_file, on_chunk=on_chunk,
+                    )
+                    row["status"] = "done"
+            else:
+                filepath = os.path.join(download_loc, dandi_filepath.split("/")[-1])
+                downloaded = download_resumable(
+                    file, filepath, n_workers=n_workers_per_file, show_progress=False, on_chunk=on_chunk
+                )
+                row["local_path"] = filepath
+                row["status"] = "done" if downloaded else "exists"
+                if not downloaded:
+                    with progress_lock:
+                        progress.update(size)
+            row["error"] = None
+        except Exception as e:
+            row["local_path"] = None
+            row["status"] = "failed"
+            row["error"] = repr(e)
+        row["seconds"] = time.perf_counter() - t0
+        return row
+
+    t_start = time.perf_counter()
+    rows = []
+    try:
+        with ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+            # the executor's queue is FIFO, so files start in the scheduled order
+            futures = [executor.submit(fetch_one, path, size) for path, size in zip(selected["path"], selected["size"])]
+            for future in as_completed(futures):
+                rows.append(future.result())
+    finally:
+        progress.close()
+    elapsed = time.perf_counter() - t_start
+
+    report = pd.DataFrame(rows, columns=["path", "size", "local_path", "status", "seconds", "error"])
+    report["MB/s"] = report["size"] / report["seconds"].clip(lower=1e-9) / 1e6
+    report.loc[report["status"] != "done", "MB/s"] = None
+    fetched_bytes = report.loc[report["status"] == "done", "size"].sum()
+    print(
+        f"Fetched {(report['status'] == 'done').sum()} files ({fetched_bytes / 1e9:.2f} GB) in {elapsed:.1f} s "
+        f"({fetched_bytes / max(elapsed, 1e-9) / 1e6:.1f} MB/s overall), "
+        f"{(report['status'] == 'exists').sum()} already present, {(report['status'] == 'failed').sum()} failed"
+    )
+    return report
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Download the sessions of a data/*_sessions.csv catalog concurrently."
+    )
+    parser.add_argument("catalog", help="path to a sessions catalog CSV")
+    parser.add_argument("--dandiset", required=True, help="dandiset id, e.g. 000248")
+    parser.add_argument("--version", default=None, help="dandiset version")
+    parser.add_argument("--query", default=None, help="pandas query string, e.g. \"size <= 2.5e9\"")
+    parser.add_argument("--download-loc", default=".", help="directory to download into")
+    parser.add_argument("--cache-dir", default=None, help="download into a shared AssetCache at this directory instead")
+    parser.add_argument("--max-concurrent", type=int, default=2, help="files downloaded at the same time")
+    parser.add_argument("--workers-per-file", type=int, default=1, help="range requests per file")
+    parser.add_argument("--max-rate", default=None, help="combined bandwidth limit, e.g. 50MB")
+    parser.add_argument("--order", choices=["largest", "smallest", "catalog"], default="largest")
+    parser.add_argument("--report", default=None, help="write the per-file report to this CSV")
+    args = parser.parse_args(argv)
+
+    report = fetch_sessions(
+        args.dandiset,
+        args.catalog,
+        query=args.query,
+        download_loc=args.download_loc,
+        version=args.version,
+        dandi_api_key=os.environ.get("DANDI_API_KEY"),
+        max_concurrent=args.max_concurrent,
+        n_workers_per_file=args.workers_per_file,
+        max_bytes_per_second=args.max_rate,
+        order=args.order,
+        cache=AssetCache(args.cache_dir) if args.cache_dir else None,
+    )
+    if args.report:
+        report.to_csv(args.report, index=False)
+    if (report["status"] == "failed").any():
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+import time
+import warnings
+
+import numpy as np
+
+from typing import TYPE_CHECKING, Sequence, Tuple
+
+# scipy.optimize and scipy.sparse are imported by the functions that use them,
+# since they take about half a second to import
+if TYPE_CHECKING:
+    from scipy import sparse
+
+
+def get_ridge_precision(n_params: int, lam: float = 0) -> np.ndarray:
+    """Return the ridge penalty matrix Cinv of fit_lnp, which leaves the constant (first) parameter unpenalized."""
+    Cinv = lam * np.identity(n_params)
+    Cinv[0, 0] = 0
+    return Cinv
+
+
+def neg_log_lik_lnp(theta: np.ndarray, X: np.ndarray, y: np.ndarray, Cinv: np.ndarray) -> float:
+    """Ridge-penalized negative Poisson log likelihood of an LNP model, as in compare_likelihood.py."""
+    rate = np.exp(X @ theta)
+    log_lik = y @ np.log(rate) - rate.sum()
+    log_lik -= theta.T @ Cinv @ theta
+    return -log_lik
+
+
+def neg_log_lik_lnp_grad(theta: np.ndarray, X: np.ndarray, y: np.ndarray, Cinv: np.ndarray) -> np.ndarray:
+    """Analytic gradient of neg_log_lik_lnp with respect to theta."""
+    rate = np.exp(X @ theta)
+    return X.T @ (rate - y) + 2 * Cinv @ theta
+
+
+def neg_log_lik_lnp_hess(theta: np.ndarray, X: np.ndarray, y: np.ndarray, Cinv: np.ndarray) -> np.ndarray:
+    """Analytic Hessian of neg_log_lik_lnp with respect to theta."""
+    rate = np.exp(X @ theta)
+    return X.T @ (rate[:, np.newaxis] * X) + 2 * Cinv
+
+
+def _fit_lnp_reference(X: np.ndarray, y: np.ndarray, lam: float = 0) -> np.ndarray:
+    """fit_lnp from compare_likelihood.py (BFGS with finite-difference gradients), used by benchmark_lnp_fit."""
+    from scipy.optimize import minimize
+
+    Cinv = get_ridge_precision(X.shape[1], lam)
+    x0 = np.random.normal(0, .2, X.shape[1])
+    return minimize(neg_log_lik_lnp, x0, args=(X, y, Cinv))["x"]
+
+
+def _batched_loss(X, Y, theta, Cinv) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the linear predictor and the penalized negative log likelihood of every unit (column)."""
+    eta = X @ theta
+    with np.errstate(over="ignore"):
+        loss = np.exp(eta).sum(axis=0) - (Y * eta).sum(axis=0)
+    loss += np.einsum("pu,pq,qu->u", theta, Cinv, theta)
+    return eta, loss
+
+
+def _batched_hessians(X, rate, Cinv, row_chunk_size) -> np.ndarray:
+    """Return the (units x params x params) Hessians, accumulating X.T @ diag(rate) @ X over chunks of rows."""
+    from scipy import sparse
+
+    n_params = X.shape[1]
+    hessians = np.zeros((rate.shape[1], n_params * n_params))
+    for row_start in range(0, X.shape[0], row_chunk_size):
+        X_chunk = X[row_start:row_start + row_chunk_size]
+        if sparse.issparse(X_chunk):
+            X_chunk = X_chunk.toarray()
+        # outer products of each row's features, so that one matmul covers every unit
+        outer = (X_chunk[:, :, np.newaxis] * X_chunk[:, np.newaxis, :]).reshape(X_chunk.shape[0], -1)
+        hessians += (outer.T @ rate[row_start:row_start + row_chunk_size]).T
+    return hessians.reshape(-1, n_params, n_params) + 2 * Cinv
+
+
+def fit_lnp_batched(
+    X: np.ndarray,
+    counts: np.ndarray,
+    lam: float = 0,
+    method: str = "newton",
+    max_iter: int = 100,
+    tol: float = 1e-8,
+    row_chunk_size: int = 16384,
+) -> np.ndarray:
+    """
+    Fit an LNP (Poisson GLM with exponential nonlinearity) to many units against a shared design matrix.
+
+    Minimizes the same ridge-penalized negative log likelihood as fit_lnp in
+    compare_likelihood.py, but with its analytic gradient and Hessian
+    instead of BFGS's finite differences, which cost one X @ theta per
+    parameter per iteration. With method="newton", every unit is fit at once:
+    the Hessians of all units are built with a single matrix product per
+    chunk of rows and solved as one batched linear system, with step halving
+    for units whose loss would increase. Units drop out as they converge,
+    or keep their last weights if no step decreases their loss, with a
+    warning naming them, as for units still unconverged after max_iter.
+    method="lbfgs" fits the units one at a time with L-BFGS and the analytic
+    gradient, which suits designs with many parameters.
+
+    Parameters
+    ----------
+    X : np.ndarray or scipy sparse matrix
+        Design matrix (samples x params) whose first column is the constant,
+        as for fit_lnp. The constant's weight is not penalized. A sparse
+        matrix, e.g. from build_history_design, is only densified a chunk of
+        rows at a time.
+    counts : np.ndarray
+        Spike counts (samples,) for one unit, or (samples x units)
+    lam : float, optional
+        Ridge penalty, as for fit_lnp
+    method : str, optional
+        "newton" (batched Newton) or "lbfgs"
+    max_iter : int, optional
+        Maximum number of iterations
+    tol : float, optional
+        Stop once half the Newton decrement (the predicted decrease of the loss) falls below tol
+    row_chunk_size : int, optional
+        Number of samples per chunk when building the Hessians, bounding
+        temporary memory to row_chunk_size x params^2 floats
+
+    Returns
+    -------
+    theta : np.ndarray
+        Fitted weights, (params,) for one unit or (params x units)
+    """
+    from scipy import sparse
+    from scipy.optimize import minimize
+
+    X = sparse.csr_matrix(X, dtype=np.float64) if sparse.issparse(X) else np.asarray(X, dtype=np.float64)
+    Y = np.asarray(counts, dtype=np.float64)
+    single_unit = Y.ndim == 1
+    if single_unit:
+        Y = Y[:, np.newaxis]
+    n_params, n_units = X.shape[1], Y.shape[1]
+    Cinv = get_ridge_precision(n_params, lam)
+
+    # start from a flat rate at each unit's mean count
+    theta = np.zeros((n_params, n_units))
+    theta[0] = np.log(np.maximum(Y.mean(axis=0), 1e-10))
+
+    if method == "lbfgs":
+        for i in range(n_units):
+            fun = lambda t: (neg_log_lik_lnp(t, X, Y[:, i], Cinv), neg_log_lik_lnp_grad(t, X, Y[:, i], Cinv))
+            theta[:, i] = minimize(fun, theta[:, i], jac=True, method="L-BFGS-B", options={"maxiter": max_iter})["x"]
+        return theta[:, 0] if single_unit else theta
+    if method != "newton":
+        raise ValueError(f"Unknown method '{method}', expected 'newton' or 'lbfgs'")
+
+    active = np.arange(n_units)
+    failed = []
+    eta, loss = _batched_loss(X, Y, theta, Cinv)
+    for _ in range(max_iter):
+        if len(active) == 0:
+            break
+        Y_active, theta_active = Y[:, active], theta[:, active]
+        rate = np.exp(eta)
+        gradient = X.T @ (rate - Y_active) + 2 * Cinv @ theta_active
+        hessians = _batched_hessians(X, rate, Cinv, row_chunk_size)
+        step = np.linalg.solve(hessians, gradient.T[:, :, np.newaxis])[:, :, 0].T
+        decrement = (gradient * step).sum(axis=0) / 2
+
+        # halve the step of each unit whose loss does not decrease
+        step_size = np.ones(len(active))
+        new_theta = theta_active - step
+        new_eta, new_loss = _batched_loss(X, Y_active, new_theta, Cinv)
+        for _ in range(30):
+            worse = ~(new_loss <= loss[active])
+            if not worse.any():
+                break
+            step_size[worse] /= 2
+            new_theta[:, worse] = theta_active[:, worse] - step_size[worse] * step[:, worse]
+            new_eta[:, worse], new_loss[worse] = _batched_loss(X, Y_active[:, worse], new_theta[:, worse], Cinv)
+        # units whose loss still does not decrease, e.g. as it overflows to inf or nan, keep their weights and stop
+        stalled = ~(new_loss <= loss[active])
+        new_theta[:, stalled], new_eta[:, stalled], new_loss[stalled] = (
+            theta_active[:, stalled], eta[:, stalled], loss[active][stalled]
+        )
+
+        theta[:, active], loss[active] = new_theta, new_loss
+        converged = decrement < tol
+        failed.extend(active[stalled & ~converged].tolist())
+        done = converged | stalled
+        active, eta = active[~done], new_eta[:, ~done]
+
+    if failed:
+        warnings.warn(f"Units {sorted(failed)} stopped because step halving could not decrease their loss")
+    if len(active):
+        warnings.warn(f"Units {active.tolist()} did not converge in {max_iter} iterations")
+    return theta[:, 0] if single_unit else theta
+
+
+def get_interval_bins(bin_times: Sequence[float], starts: Sequence[float], stops: Sequence[float]) -> np.ndarray:
+    """
+    Return the sorted indices of the bins whose time falls within any of a set of intervals.
+
+    A bin at time t is within an interval if start <= t <= stop, as for
+    pynapple's in_interval. Each interval's first and last bin are found with
+    searchsorted on the sorted bin times, so the cost scales with the number
+    of bins inside intervals rather than with the whole session.
+    """
+    bin_times = np.asarray(bin_times, dtype=np.float64)
+    firsts = np.searchsorted(bin_times, np.asarray(starts, dtype=np.float64), side="left")
+    lasts = np.searchsorted(bin_times, np.asarray(stops, dtype=np.float64), side="right")
+    lengths = np.maximum(lasts - firsts, 0)
+    run_starts = np.repeat(firsts - np.cumsum(lengths) + lengths, lengths)
+    # overlapping intervals would repeat bins
+    return np.unique(run_starts + np.arange(lengths.sum()))
+
+
+def build_history_design(
+    bin_times: Sequence[float],
+    intervals: Sequence[Tuple[Sequence[float], Sequence[float]]],
+    history_size: int,
+    add_constant: bool = True,
+) -> "sparse.csr_matrix":
+    """
+    Build a sparse design matrix of lagged stimulus indicators directly from interval times.
+
+    Replaces building a dense 0/1 feature per stimulus type (retrieve_stim_info
+    in compare_likelihood.py) and passing it through nemos' HistoryConv: only
+    the nonzero entries, history_size per stimulus bin, are ever created. The
+    result can be passed as X to fit_lnp_batched.
+
+    Parameters
+    ----------
+    bin_times : array-like
+        Sorted time of each bin, e.g. counts.t
+    intervals : list of (starts, stops)
+        For each stimulus feature, the start and stop times of its
+        intervals, e.g. flashes' start and end times for one color
+    history_size : int
+        Number of lags per feature. Column k of each feature holds the
+        indicator k + 1 bins earlier (most recent lag first, as in
+        HistoryConv). Bins before the session start count as 0, whereas
+        HistoryConv gives NaN for the first history_size rows; see
+        check_history_design.
+    add_constant : bool, optional
+        If True, the first column is the constant 1, as fit_lnp_batched expects
+
+    Returns
+    -------
+    X : scipy.sparse.csr_matrix
+        Design matrix (bins x (add_constant + features * history_size))
+    """
+    from scipy import sparse
+
+    n_bins = len(bin_times)
+    rows, cols = [], []
+    if add_constant:
+        rows.append(np.arange(n_bins))
+        cols.append(np.zeros(n_bins, dtype=np.int64))
+    for f, (starts, stops) in enumerate(intervals):
+        stim_bins = get_interval_bins(bin_times, starts, stops)
+        for k in range(history_size):
+            lagged_bins = stim_bins + k + 1
+            lagged_bins = lagged_bins[lagged_bins < n_bins]
+            rows.append(lagged_bins)
+            cols.append(np.full(len(lagged_bins), int(add_constant) + f * history_size + k))
+
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    shape = (n_bins, int(add_constant) + len(intervals) * history_size)
+    return sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=shape)
+
+
+def check_history_design(
+    bin_times: Sequence[float],
+    intervals: Sequence[Tuple[Sequence[float], Sequence[float]]],
+    history_size: int,
+) -> float:
+    """
+    Return the largest difference between build_history_design and nemos' HistoryConv features.
+
+    The dense 0/1 indicator of each feature is passed through
+    nmo.basis.HistoryConv(history_size).compute_features, as in
+    compare_likelihood.py, and compared with the sparse design on the rows
+    after the first history_size, where HistoryConv gives NaN.
+    """
+    import nemos as nmo
+
+    n_bins = len(bin_times)
+    X = build_history_design(bin_times, intervals, history_size, add_constant=False).toarray()
+    max_diff = 0.0
+    for f, (starts, stops) in enumerate(intervals):
+        indicator = np.zeros(n_bins)
+        indicator[get_interval_bins(bin_times, starts, stops)] = 1
+        features = np.asarray(nmo.basis.HistoryConv(history_size).compute_features(indicator))
+        columns = slice(f * history_size, (f + 1) * history_size)
+        max_diff = max(max_diff, float(np.abs(X[history_size:, columns] - features[history_size:]).max(initial=0)))
+    return max_diff
+
+
+def _fit_nemos(X: np.ndarray, Y: np.ndarray, lam: float) -> np.ndarray:
+    """Fit the same penalized model with nemos' PopulationGLM and return its weights, constant first."""
+    import jax
+    import nemos as nmo
+
+    jax.config.update("jax_enable_x64", True)
+    if lam:
+        # nemos minimizes the mean loss + 0.5 * strength * |w|^2, this module the summed loss + lam * |w|^2
+        model = nmo.glm.PopulationGLM(regularizer="Ridge", regularizer_strength=lam * 2 / X.shape[0])
+    else:
+        model = nmo.glm.PopulationGLM()
+    model.fit(X[:, 1:], Y)
+    return np.vstack([np.asarray(model.intercept_)[np.newaxis], np.asarray(model.coef_)])
+
+
+def benchmark_lnp_fit(X: np.ndarray, counts: np.ndarray, lam: float = 0, compare_nemos: bool = True, **kwargs) -> dict:
+    """
+    Time fit_lnp_batched against fitting each unit with compare_likelihood.py's fit_lnp, and check that they agree.
+
+    Parameters
+    ----------
+    X, counts, lam
+        As for fit_lnp_batched, with counts as (samples x units)
+    compare_nemos : bool, optional
+        Also fit with nemos' PopulationGLM and compare the weights
+    **kwargs
+        Passed to fit_lnp_batched
+
+    Returns
+    -------
+    dict
+        Seconds taken by each fitter, the speedup, the largest amount by
+        which the batched loss exceeds fit_lnp's (about 0, or negative where
+        it found a better optimum), and the largest absolute weight differences
+        to fit_lnp and, if compared, nemos (None if the nemos fit failed, with
+        the error in "nemos_error", e.g. if nemos is not installed).
+    """
+    counts = np.asarray(counts, dtype=np.float64).reshape(X.shape[0], -1)
+    Cinv = get_ridge_precision(X.shape[1], lam)
+
+    t0 = time.perf_counter()
+    reference = np.stack([_fit_lnp_reference(X, counts[:, i], lam) for i in range(counts.shape[1])], axis=1)
+    reference_seconds = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    batched = fit_lnp_batched(X, counts, lam, **kwargs)
+    batched_seconds = time.perf_counter() - t0
+
+    loss_excess = max(
+        neg_log_lik_lnp(batched[:, i], X, counts[:, i], Cinv) - neg_log_lik_lnp(reference[:, i], X, counts[:, i], Cinv)
+        for i in range(counts.shape[1])
+    )
+    results = {
+        "reference_seconds": reference_seconds,
+        "batched_seconds": batched_seconds,
+        "speedup": reference_seconds / batched_seconds,
+        "max_loss_excess": float(loss_excess),
+        "max_weight_diff": float(np.abs(batched - reference).max()),
+        "max_weight_diff_nemos": None,
+        "nemos_error": None,
+    }
+    if compare_nemos:
+        # nemos is optional and its fits depend on matching jax and optimistix versions,
+        # so any failure is reported rather than discarding the timings above
+        try:
+            results["max_weight_diff_nemos"] = float(np.abs(batched - _fit_nemos(X, counts, lam)).max())
+        except Exception as e:
+            results["nemos_error"] = repr(e)
+    return results
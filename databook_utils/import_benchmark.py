@@ -0,0 +1,101 @@
+import argparse
+import subprocess
+import sys
+
+from typing import Dict
+
+
+# seconds that importing each module may take in a fresh interpreter, with headroom
+# over the measured times; heavy backends (dandi, pynwb, matplotlib, scipy.optimize)
+# must stay out of module-level imports to fit
+IMPORT_BUDGETS = {
+    "databook_utils": 0.05,
+    "databook_utils.cache_utils": 0.1,
+    "databook_utils.stream_utils": 0.3,
+    "databook_utils.dandi_utils": 0.3,
+    "databook_utils.spike_utils": 0.3,
+    "databook_utils.stim_utils": 0.3,
+    "databook_utils.units_utils": 0.3,
+    "databook_utils.rf_utils": 0.3,
+    "databook_utils.lfp_utils": 0.3,
+    "databook_utils.glm_utils": 0.3,
+    "databook_utils.cred_assign_utils": 0.3,
+    "databook_utils.subset_utils": 0.3,
+    "databook_utils.opto_utils": 0.3,
+    "databook_utils.sdf_utils": 0.3,
+    "databook_utils.pyramid_utils": 0.3,
+    "databook_utils.movie_utils": 0.3,
+    # these need pandas at import time for their catalog DataFrames
+    "databook_utils.catalog_utils": 1.0,
+    "databook_utils.metadata_utils": 1.0,
+    "databook_utils.fetch_utils": 1.0,
+}
+
+
+def measure_import_time(module: str, repeats: int = 3) -> float:
+    """
+    Return the cumulative import time of a module in seconds, as reported by python -X importtime.
+
+    Each repeat runs in a fresh interpreter so nothing is already imported, and
+    the fastest repeat is kept to reduce noise from disk caches and other load.
+    """
+    seconds = []
+    for _ in range(repeats):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True, text=True, check=True,
+        )
+        # lines look like "import time:  self [us] | cumulative | imported package"
+        for line in result.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip() == module:
+                seconds.append(int(fields[1]) / 1e6)
+    if not seconds:
+        raise RuntimeError(f"No import time reported for {module}")
+    return min(seconds)
+
+
+def run_import_benchmark(budgets: Dict[str, float] = None, repeats: int = 3, scale: float = 1.0) -> dict:
+    """
+    Measure the import time of each module and compare it to its budget.
+
+    Parameters
+    ----------
+    budgets : dict, optional
+        Module name -> budget in seconds. Defaults to IMPORT_BUDGETS.
+    repeats : int, optional
+        Fresh interpreters per module; the fastest is kept
+    scale : float, optional
+        Multiplier applied to every budget, e.g. 2 on a slow machine
+
+    Returns
+    -------
+    dict
+        Module name -> (seconds, budget in seconds, within budget)
+    """
+    if budgets is None:
+        budgets = IMPORT_BUDGETS
+    results = {}
+    for module, budget in budgets.items():
+        seconds = measure_import_time(module, repeats=repeats)
+        results[module] = (seconds, budget * scale, seconds <= budget * scale)
+    return results
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Check that importing each databook_utils module stays within its time budget."
+    )
+    parser.add_argument("--repeats", type=int, default=3, help="fresh interpreters per module")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every budget, e.g. 2 on a slow machine")
+    args = parser.parse_args(argv)
+
+    results = run_import_benchmark(repeats=args.repeats, scale=args.scale)
+    for module, (seconds, budget, ok) in results.items():
+        print(f"{module:40s} {seconds:7.3f} s  (budget {budget:.3f} s)  {'ok' if ok else 'OVER BUDGET'}")
+    if not all(ok for _, _, ok in results.values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
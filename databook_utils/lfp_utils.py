@@ -0,0 +1,152 @@
+import numpy as np
+
+from typing import Sequence, Tuple
+
+
+def get_lfp_timestamps(lfp) -> np.ndarray:
+    """Return the timestamps of an ElectricalSeries, computing them from starting_time and rate if it has none."""
+    if lfp.timestamps is not None:
+        return np.asarray(lfp.timestamps[:], dtype=np.float64)
+    return lfp.starting_time + np.arange(len(lfp.data)) / lfp.rate
+
+
+def _get_sample_map(
+    timestamps: np.ndarray, times: np.ndarray, kind: str
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return, for each time, the index of the sample it is resampled from and the linear weight of the next sample.
+
+    "nearest" matches scipy.interpolate.interp1d(kind="nearest"), which rounds
+    times halfway between two samples down to the earlier one.
+    """
+    if kind == "nearest":
+        midpoints = (timestamps[1:] + timestamps[:-1]) / 2
+        return np.searchsorted(midpoints, times, side="left"), None
+    if kind == "linear":
+        idx = np.clip(np.searchsorted(timestamps, times, side="right") - 1, 0, len(timestamps) - 2)
+        weights = (times - timestamps[idx]) / (timestamps[idx + 1] - timestamps[idx])
+        return idx, weights
+    raise ValueError(f"Unknown kind '{kind}', expected 'nearest' or 'linear'")
+
+
+def get_lfp_windows(
+    lfp,
+    stim_times: Sequence[float],
+    window_start_time: float,
+    window_end_time: float,
+    interp_hz: float = 250,
+    period_start: float = None,
+    period_end: float = None,
+    kind: str = "nearest",
+    block_samples: int = 2 ** 20,
+    dtype=None,
+    out: np.ndarray = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Resample LFP to a regular rate and cut a window around each stimulus, reading the data in blocks.
+
+    Gives the same windows as current_source_density.ipynb, which resamples
+    the whole period channel by channel with interp1d before slicing out each
+    window. Here the sample of lfp.data that every window time is resampled
+    from is computed up front, and only the rows spanned by a group of
+    consecutive windows (at most block_samples of them) are read at a time,
+    for all channels at once. The resampled period is never built, so memory
+    is bounded by one block plus the output, which can be a np.memmap.
+
+    Parameters
+    ----------
+    lfp : ElectricalSeries
+        The LFP series, e.g. lfp_nwb.acquisition["probe_0_lfp_data"]. Its
+        timestamps are loaded whole, its data only block by block.
+    stim_times : array-like
+        Stimulus onset times in seconds
+    window_start_time, window_end_time : float
+        Window bounds in seconds relative to each onset, e.g. -0.05 and 0.2
+    interp_hz : float, optional
+        Rate in Hz to resample the LFP to
+    period_start, period_end : float, optional
+        Only use LFP and stimuli within this period. Defaults to the whole recording.
+    kind : str, optional
+        "nearest" (as in the notebook) or "linear" interpolation
+    block_samples : int, optional
+        Maximum number of LFP samples read at once
+    dtype : numpy dtype, optional
+        dtype of the windows. Defaults to the data's dtype for "nearest" and float64 for "linear".
+    out : np.ndarray, optional
+        Preallocated (channels x trials x samples) array, e.g. a np.memmap, to
+        write the windows into. The number of trials must match the returned trial_times.
+
+    Returns
+    -------
+    windows : np.ndarray
+        Resampled LFP with shape (channels, trials, samples)
+    trial_times : np.ndarray
+        Onset times of the windows that fit within the period, in the order of
+        the trials axis. Onsets whose windows fall outside it are skipped.
+    """
+    if window_start_time > 0:
+        raise ValueError("start time must be non-positive number")
+    if window_end_time <= 0:
+        raise ValueError("end time must be positive number")
+
+    timestamps = get_lfp_timestamps(lfp)
+    period_start = timestamps[0] if period_start is None else period_start
+    period_end = timestamps[-1] if period_end is None else period_end
+    period_start_idx, period_end_idx = np.searchsorted(timestamps, (period_start, period_end))
+    timestamps = timestamps[period_start_idx:period_end_idx]
+    if len(timestamps) < 2:
+        raise ValueError("Period bounds not found within lfp data")
+
+    stim_times = np.asarray(stim_times, dtype=np.float64)
+    stim_times = np.sort(stim_times[(stim_times >= period_start) & (stim_times <= period_end)])
+    if len(stim_times) == 0:
+        raise ValueError("There are no stimulus timestamps in that period")
+
+    # the regular time axis of the resampled period, as np.arange(timestamps[0], timestamps[-1], step)
+    step = 1 / interp_hz
+    n_resampled = int(np.ceil((timestamps[-1] - timestamps[0]) / step))
+    window_length = int((window_end_time - window_start_time) * interp_hz)
+    start_idxs = ((stim_times + window_start_time - timestamps[0]) * interp_hz).astype(int)
+    in_bounds = (start_idxs >= 0) & (start_idxs + window_length <= n_resampled)
+    trial_times, start_idxs = stim_times[in_bounds], start_idxs[in_bounds]
+    if len(trial_times) == 0:
+        raise ValueError("There are no windows for these timestamps")
+
+    window_times = timestamps[0] + (start_idxs[:, np.newaxis] + np.arange(window_length)) * step
+    sample_idxs, weights = _get_sample_map(timestamps, window_times, kind)
+    # first and last sample each window reads, including the next sample for linear interpolation
+    window_lows = sample_idxs.min(axis=1)
+    window_highs = sample_idxs.max(axis=1) + (1 if weights is not None else 0)
+
+    n_channels = lfp.data.shape[1]
+    shape = (n_channels, len(trial_times), window_length)
+    if dtype is None:
+        dtype = lfp.data.dtype if weights is None else np.float64
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    elif out.shape != shape:
+        raise ValueError(f"out has shape {out.shape}, expected {shape}")
+
+    trial = 0
+    while trial < len(trial_times):
+        # grow the block over consecutive windows while their samples fit in block_samples
+        block_end = trial + 1
+        while (
+            block_end < len(trial_times)
+            and window_highs[block_end] - window_lows[trial] < block_samples
+        ):
+            block_end += 1
+        low, high = window_lows[trial], window_highs[block_end - 1]
+        block = np.asarray(lfp.data[period_start_idx + low:period_start_idx + high + 1])
+
+        block_idxs = sample_idxs[trial:block_end] - low
+        if weights is None:
+            resampled = block[block_idxs]
+        else:
+            block_weights = weights[trial:block_end, :, np.newaxis]
+            resampled = (1 - block_weights) * block[block_idxs] + block_weights * block[block_idxs + 1]
+        # (trials, samples, channels) -> (channels, trials, samples)
+        out[:, trial:block_end] = resampled.transpose(2, 0, 1)
+        trial = block_end
+
+    return out, trial_times
@@ -0,0 +1,237 @@
+import json
+import os
+
+import h5py
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Union
+
+from databook_utils.dandi_utils import resolve_download_url, get_dandiset
+
+
+# column layouts of the ephys and ophys session catalogs in data/*_sessions.csv
+EPHYS_COLUMNS = (
+    "identifier", "size", "path", "session_time", "sub_name", "sub_sex", "sub_age",
+    "sub_genotype", "probes", "stim types", "#_units", "session_length",
+)
+OPHYS_COLUMNS = (
+    "identifier", "size", "path", "session_time", "sub_name", "session_id", "experiment_id",
+    "container_id", "group", "group_count", "imaging_depth", "location", "fov_height",
+    "fov_width", "sub_sex", "sub_age", "sub_genotype", "stim_types", "#_rois", "session_end",
+)
+
+# columns holding sets, which are stored as lists in the JSON cache
+_SET_COLUMNS = ("probes", "stim types", "stim_types")
+
+# bump when the extracted fields change, so that stale cache entries are ignored
+_CACHE_FORMAT = 1
+
+
+def _read_value(group: h5py.Group, name: str):
+    """Return a scalar dataset of an HDF5 group as a Python value, or None if it is absent."""
+    if group is None or name not in group:
+        return None
+    value = group[name][()]
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+
+def _get_session_end(h5_file: h5py.File):
+    """Return the highest final stop time among the intervals tables with more than one row."""
+    intervals = h5_file.get("intervals", {})
+    stop_times = [
+        intervals[name]["stop_time"][-1]
+        for name in intervals
+        if "stop_time" in intervals[name] and len(intervals[name]["stop_time"]) > 1
+    ]
+    return float(max(stop_times)) if stop_times else None
+
+
+def get_ephys_h5_info(h5_file: h5py.File) -> list:
+    """
+    Extract the ephys session catalog fields from an open NWB HDF5 file.
+
+    Equivalent to get_ephys_nwb_info in get_dandiset_metadata.ipynb, but only
+    reads the handful of header groups involved instead of building the
+    whole NWB object tree.
+    """
+    subject = h5_file.get("general/subject")
+    devices = h5_file.get("general/devices", {})
+    n_units = len(h5_file["units/id"]) if "units/id" in h5_file else 0
+    return [
+        _read_value(h5_file, "session_start_time"),
+        _read_value(subject, "specimen_name"),
+        _read_value(subject, "sex"),
+        _read_value(subject, "age_in_days"),
+        _read_value(subject, "genotype"),
+        sorted(devices.keys()),
+        sorted(h5_file.get("intervals", {}).keys()),
+        n_units,
+        _get_session_end(h5_file),
+    ]
+
+
+def get_ophys_h5_info(h5_file: h5py.File) -> list:
+    """
+    Extract the ophys session catalog fields from an open NWB HDF5 file.
+
+    Equivalent to get_ophys_nwb_info in get_dandiset_metadata.ipynb, but only
+    reads the handful of header groups involved.
+    """
+    metadata = h5_file.get("general/metadata")
+    subject = h5_file.get("general/subject")
+
+    traces_path = "processing/ophys/dff/traces/data"
+    n_rois = h5_file[traces_path].shape[1] if traces_path in h5_file else None
+    planes = h5_file.get("general/optophysiology", {})
+    location = _read_value(planes[list(planes.keys())[0]], "location") if len(planes) else None
+
+    return [
+        _read_value(h5_file, "session_start_time"),
+        _read_value(subject, "subject_id"),
+        _read_value(metadata, "ophys_session_id"),
+        _read_value(metadata, "ophys_experiment_id"),
+        _read_value(metadata, "experiment_container_id"),
+        _read_value(metadata, "imaging_plane_group"),
+        _read_value(metadata, "imaging_plane_group_count"),
+        _read_value(metadata, "imaging_depth"),
+        location,
+        _read_value(metadata, "field_of_view_height"),
+        _read_value(metadata, "field_of_view_width"),
+        _read_value(subject, "sex"),
+        _read_value(subject, "age"),
+        _read_value(subject, "genotype"),
+        sorted(h5_file.get("intervals", {}).keys()),
+        n_rois,
+        _get_session_end(h5_file),
+    ]
+
+
+def _harvest_asset(file_url: str, nwb_type: str) -> list:
+    """Stream one NWB asset and return its catalog fields. Runs in a worker process."""
+    import remfile
+
+    extract_h5_info = get_ephys_h5_info if nwb_type == "ephys" else get_ophys_h5_info
+    with h5py.File(remfile.File(file_url), "r") as h5_file:
+        return extract_h5_info(h5_file)
+
+
+def _load_harvest_cache(cache_path: str) -> dict:
+    try:
+        with open(cache_path, "r") as fp:
+            cache = json.load(fp)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if cache.get("format") != _CACHE_FORMAT:
+        return {}
+    return cache.get("assets", {})
+
+
+def _save_harvest_cache(cache_path: str, assets: dict) -> None:
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump({"format": _CACHE_FORMAT, "assets": assets}, fp)
+    os.replace(tmp_path, cache_path)
+
+
+def harvest_dandiset_metadata(
+    dandiset_id: str,
+    nwb_type: str = "ephys",
+    version: str = None,
+    dandi_api_key: str = None,
+    asset_filter: Callable = None,
+    cache_path: Union[str, Path] = None,
+    n_processes: int = None,
+    max_assets: int = None,
+) -> pd.DataFrame:
+    """
+    Build a session catalog for a dandiset by streaming the header of every asset in parallel.
+
+    Each asset is streamed with remfile and only the groups needed for the
+    catalog (subject, session_start_time, intervals, units/ROI counts) are
+    read, on a process pool. Results are cached per asset id in a JSON file,
+    and since DANDI assigns a new asset id whenever an asset's content
+    changes, rerunning on a new dandiset version only streams new or changed
+    assets.
+
+    Parameters
+    ----------
+    dandiset_id : str
+        Dandiset to harvest, e.g. "000248"
+    nwb_type : str, optional
+        "ephys" or "ophys", selecting the catalog layout (EPHYS_COLUMNS or OPHYS_COLUMNS).
+    version : str, optional
+        Dandiset version. Defaults to the most recent one.
+    dandi_api_key : str, optional
+        Required to access files from embargoed dandisets
+    asset_filter : Callable, optional
+        Predicate on each RemoteAsset selecting the main session files. Defaults
+        to skipping "probe" files for ephys and "raw" files for ophys.
+    cache_path : str or Path, optional
+        JSON file caching the extracted fields per asset. Defaults to
+        "{dandiset_id}_metadata_cache.json" in the working directory.
+    n_processes : int, optional
+        Number of worker processes. Defaults to the number of CPUs.
+    max_assets : int, optional
+        Only harvest the first max_assets selected assets, e.g. for testing.
+
+    Returns
+    -------
+    DataFrame
+        One row per asset in the same layout as the data/*_sessions.csv catalogs
+    """
+    if nwb_type not in ("ephys", "ophys"):
+        raise ValueError(f"Unknown nwb_type '{nwb_type}', expected 'ephys' or 'ophys'")
+    columns = EPHYS_COLUMNS if nwb_type == "ephys" else OPHYS_COLUMNS
+    if asset_filter is None:
+        skip = "probe" if nwb_type == "ephys" else "raw"
+        asset_filter = lambda asset: skip not in asset.path
+    if cache_path is None:
+        cache_path = f"{dandiset_id}_metadata_cache.json"
+
+    dandiset = get_dandiset(dandiset_id, version=version, dandi_api_key=dandi_api_key)
+    files = [asset for asset in dandiset.get_assets() if asset_filter(asset)]
+    if max_assets is not None:
+        files = files[:max_assets]
+
+    cached = _load_harvest_cache(cache_path)
+    to_harvest = [file for file in files if f"{nwb_type}:{file.identifier}" not in cached]
+    print(f"{len(files)} files retrieved, {len(files) - len(to_harvest)} cached, {len(to_harvest)} to stream")
+
+    if to_harvest:
+        with ProcessPoolExecutor(max_workers=n_processes) as executor:
+            futures = {
+                executor.submit(_harvest_asset, resolve_download_url(file), nwb_type): file
+                for file in to_harvest
+            }
+            for i, future in enumerate(as_completed(futures)):
+                file = futures[future]
+                try:
+                    fields = future.result()
+                except Exception as e:
+                    print(f"Failed to read {file.path}: {e!r}")
+                    continue
+                cached[f"{nwb_type}:{file.identifier}"] = fields
+                print(f"Examined file {i+1}/{len(to_harvest)}: {file.identifier}")
+                # save as we go, so an interrupted harvest keeps its progress
+                _save_harvest_cache(cache_path, cached)
+
+    rows = [
+        [file.identifier, file.size, file.path] + cached[f"{nwb_type}:{file.identifier}"]
+        for file in files
+        if f"{nwb_type}:{file.identifier}" in cached
+    ]
+    dandiset_files = pd.DataFrame(rows, columns=columns)
+    dandiset_files["session_time"] = dandiset_files["session_time"].map(
+        lambda time: None if time is None else datetime.fromisoformat(time)
+    )
+    for column in _SET_COLUMNS:
+        if column in dandiset_files:
+            dandiset_files[column] = dandiset_files[column].map(set)
+    return dandiset_files
@@ -0,0 +1,303 @@
+import io
+import math
+import threading
+
+import numpy as np
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Sequence, Tuple, Union
+
+# matplotlib, PIL and ipywidgets are imported by the methods that use them, since they are slow to import
+
+
+class FrameServer:
+    """
+    Random access to the frames of a 2-photon movie for interactive viewing.
+
+    Reading movie[start_idx:end_idx] of visualize_2p_raw.ipynb loads the whole
+    clip into memory, adds a full-size ROI mask array to it, and its
+    hyperslicer draws every frame through a new matplotlib figure. Here,
+    frames are read in blocks aligned to the dataset's chunks, so each
+    chunk is read and decompressed once, and kept in an LRU of decoded
+    blocks within max_cache_bytes. After each access, the next blocks in
+    the direction of scrubbing are read by a background thread. The ROI
+    overlay is blended into each frame as it is rendered, and the rendered
+    images are kept in a second LRU so revisited frames cost nothing.
+
+    Parameters
+    ----------
+    movie : h5py.Dataset, zarr.Array or np.ndarray
+        Movie with frames on the first axis, e.g. nwb.acquisition["motion_corrected_stack"].data
+    timestamps : array-like, optional
+        Time in seconds of each frame, e.g. the RoiResponseSeries timestamps, for time_to_frame
+        and get_frame_range
+    roi_masks : np.ndarray, optional
+        Boolean mask with the shape of a frame, drawn over each frame
+    vmin, vmax : float, optional
+        Values mapped to the ends of the colormap. Default to the 1st and 99.5th
+        percentiles of the first block read, so that all frames share one scale.
+    cmap : str, optional
+        Matplotlib colormap name
+    overlay_color : tuple of int, optional
+        RGB color of the ROI overlay
+    overlay_alpha : float, optional
+        Opacity of the ROI overlay
+    frames_per_block : int, optional
+        Frames per read. Defaults to the smallest multiple of the dataset's chunk length of at least 16 frames.
+    max_cache_bytes : int, optional
+        Byte budget of the decoded block LRU. Defaults to 512MB.
+    image_format : str, optional
+        "png", or "jpeg" to encode frames several times faster, lossily
+    max_cached_images : int, optional
+        Number of rendered frames kept
+    prefetch_blocks : int, optional
+        Number of blocks read ahead in the direction of scrubbing
+    """
+
+    def __init__(
+        self,
+        movie,
+        timestamps: Sequence[float] = None,
+        roi_masks: np.ndarray = None,
+        vmin: float = None,
+        vmax: float = None,
+        cmap: str = "viridis",
+        overlay_color: Tuple[int, int, int] = (255, 255, 255),
+        overlay_alpha: float = 0.5,
+        frames_per_block: int = None,
+        max_cache_bytes: int = 512 * 1024 * 1024,
+        image_format: str = "png",
+        max_cached_images: int = 1024,
+        prefetch_blocks: int = 2,
+    ):
+        self.movie = movie
+        self.timestamps = None if timestamps is None else np.asarray(timestamps, dtype=np.float64)
+        self.vmin, self.vmax = vmin, vmax
+        self.cmap = cmap
+        self.overlay_alpha = overlay_alpha
+        self.overlay_color = np.asarray(overlay_color, dtype=np.float32)
+        # only the masked pixels are blended into each frame
+        self._overlay_idxs = None if roi_masks is None else np.flatnonzero(np.asarray(roi_masks, dtype=bool))
+        self._lut = None
+
+        if frames_per_block is None:
+            chunks = getattr(movie, "chunks", None)
+            chunk_frames = chunks[0] if chunks else 1
+            frames_per_block = chunk_frames * math.ceil(16 / chunk_frames)
+        self.frames_per_block = frames_per_block
+        self.max_cache_bytes = max_cache_bytes
+        self.image_format = image_format
+        self.max_cached_images = max_cached_images
+        self.prefetch_blocks = prefetch_blocks
+
+        self._blocks = OrderedDict()
+        self._cache_bytes = 0
+        self._encoded = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._last_block = None
+        # one reader, since HDF5 reads are serialized anyway; it overlaps reads with rendering
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self.stats = {"block_hits": 0, "block_misses": 0, "prefetched_blocks": 0, "encoded_hits": 0}
+
+    def __len__(self) -> int:
+        return len(self.movie)
+
+    def __enter__(self) -> "FrameServer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stop the prefetch thread and drop the caches."""
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            self._blocks.clear()
+            self._encoded.clear()
+            self._cache_bytes = 0
+
+    def time_to_frame(self, times: Union[float, Sequence[float]]) -> Union[int, np.ndarray]:
+        """Return the index of the first frame at or after each time."""
+        if self.timestamps is None:
+            raise ValueError("FrameServer needs timestamps to look up frames by time")
+        idxs = np.searchsorted(self.timestamps, times, side="left")
+        return int(idxs) if np.ndim(idxs) == 0 else idxs
+
+    def get_frame_range(self, start_time: float, end_time: float) -> Tuple[int, int]:
+        """
+        Return the start and end indices of the frames from start_time up to end_time.
+
+        Replaces the loop over flr_timestamps of visualize_2p_raw.ipynb with a binary search.
+        """
+        start_idx, end_idx = self.time_to_frame([start_time, end_time])
+        if start_idx >= len(self.timestamps) or end_idx <= start_idx:
+            raise ValueError("Period bounds not found within 2P data")
+        return int(start_idx), int(end_idx)
+
+    def _read_block(self, block_idx: int) -> np.ndarray:
+        start = block_idx * self.frames_per_block
+        block = np.asarray(self.movie[start:start + self.frames_per_block])
+        block.setflags(write=False)
+        with self._lock:
+            self._blocks[block_idx] = block
+            self._cache_bytes += block.nbytes
+            while self._cache_bytes > self.max_cache_bytes and len(self._blocks) > 1:
+                _, evicted = self._blocks.popitem(last=False)
+                self._cache_bytes -= evicted.nbytes
+            self._pending.pop(block_idx, None)
+        return block
+
+    def _read_prefetched_block(self, block_idx: int) -> Union[np.ndarray, None]:
+        """Read a block in the background, unless scrubbing has since moved away from it."""
+        if abs(block_idx - self._last_block) > self.prefetch_blocks:
+            with self._lock:
+                self._pending.pop(block_idx, None)
+            return None
+        return self._read_block(block_idx)
+
+    def _submit_read(self, block_idx: int) -> Future:
+        """Return the pending read of a block, starting one if needed. Must be called with the lock held."""
+        future = self._pending.get(block_idx)
+        if future is None:
+            future = self._executor.submit(self._read_prefetched_block, block_idx)
+            self._pending[block_idx] = future
+        return future
+
+    def _get_block(self, block_idx: int) -> np.ndarray:
+        with self._lock:
+            block = self._blocks.get(block_idx)
+            if block is not None:
+                self._blocks.move_to_end(block_idx)
+                self.stats["block_hits"] += 1
+            else:
+                self.stats["block_misses"] += 1
+                future = self._pending.get(block_idx)
+        if block is None:
+            # a miss is read right away rather than queued behind the prefetches
+            block = None if future is None else future.result()
+            if block is None:
+                block = self._read_block(block_idx)
+        self._prefetch(block_idx)
+        return block
+
+    def _prefetch(self, block_idx: int) -> None:
+        """Read the next blocks in the direction of scrubbing in the background."""
+        direction = -1 if self._last_block is not None and block_idx < self._last_block else 1
+        self._last_block = block_idx
+        n_blocks = math.ceil(len(self) / self.frames_per_block)
+        with self._lock:
+            for step in range(1, self.prefetch_blocks + 1):
+                next_idx = block_idx + direction * step
+                if 0 <= next_idx < n_blocks and next_idx not in self._blocks and next_idx not in self._pending:
+                    self._submit_read(next_idx)
+                    self.stats["prefetched_blocks"] += 1
+
+    def _check_frame_idx(self, frame_idx: int) -> int:
+        frame_idx = int(frame_idx)
+        if frame_idx < 0:
+            frame_idx += len(self)
+        if not 0 <= frame_idx < len(self):
+            raise IndexError(f"frame {frame_idx} out of range for {len(self)} frames")
+        return frame_idx
+
+    def get_frame(self, frame_idx: int) -> np.ndarray:
+        """Return a frame of the movie, as a read-only view of its cached block."""
+        block_idx, offset = divmod(self._check_frame_idx(frame_idx), self.frames_per_block)
+        return self._get_block(block_idx)[offset]
+
+    def _get_lut(self, dtype: np.dtype) -> np.ndarray:
+        """
+        Return the RGB color of each level, or of each raw value for 8 and 16-bit integer movies.
+
+        With a table over every raw value, a frame is colormapped with a single lookup.
+        """
+        key = (self.cmap, self.vmin, self.vmax, dtype)
+        if self._lut is None or self._lut[0] != key:
+            from matplotlib import colormaps
+
+            colors = (colormaps[self.cmap](np.linspace(0, 1, 256))[:, :3] * 255).astype(np.uint8)
+            if self._is_lut_by_value(dtype):
+                raw_values = np.arange(2 ** (8 * dtype.itemsize), dtype=f"u{dtype.itemsize}").view(dtype)
+                colors = colors[self._get_levels(raw_values)]
+            self._lut = (key, colors)
+        return self._lut[1]
+
+    @staticmethod
+    def _is_lut_by_value(dtype: np.dtype) -> bool:
+        return dtype.kind in "iu" and dtype.itemsize <= 2
+
+    def _get_levels(self, values: np.ndarray) -> np.ndarray:
+        """Return the colormap level from 0 to 255 of each value."""
+        scale = 255 / max(self.vmax - self.vmin, np.finfo(np.float32).tiny)
+        return np.clip((values.astype(np.float32) - self.vmin) * scale, 0, 255).astype(np.uint8)
+
+    def get_image(self, frame_idx: int) -> np.ndarray:
+        """Return a frame colormapped to RGB, with the ROI overlay blended in."""
+        frame_idx = self._check_frame_idx(frame_idx)
+        frame = self.get_frame(frame_idx)
+        if self.vmin is None or self.vmax is None:
+            vmin, vmax = np.percentile(self._get_block(frame_idx // self.frames_per_block), [1, 99.5])
+            self.vmin = vmin if self.vmin is None else self.vmin
+            self.vmax = vmax if self.vmax is None else self.vmax
+        lut = self._get_lut(frame.dtype)
+        if self._is_lut_by_value(frame.dtype):
+            image = np.take(lut, frame.view(f"u{frame.dtype.itemsize}"), axis=0)
+        else:
+            image = np.take(lut, self._get_levels(frame), axis=0)
+        if self._overlay_idxs is not None:
+            pixels = image.reshape(-1, 3)
+            blended = (1 - self.overlay_alpha) * pixels[self._overlay_idxs] + self.overlay_alpha * self.overlay_color
+            pixels[self._overlay_idxs] = blended.astype(np.uint8)
+        return image
+
+    def _get_encoded_key(self, frame_idx: int) -> tuple:
+        """Return the key of a rendered frame in the LRU, which changes with any of the render settings."""
+        return (
+            frame_idx, self.cmap, self.vmin, self.vmax, tuple(self.overlay_color), self.overlay_alpha, self.image_format
+        )
+
+    def get_encoded_image(self, frame_idx: int) -> bytes:
+        """Return a frame rendered by get_image and encoded in image_format, using the LRU of rendered frames."""
+        frame_idx = self._check_frame_idx(frame_idx)
+        with self._lock:
+            key = self._get_encoded_key(frame_idx)
+            encoded = self._encoded.get(key)
+            if encoded is not None:
+                self._encoded.move_to_end(key)
+                self.stats["encoded_hits"] += 1
+                return encoded
+
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        # fast compression, since the images only travel to the notebook frontend
+        options = {"compress_level": 1} if self.image_format == "png" else {"quality": 90}
+        Image.fromarray(self.get_image(frame_idx)).save(buffer, format=self.image_format, **options)
+        encoded = buffer.getvalue()
+        with self._lock:
+            # keyed after rendering, which sets vmin and vmax if they were not given
+            self._encoded[self._get_encoded_key(frame_idx)] = encoded
+            while len(self._encoded) > self.max_cached_images:
+                self._encoded.popitem(last=False)
+        return encoded
+
+    def widget(self, start_idx: int = 0, end_idx: int = None, play_buttons: bool = False):
+        """
+        Return an ipywidgets viewer of frames start_idx to end_idx, replacing hyperslicer of visualize_2p_raw.ipynb.
+
+        Each slider step only reads (usually from cache) and renders the frame shown.
+        """
+        import ipywidgets as widgets
+
+        end_idx = len(self) if end_idx is None else end_idx
+        image = widgets.Image(format=self.image_format, value=self.get_encoded_image(start_idx))
+        slider = widgets.IntSlider(min=start_idx, max=end_idx - 1, value=start_idx, description="Frame")
+        slider.observe(lambda change: setattr(image, "value", self.get_encoded_image(change["new"])), names="value")
+        controls = [slider]
+        if play_buttons:
+            play = widgets.Play(min=start_idx, max=end_idx - 1, value=start_idx, interval=50)
+            widgets.jslink((play, "value"), (slider, "value"))
+            controls.insert(0, play)
+        return widgets.VBox([image, widgets.HBox(controls)])
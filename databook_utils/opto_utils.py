@@ -0,0 +1,337 @@
+import warnings
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Sequence, Tuple
+
+from databook_utils.spike_utils import _find_windows, get_ragged_arrays, get_spike_matrix
+
+# scipy.stats is imported by the functions that use it, since it takes about half a second to import
+
+
+def get_response_bins(
+    censor_period: float = 0.002,
+    stim_duration: float = 0.01,
+    time_resolution: float = 0.001,
+    window_start_time: float = -0.01,
+    window_end_time: float = 0.025,
+) -> Tuple[np.ndarray, slice, slice]:
+    """
+    Return the bin edges and the baseline and response bins used in optotagging.ipynb.
+
+    The baseline is window_start_time to -censor_period and the response is
+    censor_period to stim_duration - censor_period, relative to each pulse onset.
+
+    Returns
+    -------
+    bin_edges : np.ndarray
+        Bin edges in seconds relative to each onset
+    baseline_bins, response_bins : slice
+        Bins of the baseline and response periods
+    """
+    n_bins = int((window_end_time - window_start_time) / time_resolution)
+    bin_edges = np.linspace(window_start_time, window_end_time, n_bins, endpoint=True)
+    stim_start_idx = int((censor_period - bin_edges[0]) / time_resolution)
+    stim_end_idx = int((stim_duration - censor_period - bin_edges[0]) / time_resolution)
+    bl_end_idx = int((0 - censor_period - bin_edges[0]) / time_resolution)
+    return bin_edges, slice(0, bl_end_idx), slice(stim_start_idx, stim_end_idx)
+
+
+def mannwhitneyu_pvalues(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Two-sided Mann-Whitney U p-values of many pairs of samples at once.
+
+    Samples lie along the last axis and the other axes broadcast. Each pair
+    gets the same p-value as its own call to scipy.stats.mannwhitneyu(x, y):
+    scipy's method="auto" would pick the exact or asymptotic test once for a
+    whole batch, so here the exact test is used only for the pairs with no
+    ties when either sample has 8 values or fewer, and the asymptotic test
+    with tie and continuity corrections for the rest.
+    """
+    from scipy.stats import mannwhitneyu
+
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    batch_shape = np.broadcast_shapes(x.shape[:-1], y.shape[:-1])
+    x = np.broadcast_to(x, (*batch_shape, x.shape[-1]))
+    y = np.broadcast_to(y, (*batch_shape, y.shape[-1]))
+    pvalues = mannwhitneyu(x, y, axis=-1, method="asymptotic").pvalue
+
+    if x.shape[-1] <= 8 or y.shape[-1] <= 8:
+        xy = np.sort(np.concatenate([x, y], axis=-1), axis=-1)
+        no_ties = ~np.any(xy[..., 1:] == xy[..., :-1], axis=-1)
+        if no_ties.any():
+            pvalues[no_ties] = mannwhitneyu(x[no_ties], y[no_ties], axis=-1, method="exact").pvalue
+    return pvalues
+
+
+def fraction_responsive(
+    spike_matrix: np.ndarray,
+    baseline_bins: slice,
+    response_bins: slice,
+    alpha: float = 0.01,
+    unit_chunk_size: int = 256,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the fraction of response bins and of trials in which each unit fires above baseline.
+
+    Computes fraction_time_responsive and fraction_trials_responsive of
+    optotagging.ipynb for every unit with one batched rank test per chunk of
+    units instead of one mannwhitneyu call per unit and bin or trial. In both,
+    the baseline sample is the trial-averaged count in each baseline bin. A
+    bin (across trials) or a trial (across response bins) counts as responsive
+    when it differs from the baseline with p < alpha and its mean is higher.
+
+    Parameters
+    ----------
+    spike_matrix : np.ndarray
+        Spike counts with shape (units, trials, bins), e.g. from spike_utils.get_spike_matrix
+    baseline_bins, response_bins : slice
+        Bins of the baseline and response periods, e.g. from get_response_bins
+    alpha : float, optional
+        Significance level
+    unit_chunk_size : int, optional
+        Number of units tested at once
+
+    Returns
+    -------
+    fracs_time_responsive, fracs_trials_responsive : np.ndarray
+        Fractions with shape (units,)
+    """
+    n_units = spike_matrix.shape[0]
+    fracs_time_responsive = np.zeros(n_units)
+    fracs_trials_responsive = np.zeros(n_units)
+    for chunk_start in range(0, n_units, unit_chunk_size):
+        chunk = np.asarray(spike_matrix[chunk_start:chunk_start + unit_chunk_size], dtype=np.float64)
+        baseline = chunk[:, :, baseline_bins].mean(axis=1)
+        baseline_means = baseline.mean(axis=1, keepdims=True)
+        response = chunk[:, :, response_bins]
+
+        # one test per response bin, over trials
+        by_bin = response.transpose(0, 2, 1)
+        pvalues = mannwhitneyu_pvalues(baseline[:, np.newaxis, :], by_bin)
+        responsive = (pvalues < alpha) & (by_bin.mean(axis=-1) > baseline_means)
+        fracs_time_responsive[chunk_start:chunk_start + len(chunk)] = responsive.mean(axis=1)
+
+        # one test per trial, over response bins
+        pvalues = mannwhitneyu_pvalues(baseline[:, np.newaxis, :], response)
+        responsive = (pvalues < alpha) & (response.mean(axis=-1) > baseline_means)
+        fracs_trials_responsive[chunk_start:chunk_start + len(chunk)] = responsive.mean(axis=1)
+    return fracs_time_responsive, fracs_trials_responsive
+
+
+def get_first_spike_latencies(
+    start_times: Sequence[float],
+    units_spike_times,
+    unit_chunk_size: int = 256,
+) -> np.ndarray:
+    """
+    Return the time from each start time to each unit's next spike.
+
+    The next spike of every (unit, trial) is found with a single searchsorted
+    per chunk of units over the flat spike times (see spike_utils._find_windows).
+    As in optotagging.ipynb, start times at or after a unit's last spike have
+    no latency; they are NaN here.
+
+    Parameters
+    ----------
+    start_times : array-like
+        Times in seconds to measure from, e.g. the pulse onsets plus the censor period
+    units_spike_times : VectorIndex or list of arrays
+        units["spike_times"] from an NWB file, or one sorted array of spike times per unit
+    unit_chunk_size : int, optional
+        Number of units searched at once
+
+    Returns
+    -------
+    latencies : np.ndarray
+        Latencies in seconds with shape (units, trials)
+    """
+    start_times = np.asarray(start_times, dtype=np.float64)
+    flat_spike_times, index = get_ragged_arrays(units_spike_times)
+    n_units, n_trials = len(index), len(start_times)
+    starts = np.concatenate([[0], index[:-1]])
+
+    latencies = np.full((n_units, n_trials), np.nan)
+    if n_units == 0 or n_trials == 0:
+        return latencies
+
+    origin = start_times.min()
+    relative_starts = start_times - origin
+    for chunk_start in range(0, n_units, unit_chunk_size):
+        chunk_end = min(chunk_start + unit_chunk_size, n_units)
+        flat_start, flat_end = starts[chunk_start], index[chunk_end - 1]
+        chunk_spikes = np.asarray(flat_spike_times[flat_start:flat_end], dtype=np.float64) - origin
+        lengths = index[chunk_start:chunk_end] - starts[chunk_start:chunk_end]
+        first, _ = _find_windows(chunk_spikes, lengths, relative_starts, relative_starts)
+        first = first.reshape(chunk_end - chunk_start, n_trials)
+
+        unit_ends = np.cumsum(lengths)
+        last_spikes = np.full(len(lengths), -np.inf)
+        last_spikes[lengths > 0] = chunk_spikes[unit_ends[lengths > 0] - 1]
+        has_next = relative_starts < last_spikes[:, np.newaxis]
+        latencies[chunk_start:chunk_end][has_next] = (
+            chunk_spikes[first[has_next]] - np.broadcast_to(relative_starts, first.shape)[has_next]
+        )
+    return latencies
+
+
+def _median_and_mad(latencies: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the median and median absolute deviation over the last axis, ignoring NaN."""
+    with warnings.catch_warnings():
+        # units without any latency give NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        median = np.nanmedian(latencies, axis=-1)
+        mad = np.nanmedian(np.abs(latencies - median[..., np.newaxis]), axis=-1)
+    return median, mad
+
+
+def _get_latency_stats(
+    latencies: np.ndarray, baseline_latencies: np.ndarray, n_bootstrap: int, seed
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Return the KS salt p-values and the bootstrap standard errors of the latency and jitter of a chunk of units.
+
+    Runs in a worker process when n_processes is given to get_opto_metrics.
+    """
+    from scipy.stats import ks_2samp
+
+    salts = np.full(len(latencies), np.nan)
+    for unit_idx, (unit_latencies, unit_baseline) in enumerate(zip(latencies, baseline_latencies)):
+        unit_latencies = unit_latencies[~np.isnan(unit_latencies)]
+        unit_baseline = unit_baseline[~np.isnan(unit_baseline)]
+        if len(unit_latencies) > 0 and len(unit_baseline) > 0:
+            salts[unit_idx] = ks_2samp(unit_latencies, unit_baseline)[1]
+
+    latency_se = np.full(len(latencies), np.nan)
+    jitter_se = np.full(len(latencies), np.nan)
+    if n_bootstrap > 0:
+        rng = np.random.default_rng(seed)
+        latency_samples = np.empty((len(latencies), n_bootstrap))
+        jitter_samples = np.empty((len(latencies), n_bootstrap))
+        # resample trials in batches, bounding memory to units x batch x trials values
+        batch_size = max(1, 2 ** 22 // max(latencies.size, 1))
+        for batch_start in range(0, n_bootstrap, batch_size):
+            batch_end = min(batch_start + batch_size, n_bootstrap)
+            trial_idxs = rng.integers(0, latencies.shape[1], size=(batch_end - batch_start, latencies.shape[1]))
+            medians, mads = _median_and_mad(latencies[:, trial_idxs])
+            latency_samples[:, batch_start:batch_end] = medians
+            jitter_samples[:, batch_start:batch_end] = mads
+        latency_se = np.nanstd(latency_samples, axis=1)
+        jitter_se = np.nanstd(jitter_samples, axis=1)
+    return salts, latency_se, jitter_se
+
+
+def get_opto_metrics(
+    stim_times: Sequence[float],
+    units_spike_times,
+    spike_matrix: np.ndarray = None,
+    censor_period: float = 0.002,
+    stim_duration: float = 0.01,
+    time_resolution: float = 0.001,
+    window_start_time: float = -0.01,
+    window_end_time: float = 0.025,
+    alpha: float = 0.01,
+    n_bootstrap: int = 0,
+    seed: int = None,
+    n_processes: int = None,
+    unit_chunk_size: int = 256,
+) -> dict:
+    """
+    Compute the optotagging metrics of optotagging.ipynb for every unit at once.
+
+    Gives the same metrics as the notebook's get_opto_metrics, without its
+    loops over units, bins and trials: the rank tests of fraction_responsive
+    run batched over chunks of units, and the first spikes after every pulse
+    come from get_first_spike_latencies. The KS "salt" test, which compares
+    each unit's first-spike latencies after the pulses with those 10 ms
+    earlier, still runs per unit, optionally in worker processes together
+    with the trial bootstraps of the latency and jitter.
+
+    Parameters
+    ----------
+    stim_times : array-like
+        Onset times of the light pulses in seconds
+    units_spike_times : VectorIndex or list of arrays
+        units["spike_times"] from an NWB file, or one sorted array of spike times per unit
+    spike_matrix : np.ndarray, optional
+        Spike counts with shape (units, trials, bins) over the bins of
+        get_response_bins, if already computed. Computed here if not given.
+    censor_period, stim_duration, time_resolution, window_start_time, window_end_time : float, optional
+        As in the notebook; see get_response_bins
+    alpha : float, optional
+        Significance level of the rank tests
+    n_bootstrap : int, optional
+        Number of trial resamples used to estimate the standard errors of
+        the first spike latency and jitter. Skipped when 0.
+    seed : int, optional
+        Seed of the bootstrap resampling. Results do not depend on n_processes.
+    n_processes : int, optional
+        Run the salt tests and bootstraps over this many worker processes
+    unit_chunk_size : int, optional
+        Number of units processed at once
+
+    Returns
+    -------
+    dict
+        Arrays with shape (units,) under the column names of the notebook's
+        DataFrame, so that pd.DataFrame(metrics) reproduces it, plus
+        "first spike latency se" and "first spike jitter se" when n_bootstrap > 0
+    """
+    stim_times = np.asarray(stim_times, dtype=np.float64)
+    bin_edges, baseline_bins, response_bins = get_response_bins(
+        censor_period, stim_duration, time_resolution, window_start_time, window_end_time
+    )
+    if spike_matrix is None:
+        spike_matrix = get_spike_matrix(
+            stim_times, units_spike_times, bin_edges, unit_chunk_size=unit_chunk_size, dtype=np.int32
+        )
+    n_units, n_trials = spike_matrix.shape[:2]
+
+    response_counts = np.asarray(spike_matrix[:, :, response_bins], dtype=np.float64).sum(axis=1)
+    mean_response_spike_rates = np.mean(response_counts / n_trials, axis=1)
+    fracs_time_responsive, fracs_trials_responsive = fraction_responsive(
+        spike_matrix, baseline_bins, response_bins, alpha=alpha, unit_chunk_size=unit_chunk_size
+    )
+
+    # latencies are measured from the end of the censor period and include it, as in the notebook
+    start_times = stim_times + censor_period
+    latencies = get_first_spike_latencies(start_times, units_spike_times, unit_chunk_size) + censor_period
+    baseline_latencies = (
+        get_first_spike_latencies(start_times - 0.01, units_spike_times, unit_chunk_size) + censor_period
+    )
+    first_spike_latencies, first_spike_jitters = _median_and_mad(latencies)
+
+    # fixed chunks with their own seeds, so that the bootstrap does not depend on n_processes
+    chunk_starts = range(0, n_units, unit_chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_starts))
+    chunk_args = [
+        (
+            latencies[start:start + unit_chunk_size],
+            baseline_latencies[start:start + unit_chunk_size],
+            n_bootstrap,
+            chunk_seed,
+        )
+        for start, chunk_seed in zip(chunk_starts, seeds)
+    ]
+    if n_processes is None or n_processes <= 1 or len(chunk_args) <= 1:
+        results = [_get_latency_stats(*args) for args in chunk_args]
+    else:
+        with ProcessPoolExecutor(max_workers=n_processes) as executor:
+            results = list(executor.map(_get_latency_stats, *zip(*chunk_args)))
+    salts = np.concatenate([np.zeros(0)] + [result[0] for result in results])
+    latency_se = np.concatenate([np.zeros(0)] + [result[1] for result in results])
+    jitter_se = np.concatenate([np.zeros(0)] + [result[2] for result in results])
+
+    metrics = {
+        "mean response spike rate": mean_response_spike_rates,
+        "first spike jitter": first_spike_jitters,
+        "first spike latency": first_spike_latencies,
+        "fraction time responsive": fracs_time_responsive,
+        "fraction trials responsive": fracs_trials_responsive,
+        "ks salt value": salts,
+    }
+    if n_bootstrap > 0:
+        metrics["first spike latency se"] = latency_se
+        metrics["first spike jitter se"] = jitter_se
+    return metrics
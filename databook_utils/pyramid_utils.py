@@ -0,0 +1,229 @@
+import json
+import math
+import os
+import shutil
+
+import numpy as np
+
+from typing import Sequence, Tuple, Union
+
+from databook_utils.spike_utils import get_ragged_arrays
+
+_META_FILENAME = "pyramid.json"
+
+
+def _level_filename(level: int) -> str:
+    return f"level_{level}.npy"
+
+
+class SpikeCountPyramid:
+    """
+    On-disk spike counts of every unit at power-of-two multiples of a base bin size.
+
+    Level k holds each unit's spike counts in bins of base_bin_size * 2**k
+    seconds from start_time, as a (units, bins) .npy file, so the counts of a
+    time range at any zoom are read from one level and summed instead of
+    rebinning the spike times. Build it once with build, then open it with
+    SpikeCountPyramid(path). The levels are read-only memory maps, so any
+    number of notebooks or worker processes can share them; a pyramid
+    pickles as its path.
+
+    Parameters
+    ----------
+    path : str or PathLike
+        Directory written by build
+    """
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        self.path = str(path)
+        with open(os.path.join(self.path, _META_FILENAME), "r") as fp:
+            meta = json.load(fp)
+        self.base_bin_size = meta["base_bin_size"]
+        self.start_time = meta["start_time"]
+        self.end_time = meta["end_time"]
+        self.levels = [
+            np.load(os.path.join(self.path, _level_filename(level)), mmap_mode="r")
+            for level in range(meta["n_levels"])
+        ]
+
+    @classmethod
+    def build(
+        cls,
+        units_spike_times,
+        path: Union[str, os.PathLike],
+        base_bin_size: float = 0.01,
+        start_time: float = 0,
+        end_time: float = None,
+        unit_chunk_size: int = 64,
+    ) -> "SpikeCountPyramid":
+        """
+        Build a pyramid in one streaming pass over the spike times and return it.
+
+        Each chunk of units' spike times is read with one contiguous read, binned at
+        base_bin_size, and halved in resolution level by level into every level
+        file, so only one chunk of spikes and one unit's bins are in memory at once.
+        The pyramid is written to a staging directory and renamed into place.
+
+        Parameters
+        ----------
+        units_spike_times : VectorIndex, SpikeTimes or list of arrays
+            units["spike_times"] from an NWB file, or one sorted array of spike times per unit
+        path : str or PathLike
+            Directory to write the pyramid to, replacing any existing one
+        base_bin_size : float, optional
+            Bin size in seconds of the finest level
+        start_time, end_time : float, optional
+            Time range covered by the pyramid, including end_time. end_time defaults to the last spike.
+        unit_chunk_size : int, optional
+            Number of units read at once
+
+        Returns
+        -------
+        SpikeCountPyramid
+            The pyramid, opened from path
+        """
+        path = str(path)
+        flat_spike_times, index = get_ragged_arrays(units_spike_times)
+        starts = np.concatenate([[0], index[:-1]]).astype(np.int64)
+        lengths = index - starts
+        if end_time is None:
+            # only each unit's last spike is read; h5py needs increasing, unique indices
+            last_idxs = np.unique(index[lengths > 0] - 1)
+            end_time = float(np.max(flat_spike_times[last_idxs], initial=start_time)) if len(last_idxs) else start_time
+
+        # the bins cover end_time itself, so a last spike exactly at end_time is counted
+        n_base_bins = max(1, math.floor((end_time - start_time) / base_bin_size) + 1)
+        n_levels = math.ceil(math.log2(n_base_bins)) + 1
+        # counts of coarser levels are bounded by the units' total numbers of spikes
+        level_dtypes = [np.uint16] + [
+            np.uint16 if lengths.max(initial=0) <= np.iinfo(np.uint16).max else np.uint32
+        ] * (n_levels - 1)
+
+        staging_path = f"{path}.part"
+        shutil.rmtree(staging_path, ignore_errors=True)
+        os.makedirs(staging_path)
+        levels = [
+            np.lib.format.open_memmap(
+                os.path.join(staging_path, _level_filename(level)),
+                mode="w+",
+                dtype=level_dtypes[level],
+                shape=(len(index), math.ceil(n_base_bins / 2 ** level)),
+            )
+            for level in range(n_levels)
+        ]
+
+        for chunk_start in range(0, len(index), unit_chunk_size):
+            chunk_end = min(chunk_start + unit_chunk_size, len(index))
+            chunk_offset = starts[chunk_start]
+            chunk_spikes = np.asarray(flat_spike_times[chunk_offset:index[chunk_end - 1]], dtype=np.float64)
+            for unit_idx in range(chunk_start, chunk_end):
+                spike_times = chunk_spikes[starts[unit_idx] - chunk_offset:index[unit_idx] - chunk_offset]
+                bin_idxs = np.floor((spike_times - start_time) / base_bin_size).astype(np.int64)
+                bin_idxs = bin_idxs[(bin_idxs >= 0) & (bin_idxs < n_base_bins)]
+                counts = np.bincount(bin_idxs, minlength=n_base_bins)
+                if counts.max(initial=0) > np.iinfo(level_dtypes[0]).max:
+                    raise ValueError(f"Unit {unit_idx} has too many spikes per bin; use a smaller base_bin_size")
+                for level in range(n_levels):
+                    if level > 0:
+                        counts = np.pad(counts, (0, len(counts) % 2)).reshape(-1, 2).sum(axis=1)
+                    levels[level][unit_idx] = counts
+        for level in levels:
+            level.flush()
+        del levels
+
+        with open(os.path.join(staging_path, _META_FILENAME), "w") as fp:
+            json.dump({
+                "base_bin_size": base_bin_size,
+                "start_time": start_time,
+                "end_time": end_time,
+                "n_levels": n_levels,
+            }, fp)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(staging_path, path)
+        return cls(path)
+
+    def __reduce__(self):
+        return SpikeCountPyramid, (self.path,)
+
+    def __len__(self) -> int:
+        return len(self.levels[0])
+
+    def bin_size(self, level: int) -> float:
+        """Return the bin size in seconds of a level."""
+        return self.base_bin_size * 2 ** level
+
+    def _choose_level(self, start_time: float, bin_size: float, max_edge_error: float) -> int:
+        """
+        Return the coarsest level whose bins the requested bins are made of exactly, if any.
+
+        Otherwise, return the coarsest level fine enough to place each bin edge
+        within max_edge_error * bin_size of the requested time.
+        """
+        if bin_size < self.base_bin_size * (1 - 1e-9):
+            raise ValueError(
+                f"bin_size {bin_size} is finer than the pyramid's base bin size {self.base_bin_size}; "
+                "count the spike times directly, e.g. with spike_utils.get_window_counts"
+            )
+        for level in reversed(range(len(self.levels))):
+            level_bin_size = self.bin_size(level)
+            bins_per_bin = bin_size / level_bin_size
+            start_bins = (start_time - self.start_time) / level_bin_size
+            if bins_per_bin >= 1 - 1e-9 and all(abs(x - round(x)) < 1e-6 for x in (bins_per_bin, start_bins)):
+                return level
+        # rounding each edge to the nearest level bin moves it by at most half a level bin
+        finest_level = math.floor(math.log2(2 * max_edge_error * bin_size / self.base_bin_size))
+        return min(max(finest_level, 0), len(self.levels) - 1)
+
+    def get_counts(
+        self,
+        start_time: float,
+        end_time: float,
+        bin_size: float,
+        unit_idxs: Sequence[int] = None,
+        max_edge_error: float = 0.05,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return spike counts of a time range at any bin size, summed from the closest pyramid level.
+
+        When the bins are made of whole bins of a level, as when bin_size is a
+        power-of-two multiple of the base bin size and start_time falls on its
+        grid, the counts are exact. Otherwise each bin edge is rounded to the
+        nearest edge of a level fine enough to move it by no more than
+        max_edge_error * bin_size, and the actual edges are returned.
+
+        Parameters
+        ----------
+        start_time, end_time : float
+            Time range in seconds
+        bin_size : float
+            Bin size in seconds, at least the pyramid's base bin size
+        unit_idxs : list of int, optional
+            Units to return. Defaults to every unit.
+        max_edge_error : float, optional
+            Largest shift of a bin edge, as a fraction of bin_size, when the bins are not exact
+
+        Returns
+        -------
+        counts : np.ndarray
+            Spike counts with shape (units, bins); zero outside the pyramid's time range
+        bin_edges : np.ndarray
+            Times in seconds of the bin edges used, with shape (bins + 1,)
+        """
+        n_bins = max(0, int(round((end_time - start_time) / bin_size)))
+        level = self._choose_level(start_time, bin_size, max_edge_error)
+        level_bin_size = self.bin_size(level)
+        level_counts = self.levels[level]
+
+        edge_idxs = np.round((start_time + np.arange(n_bins + 1) * bin_size - self.start_time) / level_bin_size)
+        edge_idxs = edge_idxs.astype(np.int64)
+        bin_edges = self.start_time + edge_idxs * level_bin_size
+        clipped_idxs = np.clip(edge_idxs, 0, level_counts.shape[1])
+
+        # one read of the level's bins in range, then cumulative sums give every bin's count
+        first, last = clipped_idxs[0], clipped_idxs[-1]
+        rows = slice(None) if unit_idxs is None else np.asarray(unit_idxs)
+        in_range = level_counts[rows, first:last]
+        cumulative = np.zeros((len(in_range), last - first + 1), dtype=np.int64)
+        np.cumsum(in_range, axis=1, dtype=np.int64, out=cumulative[:, 1:])
+        counts = np.diff(cumulative[:, clipped_idxs - first], axis=1)
+        return counts, bin_edges
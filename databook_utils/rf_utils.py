@@ -0,0 +1,146 @@
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Sequence, Tuple
+
+from databook_utils.spike_utils import SpikeTimes, get_ragged_arrays, get_window_counts
+from databook_utils.stim_utils import get_stimulus_table
+
+
+# names that the RF mapping tables of different projects use for the x position
+_POSITION_KEYS = ("pos_x", "x_position", "x_pos", "X")
+
+
+def get_position_keys(columns: Sequence[str]) -> Tuple[str, str]:
+    """Return the names of the x and y position columns of an RF stimulus table."""
+    for coord_key in _POSITION_KEYS:
+        if coord_key in columns:
+            return coord_key, coord_key.replace("x", "y").replace("X", "Y")
+    raise ValueError("Could not find x and y columns in RF intervals table")
+
+
+def _get_rf_columns(rf_stim_table) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return the start times and x and y positions of an RF table given as a DataFrame or intervals table."""
+    import pandas as pd
+
+    if isinstance(rf_stim_table, pd.DataFrame):
+        x_key, y_key = get_position_keys(rf_stim_table.columns)
+        return (
+            rf_stim_table["start_time"].to_numpy(dtype=np.float64),
+            rf_stim_table[x_key].to_numpy(),
+            rf_stim_table[y_key].to_numpy(),
+        )
+    table = get_stimulus_table(rf_stim_table)
+    x_key, y_key = get_position_keys(table.stim_table.colnames)
+    return np.asarray(table["start_time"], dtype=np.float64), table[x_key], table[y_key]
+
+
+def _get_position_sums(units_spike_times, onsets, response_window, position_onehot, unit_chunk_size) -> np.ndarray:
+    """Sum each unit's spike counts over the presentations at each position. Runs in a worker process when n_processes is given."""
+    counts = get_window_counts(onsets, onsets + response_window, units_spike_times, unit_chunk_size=unit_chunk_size)
+    return counts @ position_onehot
+
+
+def get_receptive_fields(
+    units_spike_times,
+    rf_stim_table,
+    unit_idxs: Sequence[int] = None,
+    xs: Sequence[float] = None,
+    ys: Sequence[float] = None,
+    response_window: float = 0.2,
+    n_processes: int = None,
+    unit_chunk_size: int = 256,
+) -> np.ndarray:
+    """
+    Compute the receptive fields of many units in one pass over the RF mapping table.
+
+    Gives the same maps as calling get_rf_vectorized from receptive_fields.ipynb
+    once per unit: the mean number of spikes in the response window after each
+    gabor onset, per gabor position. Here the table is grouped by position only
+    once, every unit's spikes are counted in every response window with a
+    single search per chunk of units (see spike_utils.get_window_counts), and
+    the counts are summed into positions with one matrix product.
+
+    Parameters
+    ----------
+    units_spike_times : VectorIndex or list of arrays
+        units["spike_times"] from an NWB file, or one sorted array of spike
+        times per unit
+    rf_stim_table : DataFrame, TimeIntervals or StimulusTable
+        The RF mapping table, e.g. nwb.intervals["gabors_presentations"] or its to_dataframe()
+    unit_idxs : list of int, optional
+        Units to compute, e.g. selected_unit_idxs. Defaults to every unit.
+    xs, ys : array-like, optional
+        Positions of the map's columns and rows. Default to every x and y position in the table.
+    response_window : float, optional
+        Time window after stimulus onset to count spikes (default: 0.2 seconds)
+    n_processes : int, optional
+        Split the units over this many worker processes. Runs in the calling process if not given.
+    unit_chunk_size : int, optional
+        Number of units searched at once by each process
+
+    Returns
+    -------
+    unit_rfs : np.ndarray
+        Mean spike counts with shape (units, ys, xs); NaN for positions that were never shown
+    """
+    onsets, x_positions, y_positions = _get_rf_columns(rf_stim_table)
+    xs = np.sort(np.unique(x_positions)) if xs is None else np.asarray(xs)
+    ys = np.sort(np.unique(y_positions)) if ys is None else np.asarray(ys)
+
+    # one-hot (presentations x positions) matrix, flattening positions as yi * len(xs) + xi
+    xi, yi = np.searchsorted(xs, x_positions), np.searchsorted(ys, y_positions)
+    shown = (xi < len(xs)) & (yi < len(ys))
+    shown[shown] = (xs[xi[shown]] == x_positions[shown]) & (ys[yi[shown]] == y_positions[shown])
+    n_positions = len(ys) * len(xs)
+    position_onehot = np.zeros((shown.sum(), n_positions))
+    position_onehot[np.arange(shown.sum()), yi[shown] * len(xs) + xi[shown]] = 1
+    onsets = onsets[shown]
+    n_shown = position_onehot.sum(axis=0)
+
+    if unit_idxs is not None:
+        flat_spike_times, index = get_ragged_arrays(units_spike_times)
+        unit_idxs = np.arange(len(index))[np.asarray(unit_idxs, dtype=np.int64)]
+        n_units = len(unit_idxs)
+        if n_units == 0:
+            return np.empty((0, len(ys), len(xs)))
+        # one contiguous read of the spikes from the first to the last selected unit,
+        # instead of one VectorIndex read per selected unit or a read of every unit
+        first, last = unit_idxs.min(), unit_idxs.max()
+        span_start = int(index[first - 1]) if first > 0 else 0
+        span = SpikeTimes(
+            np.asarray(flat_spike_times[span_start:int(index[last])], dtype=np.float64),
+            index[first:last + 1] - span_start,
+        )
+        units_spike_times = [span[unit_idx - first] for unit_idx in unit_idxs]
+    else:
+        n_units = len(units_spike_times)
+
+    if n_processes is None or n_processes <= 1 or n_units == 0:
+        sums = _get_position_sums(units_spike_times, onsets, response_window, position_onehot, unit_chunk_size)
+    else:
+        # workers attach to the spike times in shared memory (or their cache file) instead of receiving copies,
+        # since open HDF5 datasets cannot be pickled
+        if isinstance(units_spike_times, SpikeTimes) and units_spike_times.is_shareable:
+            shared_spike_times = units_spike_times
+        else:
+            shared_spike_times = SpikeTimes.from_units(units_spike_times).share()
+        splits = np.array_split(np.arange(n_units), min(n_processes, n_units))
+        try:
+            with ProcessPoolExecutor(max_workers=n_processes) as executor:
+                futures = [
+                    executor.submit(
+                        _get_position_sums,
+                        shared_spike_times[split[0]:split[-1] + 1],
+                        onsets, response_window, position_onehot, unit_chunk_size,
+                    )
+                    for split in splits
+                ]
+                sums = np.concatenate([future.result() for future in futures])
+        finally:
+            if shared_spike_times is not units_spike_times:
+                shared_spike_times.close()
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        unit_rfs = sums / n_shown
+    return unit_rfs.reshape(n_units, len(ys), len(xs))
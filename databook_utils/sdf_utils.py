@@ -0,0 +1,314 @@
+import numpy as np
+
+from typing import Tuple
+
+# scipy.signal is imported by the functions that use it, since it takes about half a second to import
+
+KERNELS = ("exponential", "gaussian", "boxcar")
+METHODS = ("auto", "recursive", "fft")
+# standard deviations in bins for which the recursive Gaussian is within about 4% of the exact kernel's peak
+RECURSIVE_GAUSSIAN_SIGMAS = (3, 80)
+
+
+def get_kernel(kernel: str = "exponential", width: float = 0.01, time_resolution: float = 0.001) -> np.ndarray:
+    """
+    Return the normalized weights of a smoothing kernel.
+
+    The kernel is centered on index len(weights) // 2, as in scipy.ndimage.convolve1d.
+
+    Parameters
+    ----------
+    kernel : str, optional
+        "exponential" for the causal exponential filter of test_unit_responses.ipynb,
+        with time constant width and truncated after 5 time constants; "gaussian"
+        for a Gaussian with standard deviation width, truncated at 4 standard
+        deviations as in scipy.ndimage.gaussian_filter1d; or "boxcar" for a
+        centered moving average over width seconds
+    width : float, optional
+        Width of the kernel in seconds, as above
+    time_resolution : float, optional
+        Bin size in seconds
+
+    Returns
+    -------
+    weights : np.ndarray
+        Kernel weights, summing to 1
+    """
+    if kernel == "exponential":
+        n_taus = int(5 * width / time_resolution)
+        weights = np.zeros(n_taus * 2)
+        weights[n_taus:] = np.exp(-np.arange(n_taus) / (width / time_resolution))
+    elif kernel == "gaussian":
+        sigma = width / time_resolution
+        radius = int(4 * sigma + 0.5)
+        weights = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+    elif kernel == "boxcar":
+        weights = np.ones(max(1, int(round(width / time_resolution))))
+    else:
+        raise ValueError(f"kernel must be one of {KERNELS}, got {kernel!r}")
+    if weights.sum() == 0:
+        raise ValueError(f"width of {width} s is too small for a time_resolution of {time_resolution} s")
+    return weights / weights.sum()
+
+
+def _reflect_pad(x: np.ndarray, before: int, after: int) -> np.ndarray:
+    """Pad the last axis like scipy.ndimage's "reflect" mode (d c b a | a b c d | d c b a)."""
+    return np.pad(x, [(0, 0)] * (x.ndim - 1) + [(before, after)], mode="symmetric")
+
+
+def _gaussian_recursive_coefs(sigma: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the lfilter coefficients of the third-order recursive Gaussian of Young & van Vliet (1995).
+
+    Its impulse response differs from the exact Gaussian by up to about 4% of
+    the peak for sigma of 3 to 80 bins (1.5% at 20 bins), and by more outside
+    that range: 9% at 1 bin, 6% at 100 bins and over 40% at 300 bins.
+    """
+    if sigma >= 2.5:
+        q = 0.98711 * sigma - 0.96330
+    else:
+        q = 3.97156 - 4.14554 * np.sqrt(1 - 0.26891 * sigma)
+    b0 = 1.57825 + 2.44413 * q + 1.4281 * q ** 2 + 0.422205 * q ** 3
+    b1 = 2.44413 * q + 2.85619 * q ** 2 + 1.26661 * q ** 3
+    b2 = -(1.4281 * q ** 2 + 1.26661 * q ** 3)
+    b3 = 0.422205 * q ** 3
+    return np.array([1 - (b1 + b2 + b3) / b0]), np.array([1, -b1 / b0, -b2 / b0, -b3 / b0])
+
+
+def _smooth_recursive(x: np.ndarray, kernel: str, weights: np.ndarray, width_bins: float) -> np.ndarray:
+    """Smooth the last axis of x with a recursive filter of O(1) operations per bin, whatever the kernel width."""
+    from scipy.signal import lfilter
+
+    n_bins = x.shape[-1]
+    n_weights = len(weights)
+    center = n_weights // 2
+    if kernel == "gaussian":
+        # forward and backward passes of an approximate recursive Gaussian, padded past its support
+        b, a = _gaussian_recursive_coefs(width_bins)
+        b, a = b.astype(x.dtype), a.astype(x.dtype)
+        padded = _reflect_pad(x, center, center)
+        padded = lfilter(b, a, padded, axis=-1)
+        padded = lfilter(b, a, padded[..., ::-1], axis=-1)[..., ::-1]
+        return padded[..., center:center + n_bins]
+
+    # the truncated exponential and the boxcar are exactly y[i] = r * y[i - 1] + w0 * (x[i] - r^n * x[i - n]),
+    # with r the ratio between successive weights and n the number of nonzero weights
+    nonzero = np.flatnonzero(weights)
+    first, n_nonzero = nonzero[0], len(nonzero)
+    ratio = weights[first + 1] / weights[first] if n_nonzero > 1 else 0
+    # output i sums x[i + center - first - n_nonzero + 1] to x[i + center - first]
+    padded = _reflect_pad(x, n_nonzero - 1 - center + first, center - first)
+    # the comb x[i] - r^n * x[i - n] is applied with slices, leaving lfilter a single feedback tap
+    combed = padded.copy()
+    combed[..., n_nonzero:] -= ratio ** n_nonzero * padded[..., :-n_nonzero]
+    b = np.array([weights[first]], dtype=x.dtype)
+    a = np.array([1, -ratio], dtype=x.dtype)
+    filtered = lfilter(b, a, combed, axis=-1)
+    return filtered[..., n_nonzero - 1:n_nonzero - 1 + n_bins]
+
+
+def _resolve_method(kernel: str, method: str, width_bins: float, n_bins: int) -> str:
+    """
+    Return "recursive" or "fft", for the method requested of smooth.
+
+    The recursive Gaussian is only used for sigmas in RECURSIVE_GAUSSIAN_SIGMAS
+    whose kernel fits in the signal, where it is accurate, and FFT otherwise.
+    """
+    if method == "auto":
+        return "fft" if kernel == "gaussian" else "recursive"
+    if method == "recursive" and kernel == "gaussian":
+        low, high = RECURSIVE_GAUSSIAN_SIGMAS
+        if not low <= width_bins <= high or int(4 * width_bins + 0.5) > n_bins:
+            return "fft"
+    return method
+
+
+def _smooth_fft(x: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Smooth the last axis of x with an FFT convolution, for any kernel."""
+    from scipy.signal import fftconvolve
+
+    center = len(weights) // 2
+    padded = _reflect_pad(x, len(weights) - 1 - center, center)
+    weights = weights.astype(x.dtype).reshape((1,) * (x.ndim - 1) + (-1,))
+    return fftconvolve(padded, weights, mode="valid", axes=-1)
+
+
+def smooth(
+    counts: np.ndarray,
+    kernel: str = "exponential",
+    width: float = 0.01,
+    time_resolution: float = 0.001,
+    method: str = "auto",
+) -> np.ndarray:
+    """
+    Smooth spike counts along their last (time) axis.
+
+    Gives the same result as scipy.ndimage.convolve1d(counts, get_kernel(kernel,
+    width, time_resolution), axis=-1), whose cost grows with the kernel length.
+    The "recursive" method instead runs an IIR filter with a constant cost per
+    bin: exact for the exponential and boxcar kernels, and the approximate
+    recursive Gaussian of Young & van Vliet (1995) for the Gaussian kernel.
+    The "fft" method convolves with the exact kernel in the Fourier domain.
+    "auto" picks "recursive" for the exponential and boxcar kernels and "fft"
+    for the Gaussian. As the recursive Gaussian is within about 4% of the
+    exact one only for standard deviations of 3 to 80 bins (see
+    RECURSIVE_GAUSSIAN_SIGMAS), "recursive" falls back to "fft" for other
+    widths, and for kernels wider than the signal.
+
+    Parameters
+    ----------
+    counts : np.ndarray
+        Spike counts, with time bins on the last axis. Smoothed in the precision of
+        its dtype if floating point, and in float64 otherwise.
+    kernel, width, time_resolution : optional
+        Smoothing kernel, as in get_kernel
+    method : str, optional
+        "auto", "recursive" or "fft"
+
+    Returns
+    -------
+    np.ndarray
+        Smoothed counts with the shape of counts
+    """
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}, got {method!r}")
+    weights = get_kernel(kernel, width, time_resolution)
+    if not np.issubdtype(counts.dtype, np.floating):
+        counts = counts.astype(np.float64)
+    method = _resolve_method(kernel, method, width / time_resolution, counts.shape[-1])
+    if method == "fft":
+        return _smooth_fft(counts, weights)
+    return _smooth_recursive(counts, kernel, weights, width / time_resolution)
+
+
+def get_sdfs(
+    spike_matrix: np.ndarray,
+    kernel: str = "exponential",
+    width: float = 0.01,
+    time_resolution: float = 0.001,
+    method: str = "auto",
+    dtype=np.float32,
+    unit_chunk_size: int = 256,
+    out: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Compute the spike density function (firing rate) of every unit in every trial.
+
+    Computes sdfs of test_unit_responses.ipynb, smoothing chunks of units at a
+    time so that the only full-size array is the result, which by default is
+    float32 to halve its memory. Pass out=spike_matrix, if it already has a
+    floating point dtype, to overwrite the counts in place.
+
+    Parameters
+    ----------
+    spike_matrix : np.ndarray
+        Spike counts with shape (units, trials, bins), e.g. from spike_utils.get_spike_matrix
+    kernel, width, time_resolution, method : optional
+        Smoothing, as in smooth
+    dtype : data-type, optional
+        Data type of the result and of the smoothing, if out is not given
+    unit_chunk_size : int, optional
+        Number of units smoothed at once, bounding the temporary memory
+    out : np.ndarray, optional
+        Array with the shape of spike_matrix to write the SDFs into
+
+    Returns
+    -------
+    sdfs : np.ndarray
+        Firing rates in spikes per second with shape (units, trials, bins)
+    """
+    if out is None:
+        out = np.empty(spike_matrix.shape, dtype=dtype)
+    elif out.shape != spike_matrix.shape:
+        raise ValueError(f"out has shape {out.shape}, expected {spike_matrix.shape}")
+
+    for chunk_start in range(0, len(spike_matrix), unit_chunk_size):
+        chunk = np.asarray(spike_matrix[chunk_start:chunk_start + unit_chunk_size], dtype=out.dtype)
+        sdfs = smooth(chunk, kernel, width, time_resolution, method)
+        sdfs /= time_resolution
+        out[chunk_start:chunk_start + len(chunk)] = sdfs
+    return out
+
+
+def _get_baseline_weights(
+    n_bins: int, baseline_bins: slice, kernel: str, width: float, time_resolution: float, method: str
+) -> np.ndarray:
+    """
+    Return w such that counts @ w is the mean SDF over baseline_bins.
+
+    Smoothing is linear, so w is its adjoint applied to the averaging over
+    baseline_bins: a convolution with the reversed kernel, after which the
+    reflected padding is folded back onto the bins it was copied from.
+    """
+    weights = get_kernel(kernel, width, time_resolution)
+    center = len(weights) // 2
+    averaging = np.zeros(n_bins)
+    averaging[baseline_bins] = 1
+    averaging /= averaging.sum() * time_resolution
+    if kernel == "gaussian" and _resolve_method(kernel, method, width / time_resolution, n_bins) == "recursive":
+        from scipy.signal import lfilter
+
+        # the forward and backward passes over the padded bins together are their own adjoint
+        b, a = _gaussian_recursive_coefs(width / time_resolution)
+        padded_weights = np.pad(averaging, center)
+        padded_weights = lfilter(b, a, padded_weights)
+        padded_weights = lfilter(b, a, padded_weights[::-1])[::-1]
+    else:
+        padded_weights = np.convolve(averaging, weights[::-1], mode="full")
+    # the bin that each bin of the padded counts in smooth is a copy of
+    padded_bins = _reflect_pad(np.arange(n_bins), len(weights) - 1 - center, center)
+    return np.bincount(padded_bins, weights=padded_weights, minlength=n_bins)
+
+
+def get_mean_normalized_sdfs(
+    spike_matrix: np.ndarray,
+    kernel: str = "exponential",
+    width: float = 0.01,
+    time_resolution: float = 0.001,
+    baseline_bins: slice = slice(None),
+    method: str = "auto",
+    unit_chunk_size: int = 256,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the trial-averaged SDF of each unit relative to its baseline, without per-trial SDFs.
+
+    Computes mean_normalized_sdfs and baseline_sdfs of test_unit_responses.ipynb,
+    i.e. smooths every trial, subtracts each trial's mean firing rate over
+    baseline_bins (all bins in the notebook) and averages across trials. As
+    smoothing is linear, the trial average is smoothed once per unit instead,
+    and each trial's baseline is a dot product of its counts with the
+    contribution of each bin to the baseline. So no (units, trials, bins) SDF
+    array is ever made and the smoothing cost does not grow with trials.
+
+    Parameters
+    ----------
+    spike_matrix : np.ndarray
+        Spike counts with shape (units, trials, bins), e.g. from spike_utils.get_spike_matrix
+    kernel, width, time_resolution, method : optional
+        Smoothing, as in smooth
+    baseline_bins : slice, optional
+        Bins whose mean firing rate is subtracted from each trial
+    unit_chunk_size : int, optional
+        Number of units processed at once
+
+    Returns
+    -------
+    mean_normalized_sdfs : np.ndarray
+        Trial-averaged SDFs relative to baseline with shape (units, bins)
+    baseline_sdfs : np.ndarray
+        Baseline firing rate of each trial with shape (units, trials)
+    """
+    n_units, n_trials, n_bins = spike_matrix.shape
+    baseline_weights = _get_baseline_weights(n_bins, baseline_bins, kernel, width, time_resolution, method)
+
+    mean_normalized_sdfs = np.empty((n_units, n_bins))
+    baseline_sdfs = np.empty((n_units, n_trials))
+    for chunk_start in range(0, n_units, unit_chunk_size):
+        chunk = np.asarray(spike_matrix[chunk_start:chunk_start + unit_chunk_size], dtype=np.float64)
+        chunk_end = chunk_start + len(chunk)
+        baseline_sdfs[chunk_start:chunk_end] = chunk @ baseline_weights
+        mean_sdfs = smooth(chunk.mean(axis=1), kernel, width, time_resolution, method) / time_resolution
+        mean_normalized_sdfs[chunk_start:chunk_end] = (
+            mean_sdfs - baseline_sdfs[chunk_start:chunk_end].mean(axis=1, keepdims=True)
+        )
+    return mean_normalized_sdfs, baseline_sdfs
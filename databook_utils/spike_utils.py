@@ -0,0 +1,448 @@
+import os
+import shutil
+import time
+
+import numpy as np
+
+from multiprocessing import shared_memory
+from typing import Sequence, Tuple, Union
+
+_DATA_FILENAME = "spike_times.npy"
+_INDEX_FILENAME = "index.npy"
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """Attach to an existing shared memory block without making this process responsible for unlinking it."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # track was added in Python 3.13; before it, attaching processes share the creator's resource tracker
+        return shared_memory.SharedMemory(name=name)
+
+
+def _reopen_spike_times(source: tuple, unit_start: int, unit_stop: int) -> "SpikeTimes":
+    """Recreate a pickled SpikeTimes from the file or shared memory it was backed by."""
+    if source[0] == "file":
+        spike_times = SpikeTimes.load(source[1])
+    else:
+        _, data_name, index_name, n_spikes, n_units = source
+        data_block, index_block = _attach_shared_memory(data_name), _attach_shared_memory(index_name)
+        spike_times = SpikeTimes(
+            np.ndarray(n_spikes, dtype=np.float64, buffer=data_block.buf),
+            np.ndarray(n_units, dtype=np.int64, buffer=index_block.buf),
+        )
+        spike_times._source = source
+        spike_times._blocks = (data_block, index_block)
+    if (unit_start, unit_stop) == (0, len(spike_times)):
+        return spike_times
+    return spike_times[unit_start:unit_stop]
+
+
+class SpikeTimes:
+    """
+    Ragged spike times of many units in one flat array, with zero-copy per-unit views.
+
+    Indexing units["spike_times"][unit_idx] slices the HDF5 data through the
+    VectorIndex and copies it on every access, and cannot be sent to worker
+    processes. SpikeTimes instead holds the flat spike times and the end
+    offset of each unit, read once, memory-mapped from a local cache file
+    (see from_units and save), or placed in shared memory (see share).
+    spike_times[unit_idx] is a view into the flat array, and spike_times[a:b]
+    a SpikeTimes view of a range of units. It can be passed anywhere
+    units["spike_times"] is accepted. A SpikeTimes backed by a file or by
+    shared memory pickles as a reference to it, so worker processes attach
+    to the same memory instead of receiving a copy.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Every unit's spike times concatenated, in seconds
+    index : np.ndarray
+        End offset of each unit's spike times in data
+    """
+
+    def __init__(self, data: np.ndarray, index: np.ndarray):
+        self.data = data
+        self.index = index
+        # range of units of this SpikeTimes in the arrays of _source, for views
+        self._unit_start, self._unit_stop = 0, len(index)
+        # ("file", path) or ("shared", data name, index name, n_spikes, n_units) when not held in private memory
+        self._source = None
+        self._blocks = None
+        self._owner = False
+        self._is_view = False
+
+    @classmethod
+    def from_units(cls, units_spike_times, cache_path: Union[str, os.PathLike] = None) -> "SpikeTimes":
+        """
+        Read a ragged spike_times column once, or memory-map it from a cache written by an earlier call.
+
+        Parameters
+        ----------
+        units_spike_times : VectorIndex or list of arrays
+            units["spike_times"] from an NWB file, or one sorted array of spike times per unit
+        cache_path : str or PathLike, optional
+            Directory to save the spike times to on the first call, and to
+            memory-map them from on later calls instead of reading the NWB file
+        """
+        if cache_path is not None and os.path.exists(os.path.join(cache_path, _INDEX_FILENAME)):
+            return cls.load(cache_path)
+        flat_spike_times, index = get_ragged_arrays(units_spike_times)
+        spike_times = cls(np.asarray(flat_spike_times[:], dtype=np.float64), index)
+        if cache_path is None:
+            return spike_times
+        spike_times.save(cache_path)
+        return cls.load(cache_path)
+
+    @classmethod
+    def load(cls, path: Union[str, os.PathLike]) -> "SpikeTimes":
+        """Memory-map spike times written by save, so they are only read from disk when used."""
+        path = str(path)
+        spike_times = cls(
+            np.load(os.path.join(path, _DATA_FILENAME), mmap_mode="r"),
+            np.load(os.path.join(path, _INDEX_FILENAME), mmap_mode="r"),
+        )
+        spike_times._source = ("file", path)
+        return spike_times
+
+    def save(self, path: Union[str, os.PathLike]) -> None:
+        """Write the spike times to a directory of .npy files, replacing it atomically."""
+        path = str(path)
+        staging_path = f"{path}.part"
+        shutil.rmtree(staging_path, ignore_errors=True)
+        os.makedirs(staging_path)
+        np.save(os.path.join(staging_path, _DATA_FILENAME), np.asarray(self.data, dtype=np.float64))
+        np.save(os.path.join(staging_path, _INDEX_FILENAME), np.asarray(self.index, dtype=np.int64))
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(staging_path, path)
+
+    def share(self) -> "SpikeTimes":
+        """
+        Return a copy of the spike times in shared memory, for worker processes to attach to.
+
+        The returned SpikeTimes owns the shared memory, which is freed by its
+        close method or at the end of a with block. Views of it, including
+        those obtained by workers, must not be used afterwards.
+        """
+        blocks = []
+        try:
+            for values, dtype in ((self.data, np.float64), (self.index, np.int64)):
+                block = shared_memory.SharedMemory(create=True, size=max(len(values) * np.dtype(dtype).itemsize, 1))
+                blocks.append(block)
+                np.ndarray(len(values), dtype=dtype, buffer=block.buf)[:] = values
+        except BaseException:
+            for block in blocks:
+                block.close()
+                block.unlink()
+            raise
+        data_block, index_block = blocks
+        shared = SpikeTimes(
+            np.ndarray(len(self.data), dtype=np.float64, buffer=data_block.buf),
+            np.ndarray(len(self.index), dtype=np.int64, buffer=index_block.buf),
+        )
+        shared._source = ("shared", data_block.name, index_block.name, len(self.data), len(self.index))
+        shared._blocks = (data_block, index_block)
+        shared._owner = True
+        return shared
+
+    def close(self) -> None:
+        """Release the shared memory of a SpikeTimes from share, or detach from it in a worker."""
+        if self._blocks is None:
+            return
+        blocks, self._blocks = self._blocks, None
+        self.data = self.index = None
+        if self._is_view:
+            # the blocks are closed by the SpikeTimes this is a view of, or when no longer referenced
+            return
+        for block in blocks:
+            block.close()
+            if self._owner:
+                block.unlink()
+
+    @property
+    def is_shareable(self) -> bool:
+        """Whether pickling sends a reference to the backing file or shared memory instead of the spike times."""
+        return self._source is not None
+
+    def __enter__(self) -> "SpikeTimes":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __reduce__(self):
+        if self._source is None:
+            return SpikeTimes, (np.asarray(self.data), np.asarray(self.index))
+        return _reopen_spike_times, (self._source, self._unit_start, self._unit_stop)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[np.ndarray, "SpikeTimes"]:
+        """Return one unit's spike times, or a range of units, as views without copying."""
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError("Only contiguous ranges of units can be viewed without copying")
+            stop = max(start, stop)
+            view = SpikeTimes.__new__(SpikeTimes)
+            view.__dict__.update(self.__dict__)
+            view._owner, view._is_view = False, True
+            first_spike = int(self.index[start - 1]) if start > 0 else 0
+            last_spike = int(self.index[stop - 1]) if stop > start else first_spike
+            view.data = self.data[first_spike:last_spike]
+            view.index = np.asarray(self.index[start:stop], dtype=np.int64) - first_spike
+            view._unit_start, view._unit_stop = self._unit_start + start, self._unit_start + stop
+            return view
+
+        unit_idx = int(key)
+        if unit_idx < 0:
+            unit_idx += len(self)
+        if not 0 <= unit_idx < len(self):
+            raise IndexError(f"unit index {key} out of range for {len(self)} units")
+        start = self.index[unit_idx - 1] if unit_idx > 0 else 0
+        return self.data[start:self.index[unit_idx]]
+
+    def __iter__(self):
+        for unit_idx in range(len(self)):
+            yield self[unit_idx]
+
+
+def get_ragged_arrays(units_spike_times) -> Tuple[Sequence[float], np.ndarray]:
+    """
+    Return the flat spike times and end offsets of a ragged spike_times column.
+
+    Parameters
+    ----------
+    units_spike_times : VectorIndex, SpikeTimes or list of arrays
+        Either units["spike_times"] from an NWB units table or a SpikeTimes,
+        whose flat data and index are used directly (the flat data is not
+        read here), or a list with one array of spike times per unit.
+
+    Returns
+    -------
+    flat_spike_times : array-like
+        All units' spike times concatenated; an HDF5 dataset for NWB input
+    index : np.ndarray
+        End offset of each unit's spike times in flat_spike_times
+    """
+    if isinstance(units_spike_times, SpikeTimes):
+        return units_spike_times.data, np.asarray(units_spike_times.index, dtype=np.int64)
+    if hasattr(units_spike_times, "target") and hasattr(units_spike_times, "data"):
+        return units_spike_times.target.data, np.asarray(units_spike_times.data[:], dtype=np.int64)
+    lengths = [len(spike_times) for spike_times in units_spike_times]
+    flat_spike_times = np.concatenate([np.asarray(spike_times, dtype=np.float64) for spike_times in units_spike_times])
+    return flat_spike_times, np.cumsum(lengths, dtype=np.int64)
+
+
+def _find_windows(
+    chunk_spikes: np.ndarray, lengths: np.ndarray, window_starts: np.ndarray, window_ends: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Locate every window in the spike times of a chunk of units with one searchsorted.
+
+    Each unit is given a disjoint range [k * span, (k + 1) * span), so that the
+    concatenated spike times of the chunk stay sorted. Returns the positions in
+    chunk_spikes of the first spike at or after each window start and each
+    window end, flattened in (unit, window) order.
+    """
+    low = min(window_starts.min(), chunk_spikes.min(initial=0)) - 1
+    high = max(window_ends.max(), chunk_spikes.max(initial=0)) + 1
+    span = high - low
+    unit_offsets = np.arange(len(lengths)) * span - low
+    keys = chunk_spikes + np.repeat(unit_offsets, lengths)
+
+    first = np.searchsorted(keys, (unit_offsets[:, np.newaxis] + window_starts).ravel())
+    last = np.searchsorted(keys, (unit_offsets[:, np.newaxis] + window_ends).ravel())
+    return first, last
+
+
+def get_window_counts(
+    window_starts: Sequence[float],
+    window_ends: Sequence[float],
+    units_spike_times,
+    unit_chunk_size: int = 256,
+) -> np.ndarray:
+    """
+    Count each unit's spikes in each of a set of time windows.
+
+    Parameters
+    ----------
+    window_starts, window_ends : array-like
+        Start (inclusive) and end (exclusive) time of each window in seconds
+    units_spike_times : VectorIndex or list of arrays
+        units["spike_times"] from an NWB file, or one sorted array of spike
+        times per unit
+    unit_chunk_size : int, optional
+        Number of units searched at once
+
+    Returns
+    -------
+    counts : np.ndarray
+        Spike counts with shape (units, windows)
+    """
+    window_starts = np.asarray(window_starts, dtype=np.float64)
+    window_ends = np.asarray(window_ends, dtype=np.float64)
+    flat_spike_times, index = get_ragged_arrays(units_spike_times)
+    n_units, n_windows = len(index), len(window_starts)
+    starts = np.concatenate([[0], index[:-1]])
+
+    counts = np.zeros((n_units, n_windows), dtype=np.int64)
+    if n_units == 0 or n_windows == 0:
+        return counts
+
+    origin = window_starts.min()
+    window_starts, window_ends = window_starts - origin, window_ends - origin
+    for chunk_start in range(0, n_units, unit_chunk_size):
+        chunk_end = min(chunk_start + unit_chunk_size, n_units)
+        flat_start, flat_end = starts[chunk_start], index[chunk_end - 1]
+        chunk_spikes = np.asarray(flat_spike_times[flat_start:flat_end], dtype=np.float64) - origin
+        lengths = index[chunk_start:chunk_end] - starts[chunk_start:chunk_end]
+        first, last = _find_windows(chunk_spikes, lengths, window_starts, window_ends)
+        counts[chunk_start:chunk_end] = (last - first).reshape(chunk_end - chunk_start, n_windows)
+    return counts
+
+
+def get_spike_matrix(
+    stim_times: Sequence[float],
+    units_spike_times,
+    bin_edges: Sequence[float],
+    unit_chunk_size: int = 256,
+    dtype=np.float64,
+    out: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Count each unit's spikes in time bins around each stimulus onset.
+
+    Computes the same units x trials x bins tensor as get_spike_matrix in
+    test_unit_responses.ipynb without Python loops over units or trials.
+    Each unit's spike times are shifted into their own disjoint time range,
+    so that a single searchsorted over the flat spike_times data locates
+    the window of every trial for a whole chunk of units. The spikes in all
+    windows are then binned and counted at once with bincount.
+
+    Parameters
+    ----------
+    stim_times : array-like
+        Stimulus onset times in seconds
+    units_spike_times : VectorIndex or list of arrays
+        units["spike_times"] from an NWB file, or one sorted array of spike
+        times per unit
+    bin_edges : array-like
+        Bin edges in seconds relative to each stimulus onset
+    unit_chunk_size : int, optional
+        Number of units processed at once, bounding the temporary memory to
+        roughly unit_chunk_size x trials x bins x 8 bytes plus the spikes
+        that fall in the chunk's windows.
+    dtype : numpy dtype, optional
+        dtype of the returned counts, e.g. np.float32 or np.int16 to keep
+        memory small. Defaults to float64, as in the notebook.
+    out : np.ndarray, optional
+        Preallocated (units x trials x bins) array, e.g. a np.memmap, to
+        write the counts into.
+
+    Returns
+    -------
+    spike_matrix : np.ndarray
+        Spike counts with shape (units, trials, bins)
+    """
+    stim_times = np.asarray(stim_times, dtype=np.float64)
+    bin_edges = np.asarray(bin_edges, dtype=np.float64)
+    flat_spike_times, index = get_ragged_arrays(units_spike_times)
+    n_units = len(index)
+    starts = np.concatenate([[0], index[:-1]])
+
+    shape = (n_units, len(stim_times), len(bin_edges) - 1)
+    if out is None:
+        out = np.zeros(shape, dtype=dtype)
+    elif out.shape != shape:
+        raise ValueError(f"out has shape {out.shape}, expected {shape}")
+    if n_units == 0 or len(stim_times) == 0 or len(bin_edges) < 2:
+        return out
+
+    n_trials, n_bins = len(stim_times), len(bin_edges) - 1
+    # window bounds of every trial, relative to the earliest one
+    window_starts = stim_times + bin_edges[0]
+    window_ends = stim_times + bin_edges[-1]
+    origin = window_starts.min()
+    window_starts, window_ends = window_starts - origin, window_ends - origin
+    relative_edges = bin_edges - bin_edges[0]
+
+    for chunk_start in range(0, n_units, unit_chunk_size):
+        chunk_end = min(chunk_start + unit_chunk_size, n_units)
+        n_chunk = chunk_end - chunk_start
+        flat_start, flat_end = starts[chunk_start], index[chunk_end - 1]
+        chunk_spikes = np.asarray(flat_spike_times[flat_start:flat_end], dtype=np.float64) - origin
+
+        lengths = index[chunk_start:chunk_end] - starts[chunk_start:chunk_end]
+        first, last = _find_windows(chunk_spikes, lengths, window_starts, window_ends)
+
+        # gather the spikes of every (unit, trial) window and bin them relative to its start
+        n_in_window = last - first
+        window_ids = np.repeat(np.arange(n_chunk * n_trials), n_in_window)
+        window_first = np.repeat(first - (np.cumsum(n_in_window) - n_in_window), n_in_window)
+        spike_idx = window_first + np.arange(len(window_ids))
+        relative_times = chunk_spikes[spike_idx] - window_starts[window_ids % n_trials]
+        bin_idx = np.searchsorted(relative_edges, relative_times, side="right") - 1
+        np.clip(bin_idx, 0, n_bins - 1, out=bin_idx)
+
+        counts = np.bincount(window_ids * n_bins + bin_idx, minlength=n_chunk * n_trials * n_bins)
+        out[chunk_start:chunk_end] = counts.reshape(n_chunk, n_trials, n_bins)
+
+    return out
+
+
+def _get_spike_matrix_loop(stim_times, units_spike_times, bin_edges) -> np.ndarray:
+    """Reference implementation copied from test_unit_responses.ipynb, used by benchmark_spike_matrix."""
+    time_resolution = np.mean(np.diff(bin_edges))
+    spike_matrix = np.zeros((len(units_spike_times), len(stim_times), len(bin_edges)-1))
+
+    for unit_idx in range(len(units_spike_times)):
+        spike_times = units_spike_times[unit_idx]
+
+        for stim_idx, stim_time in enumerate(stim_times):
+            first_bin_time = stim_time + bin_edges[0]
+            last_bin_time = stim_time + bin_edges[-1]
+            first_spike_in_range, last_spike_in_range = np.searchsorted(spike_times, [first_bin_time, last_bin_time])
+            spike_times_in_range = spike_times[first_spike_in_range:last_spike_in_range]
+
+            bin_indices = ((spike_times_in_range - (first_bin_time)) / time_resolution).astype(int)
+
+            for bin_idx in bin_indices:
+                spike_matrix[unit_idx, stim_idx, bin_idx] += 1
+
+    return spike_matrix
+
+
+def benchmark_spike_matrix(stim_times, units_spike_times, bin_edges, **kwargs) -> dict:
+    """
+    Time get_spike_matrix against the notebook's nested-loop implementation.
+
+    Parameters
+    ----------
+    stim_times, units_spike_times, bin_edges
+        As for get_spike_matrix. A list of per-unit arrays avoids timing HDF5 reads.
+    **kwargs
+        Passed to get_spike_matrix, e.g. unit_chunk_size or dtype
+
+    Returns
+    -------
+    dict
+        Seconds taken by each implementation, the speedup, and the fraction
+        of counts that differ (only spikes within rounding error of a bin
+        edge can be binned differently).
+    """
+    t0 = time.perf_counter()
+    loop_matrix = _get_spike_matrix_loop(stim_times, units_spike_times, bin_edges)
+    loop_seconds = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    vectorized_matrix = get_spike_matrix(stim_times, units_spike_times, bin_edges, **kwargs)
+    vectorized_seconds = time.perf_counter() - t0
+
+    return {
+        "loop_seconds": loop_seconds,
+        "vectorized_seconds": vectorized_seconds,
+        "speedup": loop_seconds / vectorized_seconds,
+        "mismatch_fraction": float(np.mean(loop_matrix != vectorized_matrix)),
+    }
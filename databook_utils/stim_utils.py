@@ -0,0 +1,131 @@
+import weakref
+
+import numpy as np
+
+from typing import Callable
+
+
+class StimulusTable:
+    """
+    Column-wise view of an NWB intervals table for vectorized trial selection.
+
+    Indexing an NWB intervals table row by row (stim_table[i] or iterating
+    over its rows) builds a DataFrame for every row. This class instead reads
+    each needed column once as a NumPy array, caches it, and evaluates
+    selections as boolean masks over whole columns.
+
+    Parameters
+    ----------
+    stim_table : TimeIntervals or DynamicTable
+        An intervals table, e.g. nwb.intervals["gabors_presentations"]
+    """
+
+    def __init__(self, stim_table):
+        self.stim_table = stim_table
+        self._columns = {}
+
+    def __len__(self) -> int:
+        return len(self.stim_table)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        """Return a column as a NumPy array, reading and decoding it only on first access."""
+        if name not in self._columns:
+            self._columns[name] = self._read_column(name)
+        return self._columns[name]
+
+    def _read_column(self, name: str) -> np.ndarray:
+        column = self.stim_table[name]
+        # ragged columns (e.g. tags, timeseries) come back as a VectorIndex
+        if hasattr(column, "target"):
+            values = np.empty(len(column), dtype=object)
+            values[:] = [np.asarray(row_values) for row_values in column[:]]
+            return values
+        values = np.asarray(column.data[:])
+        if values.dtype.kind in ("S", "O") and len(values) and isinstance(values[0], bytes):
+            values = np.char.decode(values.astype(bytes), "utf-8").astype(object)
+        return values
+
+    def mask(self, predicate: Callable = None, **equals) -> np.ndarray:
+        """
+        Return a boolean mask of the rows matching a selection.
+
+        Parameters
+        ----------
+        predicate : Callable, optional
+            Called with this StimulusTable and returning a boolean array,
+            e.g. lambda t: (t["x_position"] == 40) & (t["y_position"] == 40)
+        **equals
+            Columns that must equal a value, e.g. x_position=40, y_position=40
+
+        Returns
+        -------
+        np.ndarray
+            Boolean array with one element per row
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if predicate is not None:
+            mask &= np.asarray(predicate(self), dtype=bool)
+        for name, value in equals.items():
+            mask &= self[name] == value
+        return mask
+
+    def select(self, predicate: Callable = None, column: str = "start_time", **equals) -> np.ndarray:
+        """
+        Return the values of a column for the rows matching a selection.
+
+        Equivalent to the notebooks' [float(stim_table[i].start_time) for i in
+        range(len(stim_table)) if stim_select(stim_table[i])], with the row
+        predicate written over whole columns (see mask).
+        """
+        return self[column][self.mask(predicate, **equals)]
+
+    def clear(self) -> None:
+        """Drop all cached columns."""
+        self._columns.clear()
+
+
+# StimulusTable per intervals table, keyed by id since NWB containers are not hashable
+_stimulus_tables = {}
+
+
+def get_stimulus_table(stim_table) -> StimulusTable:
+    """
+    Return the shared StimulusTable for an intervals table.
+
+    Decoded columns are cached for as long as the table itself is alive, so
+    repeated selections on the same table do not read the file again.
+    """
+    if isinstance(stim_table, StimulusTable):
+        return stim_table
+    key = id(stim_table)
+    if key not in _stimulus_tables:
+        # a proxy, so that the cache does not keep the table alive
+        _stimulus_tables[key] = StimulusTable(weakref.proxy(stim_table))
+        weakref.finalize(stim_table, _stimulus_tables.pop, key, None)
+    return _stimulus_tables[key]
+
+
+def select_stim_times(
+    stim_table, predicate: Callable = None, column: str = "start_time", **equals
+) -> np.ndarray:
+    """
+    Return the start times (or another column) of the rows of an intervals table matching a selection.
+
+    Parameters
+    ----------
+    stim_table : TimeIntervals, DynamicTable or StimulusTable
+        An intervals table, e.g. nwb.intervals["gabors_presentations"]
+    predicate : Callable, optional
+        Called with the table's StimulusTable and returning a boolean array,
+        e.g. lambda t: (t["x_position"] == 40) & (t["y_position"] == 40)
+    column : str, optional
+        Column to return. Defaults to "start_time".
+    **equals
+        Columns that must equal a value, e.g. x_position=40, y_position=40
+
+    Returns
+    -------
+    np.ndarray
+        The selected values, in table order
+    """
+    return get_stimulus_table(stim_table).select(predicate, column=column, **equals)
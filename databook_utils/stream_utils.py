@@ -0,0 +1,248 @@
+import io
+import os
+import requests
+import threading
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Union
+
+
+def get_remote_size(session: requests.Session, url: str) -> int:
+    """Return the size of a remote file using a one-byte range request."""
+    # a ranged GET rather than HEAD, since presigned S3 URLs are only signed for GET
+    result = session.get(url, headers={"Range": "bytes=0-0"}, stream=True)
+    result.raise_for_status()
+    content_range = result.headers.get("Content-Range")
+    result.close()
+    if result.status_code != 206 or content_range is None:
+        raise IOError(f"Server for {url} does not support HTTP range requests")
+    return int(content_range.split("/")[-1])
+
+
+class BlockCache:
+    """
+    Block store shared by streamed remote files.
+
+    Remote files are read in fixed-size blocks that are kept in an in-memory
+    LRU and, optionally, in an on-disk tier that persists across sessions.
+    When a file is read sequentially, the blocks that follow a miss are
+    fetched in the same request (read-ahead). Hit, miss and byte counters
+    are kept in the stats dictionary to help tune these settings.
+
+    Parameters
+    ----------
+    block_size : int, optional
+        Size of each cached block in bytes. Defaults to 1MB.
+    max_memory_bytes : int, optional
+        Byte budget of the in-memory LRU. Defaults to 512MB.
+    disk_dir : str or Path, optional
+        Directory for the on-disk tier. Disabled when not given.
+    read_ahead : int, optional
+        Number of extra blocks fetched after a sequential miss. Defaults to 4.
+    """
+
+    def __init__(
+        self,
+        block_size: int = 1024 * 1024,
+        max_memory_bytes: int = 512 * 1024 * 1024,
+        disk_dir: Union[str, Path] = None,
+        read_ahead: int = 4,
+    ):
+        self.block_size = block_size
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_dir = None if disk_dir is None else str(disk_dir)
+        self.read_ahead = read_ahead
+
+        self._blocks = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "requests": 0,
+            "bytes_fetched": 0,
+            "read_ahead_blocks": 0,
+        }
+
+    def reset_stats(self) -> None:
+        for name in self.stats:
+            self.stats[name] = 0
+
+    def _disk_path(self, key: str, index: int) -> str:
+        return os.path.join(self.disk_dir, key, str(self.block_size), f"{index}.blk")
+
+    def get(self, key: str, index: int) -> Union[bytes, None]:
+        """Return a cached block from memory or disk, or None if it is not cached."""
+        with self._lock:
+            block = self._blocks.get((key, index))
+            if block is not None:
+                self._blocks.move_to_end((key, index))
+                self.stats["hits"] += 1
+                return block
+
+        if self.disk_dir is not None:
+            try:
+                with open(self._disk_path(key, index), "rb") as fp:
+                    block = fp.read()
+            except FileNotFoundError:
+                block = None
+            if block is not None:
+                self.stats["disk_hits"] += 1
+                self._put_memory(key, index, block)
+                return block
+
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, key: str, index: int, block: bytes) -> None:
+        """Store a block in memory and, if enabled, on disk."""
+        self._put_memory(key, index, block)
+        if self.disk_dir is not None:
+            disk_path = self._disk_path(key, index)
+            os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+            # write then rename, so that concurrent sessions never read a partial block
+            tmp_path = f"{disk_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as fp:
+                fp.write(block)
+            os.replace(tmp_path, disk_path)
+
+    def _put_memory(self, key: str, index: int, block: bytes) -> None:
+        with self._lock:
+            previous = self._blocks.pop((key, index), None)
+            if previous is not None:
+                self._memory_bytes -= len(previous)
+            self._blocks[(key, index)] = block
+            self._memory_bytes += len(block)
+            while self._memory_bytes > self.max_memory_bytes and len(self._blocks) > 1:
+                _, evicted = self._blocks.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+
+class BlockCacheFile(io.RawIOBase):
+    """
+    Read-only, seekable file object over HTTP range requests backed by a BlockCache.
+
+    Can be passed to h5py.File in place of remfile.File.
+
+    Parameters
+    ----------
+    url : str
+        Direct URL of the remote file
+    cache : BlockCache, optional
+        Block store to read through. A new one with default settings is
+        created if not given.
+    key : str, optional
+        Stable identifier of the file's content (e.g. the DANDI asset id),
+        used to find its blocks in the on-disk tier. Defaults to the URL,
+        which is not stable for presigned URLs.
+    size : int, optional
+        Size of the remote file in bytes. Queried from the server if not given.
+    session : requests.Session, optional
+        Session used for the range requests. A new one is created if not given.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        cache: BlockCache = None,
+        key: str = None,
+        size: int = None,
+        session: requests.Session = None,
+    ):
+        super().__init__()
+        self.url = url
+        self.cache = BlockCache() if cache is None else cache
+        self.key = url if key is None else key
+        self.session = requests.Session() if session is None else session
+        self.size = get_remote_size(self.session, url) if size is None else size
+        self._pos = 0
+        self._last_block = None
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence value {whence}")
+        return self._pos
+
+    def _fetch_blocks(self, first: int, last: int) -> dict:
+        """Fetch blocks first..last (inclusive) in one range request, cache and return them."""
+        block_size = self.cache.block_size
+        start = first * block_size
+        end = min((last + 1) * block_size, self.size) - 1
+        result = self.session.get(self.url, headers={"Range": f"bytes={start}-{end}"})
+        result.raise_for_status()
+        data = result.content
+        if len(data) != end - start + 1:
+            raise IOError(f"Expected {end - start + 1} bytes from {self.url}, got {len(data)}")
+
+        self.cache.stats["requests"] += 1
+        self.cache.stats["bytes_fetched"] += len(data)
+        blocks = {}
+        for index in range(first, last + 1):
+            offset = (index - first) * block_size
+            blocks[index] = data[offset:offset + block_size]
+            self.cache.put(self.key, index, blocks[index])
+        return blocks
+
+    def _read_range(self, start: int, end: int) -> bytes:
+        """Return bytes [start, end) of the remote file, going through the block cache."""
+        block_size = self.cache.block_size
+        first = start // block_size
+        last = (end - 1) // block_size
+        n_blocks = (self.size + block_size - 1) // block_size
+
+        blocks = {}
+        missing = []
+        for index in range(first, last + 1):
+            block = self.cache.get(self.key, index)
+            if block is None:
+                missing.append(index)
+            else:
+                blocks[index] = block
+
+        # coalesce runs of missing blocks into single requests
+        runs = []
+        for index in missing:
+            if runs and index == runs[-1][1] + 1:
+                runs[-1][1] = index
+            else:
+                runs.append([index, index])
+
+        sequential = self._last_block is not None and first in (self._last_block, self._last_block + 1)
+        for run_index, (run_first, run_last) in enumerate(runs):
+            if sequential and run_index == len(runs) - 1 and run_last == last:
+                extended = min(run_last + self.cache.read_ahead, n_blocks - 1)
+                self.cache.stats["read_ahead_blocks"] += extended - run_last
+                run_last = extended
+            blocks.update(self._fetch_blocks(run_first, run_last))
+        self._last_block = last
+
+        data = b"".join(blocks[index] for index in range(first, last + 1))
+        offset = first * block_size
+        return data[start - offset:end - offset]
+
+    def readinto(self, buffer) -> int:
+        start = self._pos
+        end = min(start + len(buffer), self.size)
+        if end <= start:
+            return 0
+        data = self._read_range(start, end)
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
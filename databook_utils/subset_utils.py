@@ -0,0 +1,390 @@
+import posixpath
+
+import h5py
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterator, Sequence, Union
+
+
+# copied into every subset, along with the root datasets (identifier, session_start_time, ...),
+# so that the subset is still a valid NWB file and carries its cached namespaces
+REQUIRED_PATHS = ("/general", "/specifications")
+# groups that the NWB schema requires, created empty when nothing inside them is selected
+REQUIRED_GROUPS = (
+    "/acquisition", "/analysis", "/processing", "/stimulus", "/stimulus/presentation", "/stimulus/templates",
+)
+
+# adjacent chunks are fetched in one request of up to this many bytes,
+# reading through gaps of up to _MAX_GAP_BYTES between them
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+_MAX_GAP_BYTES = 64 * 1024
+
+
+def _normalize_path(path: str) -> str:
+    return "/" + str(path).strip("/")
+
+
+def _is_within(path: str, selected) -> bool:
+    """Return True if path is one of the selected paths or below one of them."""
+    return any(
+        selected_path == "/" or path == selected_path or path.startswith(selected_path + "/")
+        for selected_path in selected
+    )
+
+
+def _get_ancestors(path: str) -> list:
+    parts = path.strip("/").split("/")
+    return ["/" + "/".join(parts[:depth]) for depth in range(1, len(parts))]
+
+
+def _has_references(dtype: np.dtype) -> bool:
+    if dtype.names is not None:
+        return any(_has_references(dtype.fields[name][0]) for name in dtype.names)
+    return h5py.check_dtype(ref=dtype) is not None
+
+
+def _is_fixed_size(dtype: np.dtype) -> bool:
+    """Return True if a dtype's values are stored inline, so that its raw chunks can be copied between files."""
+    if dtype.names is not None:
+        return all(_is_fixed_size(dtype.fields[name][0]) for name in dtype.names)
+    return dtype.kind != "O" and h5py.check_dtype(vlen=dtype) is None
+
+
+def _iter_references(value, dtype: np.dtype) -> Iterator:
+    """Yield every non-null reference in a value read from an attribute or dataset of dtype."""
+    if dtype.names is not None:
+        for name in dtype.names:
+            field_dtype = dtype.fields[name][0]
+            if _has_references(field_dtype):
+                yield from _iter_references(value[name], field_dtype)
+        return
+    for ref in np.asarray(value, dtype=object).ravel():
+        if ref:
+            yield ref
+
+
+def _remap_references(value, dtype: np.dtype, src: h5py.File, dst: h5py.File):
+    """Return value with each reference into src replaced by one to the object at the same path in dst."""
+    if dtype.names is not None:
+        value = np.array(value, copy=True)
+        for name in dtype.names:
+            field_dtype = dtype.fields[name][0]
+            if _has_references(field_dtype):
+                value[name] = _remap_references(value[name], field_dtype, src, dst)
+        return value
+
+    refs = np.asarray(value, dtype=object)
+    remapped = np.empty(refs.shape, dtype=object)
+    for idx, ref in np.ndenumerate(refs):
+        if not ref:
+            remapped[idx] = ref
+        elif isinstance(ref, h5py.RegionReference):
+            target_name = src[ref].name.encode()
+            region = h5py.h5r.get_region(ref, src.id)
+            remapped[idx] = h5py.h5r.create(dst.id, target_name, h5py.h5r.DATASET_REGION, region)
+        else:
+            remapped[idx] = dst[src[ref].name].ref
+    return remapped if refs.ndim else remapped[()]
+
+
+def _get_linked_paths(src: h5py.File, path: str) -> set:
+    """Return the paths that the attributes, reference data and soft links at or below path point to."""
+    linked = set()
+
+    def add_references(obj) -> None:
+        for name in obj.attrs:
+            attr_dtype = obj.attrs.get_id(name).dtype
+            if _has_references(attr_dtype):
+                linked.update(src[ref].name for ref in _iter_references(obj.attrs[name], attr_dtype))
+        if isinstance(obj, h5py.Dataset) and _has_references(obj.dtype):
+            linked.update(src[ref].name for ref in _iter_references(obj[()], obj.dtype))
+
+    def visit(group: h5py.Group) -> None:
+        for name in group:
+            link = group.get(name, getlink=True)
+            if isinstance(link, h5py.SoftLink):
+                linked.add(posixpath.normpath(posixpath.join(group.name, link.path)))
+            elif isinstance(link, h5py.HardLink):
+                obj = group[name]
+                add_references(obj)
+                if isinstance(obj, h5py.Group):
+                    visit(obj)
+
+    obj = src[path]
+    add_references(obj)
+    if isinstance(obj, h5py.Group):
+        visit(obj)
+    return linked
+
+
+def _get_enclosing_typed_path(src: h5py.File, path: str) -> str:
+    """
+    Return the path of the innermost NWB typed group at or above path, or path itself if there is none.
+
+    Copying part of a typed group, e.g. only the timestamps of a TimeSeries,
+    would leave it without its other required members.
+    """
+    for candidate in [path] + _get_ancestors(path)[::-1]:
+        obj = src[candidate]
+        if isinstance(obj, h5py.Group) and "neurodata_type" in obj.attrs:
+            return candidate
+    return path
+
+
+def get_subset_paths(src: h5py.File, include: Sequence[str]) -> list:
+    """
+    Return the paths that a subset of an NWB file copies whole.
+
+    These are the included paths, the REQUIRED_PATHS, and everything that they
+    refer to through object references or soft links, recursively, e.g. the
+    electrodes table and electrode groups referred to by the units table.
+    A path inside an NWB typed object, such as the timestamps of a TimeSeries,
+    is replaced by that whole object, so no typed group is left part-copied.
+    """
+    selected = set()
+    for path in include:
+        path = _normalize_path(path)
+        if path not in src:
+            raise KeyError(f"{path} not found in {src.filename}")
+        selected.add(_get_enclosing_typed_path(src, path))
+    selected.update(path for path in REQUIRED_PATHS if path in src)
+
+    pending = list(selected)
+    while pending:
+        for target in _get_linked_paths(src, pending.pop()):
+            target = _get_enclosing_typed_path(src, target)
+            if not _is_within(target, selected):
+                selected.add(target)
+                pending.append(target)
+    # drop paths that are inside another selected path
+    return sorted(path for path in selected if not _is_within(path, selected - {path}))
+
+
+def _copy_attrs(src_obj, dst_obj, deferred: list) -> None:
+    for name in src_obj.attrs:
+        attr_id = src_obj.attrs.get_id(name)
+        value = src_obj.attrs[name]
+        if isinstance(value, h5py.Empty):
+            dst_obj.attrs[name] = value
+        elif _has_references(attr_id.dtype):
+            # written once every object the references may point to exists
+            deferred.append((dst_obj, name, value, attr_id))
+        else:
+            dst_obj.attrs.create(name, value, shape=attr_id.shape, dtype=attr_id.dtype)
+
+
+def _get_chunks(src_ds: h5py.Dataset) -> list:
+    """Return (chunk offset, filter mask, byte offset, size) of every stored chunk of a dataset."""
+    chunks = []
+    if hasattr(src_ds.id, "chunk_iter"):
+        src_ds.id.chunk_iter(
+            lambda info: chunks.append((info.chunk_offset, info.filter_mask, info.byte_offset, info.size))
+        )
+    else:
+        for index in range(src_ds.id.get_num_chunks()):
+            info = src_ds.id.get_chunk_info(index)
+            chunks.append((info.chunk_offset, info.filter_mask, info.byte_offset, info.size))
+    return chunks
+
+
+def _plan_dataset_copy(src_ds: h5py.Dataset, dst_ds: h5py.Dataset, part_size: int) -> list:
+    """
+    Return the byte ranges to copy a dataset's data with, as (offset, size, write) tuples.
+
+    Chunks are copied as stored, still compressed, with write_direct_chunk.
+    Contiguous data is copied in blocks of rows. Datasets whose data cannot be
+    copied as raw bytes are read and written through h5py right away, and
+    produce no ranges.
+    """
+    layout = src_ds.id.get_create_plist().get_layout()
+    if _is_fixed_size(src_ds.dtype) and layout == h5py.h5d.CHUNKED:
+        return [
+            (byte_offset, size, lambda data, chunk_offset=chunk_offset, filter_mask=filter_mask:
+                dst_ds.id.write_direct_chunk(chunk_offset, data, filter_mask))
+            for chunk_offset, filter_mask, byte_offset, size in _get_chunks(src_ds)
+            if size > 0
+        ]
+
+    storage_offset = src_ds.id.get_offset() if layout == h5py.h5d.CONTIGUOUS else None
+    if _is_fixed_size(src_ds.dtype) and storage_offset is not None and src_ds.ndim > 0 and src_ds.size > 0:
+        row_shape = src_ds.shape[1:]
+        row_bytes = int(np.prod(row_shape, dtype=np.int64)) * src_ds.dtype.itemsize
+        rows_per_part = max(1, part_size // max(row_bytes, 1))
+
+        def write_rows(data, start: int, stop: int) -> None:
+            dst_ds[start:stop] = np.frombuffer(data, dtype=src_ds.dtype).reshape((stop - start, *row_shape))
+
+        return [
+            (storage_offset + start * row_bytes, (stop - start) * row_bytes,
+                lambda data, start=start, stop=stop: write_rows(data, start, stop))
+            for start in range(0, src_ds.shape[0], rows_per_part)
+            for stop in [min(start + rows_per_part, src_ds.shape[0])]
+        ]
+
+    # compact, scalar, unallocated or variable-length data, e.g. the string columns of a table
+    if src_ds.id.get_storage_size() > 0:
+        dst_ds[()] = src_ds[()]
+    return []
+
+
+def _merge_ranges(ranges: list) -> list:
+    """Group (offset, size, write) ranges into requests of (offset, size, [(offset in request, size, write), ...])."""
+    requests = []
+    for offset, size, write in sorted(ranges, key=lambda byte_range: byte_range[0]):
+        if requests:
+            request_offset, request_size, parts = requests[-1]
+            end = request_offset + request_size
+            if 0 <= offset - end <= _MAX_GAP_BYTES and offset + size - request_offset <= MAX_REQUEST_BYTES:
+                parts.append((offset - request_offset, size, write))
+                requests[-1] = (request_offset, offset + size - request_offset, parts)
+                continue
+        requests.append((offset, size, [(0, size, write)]))
+    return requests
+
+
+def _file_range_reader(filename: Union[str, Path]) -> Callable[[int, int], bytes]:
+    def read_range(offset: int, size: int) -> bytes:
+        with open(filename, "rb") as fp:
+            fp.seek(offset)
+            return fp.read(size)
+
+    return read_range
+
+
+def copy_nwb_subset(
+    src: Union[str, Path, h5py.File],
+    dst_path: Union[str, Path],
+    include: Sequence[str],
+    read_range: Callable[[int, int], bytes] = None,
+    n_workers: int = 8,
+    part_size: int = 8 * 1024 * 1024,
+    show_progress: bool = False,
+) -> list:
+    """
+    Copy only some groups and datasets of an HDF5 NWB file into a new, smaller NWB file.
+
+    The result is a valid NWB file: the root datasets, /general and
+    /specifications are always copied, the groups required by the schema are
+    created (empty if nothing in them is selected), and objects that the
+    selection refers to through object references or soft links are copied
+    too (see get_subset_paths). Everything else, typically the raw movies,
+    LFP and other acquisition data, is left out.
+
+    Chunked datasets are copied chunk by chunk without decompressing, and
+    contiguous ones in blocks of rows. The bytes are fetched with read_range
+    from n_workers threads, merging adjacent chunks into one request, while
+    the calling thread writes them, since h5py serializes all HDF5 calls. For
+    a file being streamed from DANDI, read_range can fetch byte ranges from
+    S3 directly, so only the HDF5 metadata goes through the streamed file.
+
+    Parameters
+    ----------
+    src : str, Path or h5py.File
+        The NWB file to copy from, e.g. an h5py.File over a remfile or BlockCacheFile
+    dst_path : str or Path
+        Path of the NWB file to write; overwritten if it exists
+    include : list of str
+        HDF5 paths of the groups and datasets to copy, e.g. ["units", "intervals"]
+    read_range : Callable, optional
+        Called with (offset, size) to return that many bytes of the source file
+        from that offset. Must be thread-safe. Defaults to reading src's file
+        from disk, for a local src.
+    n_workers : int, optional
+        Number of threads calling read_range
+    part_size : int, optional
+        Approximate size in bytes of each block of rows read from contiguous datasets
+    show_progress : bool, optional
+        Whether to display a tqdm progress bar of the bytes copied
+
+    Returns
+    -------
+    list of str
+        The paths that were copied whole, including those pulled in by references
+    """
+    own_src = not isinstance(src, h5py.File)
+    if own_src:
+        src = h5py.File(src, "r")
+    if read_range is None:
+        read_range = _file_range_reader(src.filename)
+
+    try:
+        selected = get_subset_paths(src, include)
+        ancestors = set(REQUIRED_GROUPS)
+        for path in selected:
+            ancestors.update(_get_ancestors(path))
+
+        ranges = []
+        deferred_attrs = []
+        deferred_datasets = []
+
+        def copy_group(src_group: h5py.Group, dst_group: h5py.Group, whole: bool) -> None:
+            _copy_attrs(src_group, dst_group, deferred_attrs)
+            for name in src_group:
+                path = posixpath.join(src_group.name, name)
+                copied = whole or _is_within(path, selected)
+                link = src_group.get(name, getlink=True)
+                if isinstance(link, h5py.SoftLink):
+                    if copied:
+                        dst_group[name] = h5py.SoftLink(link.path)
+                    continue
+                if isinstance(link, h5py.ExternalLink):
+                    if copied:
+                        dst_group[name] = h5py.ExternalLink(link.filename, link.path)
+                    continue
+
+                src_obj = src_group[name]
+                if isinstance(src_obj, h5py.Group):
+                    if copied or path in ancestors:
+                        copy_group(src_obj, dst_group.create_group(name), copied)
+                elif copied or src_group.name == "/":
+                    dsid = h5py.h5d.create(
+                        dst_group.id, name.encode(), src_obj.id.get_type(), src_obj.id.get_space(),
+                        dcpl=src_obj.id.get_create_plist(),
+                    )
+                    dst_ds = h5py.Dataset(dsid)
+                    _copy_attrs(src_obj, dst_ds, deferred_attrs)
+                    if _has_references(src_obj.dtype):
+                        deferred_datasets.append((src_obj, dst_ds))
+                    else:
+                        ranges.extend(_plan_dataset_copy(src_obj, dst_ds, part_size))
+
+        with h5py.File(dst_path, "w") as dst:
+            copy_group(src, dst, False)
+
+            # references are remapped to the same paths in dst, which all exist by now
+            for dst_obj, name, value, attr_id in deferred_attrs:
+                dst_obj.attrs.create(
+                    name, _remap_references(value, attr_id.dtype, src, dst), shape=attr_id.shape, dtype=attr_id.dtype
+                )
+            for src_ds, dst_ds in deferred_datasets:
+                dst_ds[()] = _remap_references(src_ds[()], src_ds.dtype, src, dst)
+
+            from tqdm.notebook import tqdm
+
+            requests = _merge_ranges(ranges)
+            progress = tqdm(
+                total=sum(size for _, size, _ in requests), unit="B", unit_scale=True, unit_divisor=1024,
+                disable=not show_progress,
+            )
+            try:
+                with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                    # map fetches ahead in the pool while the results are written here in order;
+                    # requests are submitted in batches to bound the bytes held in memory
+                    batch_size = n_workers * 4
+                    for batch_start in range(0, len(requests), batch_size):
+                        batch = requests[batch_start:batch_start + batch_size]
+                        fetched = executor.map(lambda request: read_range(request[0], request[1]), batch)
+                        for (_, size, parts), data in zip(batch, fetched):
+                            if len(data) != size:
+                                raise IOError(f"Expected {size} bytes from read_range, got {len(data)}")
+                            for relative_offset, part_bytes, write in parts:
+                                write(data[relative_offset:relative_offset + part_bytes])
+                            progress.update(size)
+            finally:
+                progress.close()
+    finally:
+        if own_src:
+            src.close()
+    return selected
@@ -0,0 +1,118 @@
+import numpy as np
+
+from typing import Callable
+
+from databook_utils.stim_utils import StimulusTable
+
+
+# joined unit column -> the electrodes column it comes from
+ELECTRODE_COLUMNS = {
+    "location": "location",
+    "probe": "group_name",
+}
+
+
+class UnitTable(StimulusTable):
+    """
+    Column-wise view of an NWB units table, joined with the electrodes table.
+
+    Like StimulusTable, each column is read once as a whole array instead of
+    one units[column][unit_idx] access per unit. The "location" and "probe"
+    columns are looked up from each unit's peak channel in the electrodes
+    table with one vectorized search, replacing the channel_locations and
+    channel_probes dicts of the notebooks.
+
+    Parameters
+    ----------
+    units : Units or DynamicTable
+        The units table, e.g. nwb.units
+    electrodes : DynamicTable, optional
+        The electrodes table, e.g. nwb.electrodes. Required for the location and probe columns.
+    """
+
+    def __init__(self, units, electrodes=None):
+        super().__init__(units)
+        self.electrodes = StimulusTable(electrodes) if electrodes is not None else None
+
+    def _read_column(self, name: str) -> np.ndarray:
+        if name in ELECTRODE_COLUMNS and name not in self.stim_table.colnames:
+            return self._join_electrodes(ELECTRODE_COLUMNS[name])
+        if name == "isi_violations" and name not in self.stim_table.colnames:
+            # newer files name the column isi_violations_count
+            return super()._read_column("isi_violations_count")
+        return super()._read_column(name)
+
+    def _join_electrodes(self, electrodes_column: str) -> np.ndarray:
+        """Return an electrodes column's value at each unit's peak channel."""
+        if self.electrodes is None:
+            raise ValueError(f"The electrodes table is needed to look up '{electrodes_column}'")
+        if "peak_channel_id" not in self.stim_table.colnames:
+            raise ValueError("The units table has no peak_channel_id column to join the electrodes table on")
+        channel_ids = np.asarray(self.electrodes["id"])
+        order = np.argsort(channel_ids)
+        peak_channel_ids = np.asarray(self["peak_channel_id"])
+        positions = np.searchsorted(channel_ids, peak_channel_ids, sorter=order)
+        positions = np.minimum(positions, len(channel_ids) - 1)
+        rows = order[positions]
+        if not np.array_equal(channel_ids[rows], peak_channel_ids):
+            missing = np.unique(peak_channel_ids[channel_ids[rows] != peak_channel_ids])
+            raise KeyError(f"Peak channels not found in the electrodes table: {missing[:10].tolist()}")
+        return self.electrodes[electrodes_column][rows]
+
+    def quality_mask(self, snr: float = 1, isi_violations: float = 1, firing_rate: float = 0.1) -> np.ndarray:
+        """
+        Return a mask of the units passing the notebooks' recommended quality thresholds.
+
+        Units must have snr > snr, isi_violations < isi_violations and firing_rate > firing_rate.
+        A threshold of None skips that metric.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if snr is not None:
+            mask &= self["snr"] > snr
+        if isi_violations is not None:
+            mask &= self["isi_violations"] < isi_violations
+        if firing_rate is not None:
+            mask &= self["firing_rate"] > firing_rate
+        return mask
+
+
+def select_units(
+    units,
+    electrodes=None,
+    predicate: Callable = None,
+    quality: bool = True,
+    **equals,
+) -> np.ndarray:
+    """
+    Return the indices of the units matching quality and area criteria.
+
+    Replaces the notebooks' per-unit select_condition loop, e.g.
+    select_units(nwb.units, nwb.electrodes, location="VISam") or
+    select_units(nwb.units, predicate=lambda u: u["snr"] > 3, quality=False).
+
+    Parameters
+    ----------
+    units : Units, DynamicTable or UnitTable
+        The units table, e.g. nwb.units. Pass a UnitTable to reuse its
+        cached columns across selections.
+    electrodes : DynamicTable, optional
+        The electrodes table, needed to select on location or probe
+    predicate : Callable, optional
+        Called with the UnitTable and returning a boolean array,
+        e.g. lambda u: (u["snr"] > 1) & (u["probe"] == "probeC")
+    quality : bool, optional
+        If True, also require the recommended thresholds of UnitTable.quality_mask
+    **equals
+        Columns that must equal a value, e.g. location="VISam" or probe="probeC"
+
+    Returns
+    -------
+    selected_unit_idxs : np.ndarray
+        Indices into the units table of the selected units
+    """
+    if not isinstance(units, UnitTable):
+        units = UnitTable(units, electrodes)
+    mask = units.mask(predicate, **equals)
+    if quality:
+        mask &= units.quality_mask()
+    return np.flatnonzero(mask)